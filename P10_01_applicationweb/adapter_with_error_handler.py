@@ -11,6 +11,7 @@ from botbuilder.core import (
     TurnContext,
 )
 from botbuilder.schema import ActivityTypes, Activity
+import observability
 
 
 class AdapterWithErrorHandler(BotFrameworkAdapter):
@@ -54,3 +55,7 @@ class AdapterWithErrorHandler(BotFrameworkAdapter):
             await self._conversation_state.delete(context)
 
         self.on_turn_error = on_error
+
+    async def _authenticate_request(self, request: Activity, auth_header: str):
+        with observability.timed("auth"):
+            return await super()._authenticate_request(request, auth_header)
@@ -9,6 +9,7 @@ That demonstrates the following:
 - Handle user interruptions for such things as `Help` or `Cancel`.
 - Prompt for and validate requests for information from the user.
 """
+import os
 from http import HTTPStatus
 
 from aiohttp import web
@@ -17,6 +18,7 @@ from botbuilder.core import (
     BotFrameworkAdapterSettings,
     ConversationState,
     MemoryStorage,
+    TurnContext,
     UserState,
 )
 from botbuilder.core.integration import aiohttp_error_middleware
@@ -27,12 +29,16 @@ from botbuilder.integration.applicationinsights.aiohttp import (
     bot_telemetry_middleware,
 )
 
+import observability
 from config import DefaultConfig
 from dialogs import MainDialog, BookingDialog
 from bots import DialogAndWelcomeBot
+from bots.dialog_and_welcome_bot import CARDS_PATH
 
 from adapter_with_error_handler import AdapterWithErrorHandler
 from flight_booking_recognizer import FlightBookingRecognizer
+from helpers.card_cache import CardCache
+from sqlite_storage import SqliteStorage
 
 CONFIG = DefaultConfig()
 
@@ -40,10 +46,19 @@ CONFIG = DefaultConfig()
 # See https://aka.ms/about-bot-adapter to learn more about how bots work.
 SETTINGS = BotFrameworkAdapterSettings(CONFIG.APP_ID, CONFIG.APP_PASSWORD)
 
-# Create MemoryStorage, UserState and ConversationState
-MEMORY = MemoryStorage()
-USER_STATE = UserState(MEMORY)
-CONVERSATION_STATE = ConversationState(MEMORY)
+# Create Storage, UserState and ConversationState
+# State is persisted in SQLite so that it survives restarts and can be shared by several workers.
+if CONFIG.STATE_STORAGE_PATH:
+    # A relative path does not depend on the directory the bot is started from.
+    STORAGE = SqliteStorage(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), CONFIG.STATE_STORAGE_PATH),
+        CONFIG.STATE_STORAGE_SHARDS,
+        CONFIG.STATE_TTL,
+    )
+else:
+    STORAGE = MemoryStorage()
+USER_STATE = UserState(STORAGE)
+CONVERSATION_STATE = ConversationState(STORAGE)
 
 # Create adapter.
 # See https://aka.ms/about-bot-adapter to learn more about how bots work.
@@ -59,26 +74,38 @@ TELEMETRY_CLIENT = ApplicationInsightsTelemetryClient(
 )
 
 # Create dialogs and Bot
-RECOGNIZER = FlightBookingRecognizer(CONFIG)
+RECOGNIZER = FlightBookingRecognizer(CONFIG, telemetry_client=TELEMETRY_CLIENT)
 BOOKING_DIALOG = BookingDialog()
 DIALOG = MainDialog(RECOGNIZER, BOOKING_DIALOG,
                     telemetry_client=TELEMETRY_CLIENT)
+WELCOME_CARDS = CardCache(CARDS_PATH, "welcomeCard", CONFIG.WELCOME_CARD_RELOAD_INTERVAL)
 BOT = DialogAndWelcomeBot(
-    CONVERSATION_STATE, USER_STATE, DIALOG, TELEMETRY_CLIENT)
+    CONVERSATION_STATE, USER_STATE, DIALOG, TELEMETRY_CLIENT, WELCOME_CARDS)
 
 
 # Listen for incoming requests on /api/messages.
 async def messages(req: Request) -> Response:
     # Main bot message handler.
-    if "application/json" in req.headers["Content-Type"]:
-        body = await req.json()
-    else:
-        return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
-
-    activity = Activity().deserialize(body)
-    auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
-
-    response = await ADAPTER.process_activity(activity, auth_header, BOT.on_turn)
+    with observability.timed("turn"):
+        if "application/json" in req.headers["Content-Type"]:
+            with observability.timed("parse"):
+                body = await req.json()
+        else:
+            return Response(status=HTTPStatus.UNSUPPORTED_MEDIA_TYPE)
+
+        with observability.timed("deserialize"):
+            activity = Activity().deserialize(body)
+        auth_header = req.headers["Authorization"] if "Authorization" in req.headers else ""
+
+        async def on_turn(turn_context: TurnContext):
+            # Once authenticated, answers to the intro prompt are sent to LUIS while the state is loaded.
+            prefetch = RECOGNIZER.prefetch(turn_context.activity)
+            if prefetch is not None:
+                turn_context.turn_state[FlightBookingRecognizer.PREFETCH_KEY] = prefetch
+            await BOT.on_turn(turn_context)
+
+        with observability.timed("process_activity"):
+            response = await ADAPTER.process_activity(activity, auth_header, on_turn)
     if response:
         return json_response(data=response.body, status=response.status)
     return Response(status=HTTPStatus.OK)
@@ -89,10 +116,18 @@ async def messages(req: Request) -> Response:
 # Update <Startup Command> with:
 # python3.8 -m aiohttp.web -H 0.0.0.0 -P 8000 app:init_func
 # Note : app(.py) is the name of the app
+# To use every core of the instance, run the pre-forked workers instead (see server.py):
+# python3.8 server.py --host 0.0.0.0 --port 8000
+
+async def close_recognizer(app: web.Application) -> None:
+    # Close the connections to LUIS when the application stops.
+    await RECOGNIZER.close()
+
 
 def init_func(argv):
     app = web.Application(middlewares=[bot_telemetry_middleware, aiohttp_error_middleware])
     app.router.add_post("/api/messages", messages)
+    app.on_cleanup.append(close_recognizer)
     return app
 
 if __name__ == "__main__":
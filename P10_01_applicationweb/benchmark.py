@@ -0,0 +1,320 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Replays conversations through the bot's aiohttp application and measures its performance.
+
+Conversations are synthesized from the LUIS training utterances (frames_train.json):
+each one greets the bot, sends a booking utterance then answers the bot's prompts until
+the booking is confirmed. Recorded conversations can be given instead, one JSON list of
+user texts per line, the prompts left unanswered at their end are answered the same way.
+
+The application built by app.init_func is served in-process. Activities are posted with
+the "expectReplies" delivery mode so the replies come back in the HTTP response and no
+channel is needed, and LUIS is replaced by a recognizer answering from the labels of the
+training utterances and telemetry is serialized but not sent, so that only the bot
+pipeline is measured.
+
+For each concurrency level, reports turns/sec, p50/p99 turn latency, memory blocks
+retained per turn and the peak RSS, and saves them as JSON to compare commits:
+
+python benchmark.py --levels 1 8 32 --output bench.json --baseline previous.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import uuid
+
+# The bot reads its configuration when imported: no authentication, no telemetry
+# exporter and in memory state unless told otherwise.
+os.environ.setdefault("MicrosoftAppId", "")
+os.environ.setdefault("MicrosoftAppPassword", "")
+os.environ.setdefault("AppInsightsInstrumentationCnx", "")
+os.environ.setdefault("StateStoragePath", "")
+
+# pylint: disable=wrong-import-position
+from aiohttp.test_utils import TestClient, TestServer
+from applicationinsights.channel import SynchronousSender
+from botbuilder.core import IntentScore, Recognizer, RecognizerResult, TurnContext
+
+FRAMES = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)),
+    "../P10_02_outils/tools/frames/frames_train.json",
+)
+DEPARTURE_DATE = "2022-05-01"
+RETURN_DATE = "2022-05-08"
+
+# Answers to the bot prompts, chosen by the first fragment found in the prompt.
+ANSWERS = [
+    ("Please confirm", "yes"),
+    ("In which city", "Paris"),
+    ("From which city", "London"),
+    ("departure date", DEPARTURE_DATE),
+    ("leave", DEPARTURE_DATE),
+    ("return", RETURN_DATE),
+    ("budget", "500"),
+]
+GREETING = "Hello"
+END_OF_CONVERSATION = "What else can I do for you?"
+MAX_TURNS = 12
+
+
+class StubRecognizer(Recognizer):
+    """Recognizer answering from the labels of the training utterances."""
+
+    def __init__(self, utterances: list):
+        self._results = {
+            utterance["text"]: self._result(utterance) for utterance in utterances
+        }
+
+    @property
+    def is_configured(self) -> bool:
+        return True
+
+    def expect_intro_answer(self, conversation_id: str) -> None:
+        pass
+
+    @staticmethod
+    def _result(utterance: dict) -> RecognizerResult:
+        text = utterance["text"]
+        entities = {"$instance": {}}
+        for label in utterance["entityLabels"]:
+            name = label["entityName"]
+            start, end = label["startCharIndex"], label["endCharIndex"]
+            if name == "end_date":
+                # Dates are resolved by LUIS, the stub uses fixed ones.
+                entities[name] = [RETURN_DATE]
+                continue
+            entities.setdefault(name, []).append(text[start:end].lower())
+            entities["$instance"].setdefault(name, []).append(
+                {"startIndex": start, "endIndex": end, "text": text[start:end], "type": name}
+            )
+        entities["datetime"] = [{"type": "date", "timex": [DEPARTURE_DATE]}]
+        return RecognizerResult(
+            text=text,
+            altered_text=None,
+            intents={utterance["intentName"]: IntentScore(1.0)},
+            entities=entities,
+        )
+
+    async def recognize(self, turn_context: TurnContext) -> RecognizerResult:
+        text = turn_context.activity.text
+        result = self._results.get(text)
+        if result is None:
+            return RecognizerResult(
+                text=text, altered_text=None, intents={"None": IntentScore(1.0)}, entities={}
+            )
+        return result
+
+
+class NullSender(SynchronousSender):
+    """Serializes telemetry like the Application Insights sender but does not send it."""
+
+    def send(self, data_to_send):
+        json.dumps([envelope.write() for envelope in data_to_send])
+
+
+def synthetic_conversations(utterances: list, count: int, seed: int) -> list:
+    """Returns the opening texts of each conversation, the bot prompts drive the rest."""
+    booking = [utterance["text"] for utterance in utterances if utterance["intentName"] == "book"]
+    rand = random.Random(seed)
+    return [[GREETING, rand.choice(booking)] for _ in range(count)]
+
+
+def recorded_conversations(filename: str) -> list:
+    """Returns the user texts of each conversation, one JSON list per line."""
+    with open(filename, encoding="utf-8") as conversations_file:
+        return [json.loads(line) for line in conversations_file if line.strip()]
+
+
+def answer(replies: list) -> str:
+    """Returns the answer to the last prompt of the bot, None at the end of the conversation."""
+    for reply in reversed(replies):
+        text = reply.get("text") or ""
+        if text == END_OF_CONVERSATION:
+            return None
+        for fragment, value in ANSWERS:
+            if fragment in text:
+                return value
+    return None
+
+
+class Replay:
+    """Posts the activities of conversations to the bot and times every turn."""
+
+    def __init__(self, client: TestClient):
+        self.client = client
+        self.latencies = []
+        self.errors = 0
+
+    async def post(self, conversation_id: str, activity: dict) -> list:
+        activity.update(
+            {
+                "id": uuid.uuid4().hex,
+                "channelId": "benchmark",
+                "serviceUrl": "http://localhost",
+                "deliveryMode": "expectReplies",
+                "from": {"id": "user"},
+                "recipient": {"id": "bot"},
+                "conversation": {"id": conversation_id},
+            }
+        )
+        start = time.perf_counter()
+        response = await self.client.post("/api/messages", json=activity)
+        body = await response.read()
+        self.latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            self.errors += 1
+            return []
+        return json.loads(body).get("activities", []) if body else []
+
+    async def converse(self, texts: list) -> None:
+        conversation_id = uuid.uuid4().hex
+        await self.post(
+            conversation_id,
+            {"type": "conversationUpdate", "membersAdded": [{"id": "user"}]},
+        )
+        texts = list(texts)
+        text = texts.pop(0)
+        for _ in range(MAX_TURNS):
+            replies = await self.post(conversation_id, {"type": "message", "text": text})
+            text = texts.pop(0) if texts else answer(replies)
+            if text is None:
+                break
+
+    async def run(self, conversations: list, concurrency: int) -> None:
+        queue = asyncio.Queue()
+        for conversation in conversations:
+            queue.put_nowait(conversation)
+
+        async def worker():
+            while not queue.empty():
+                await self.converse(queue.get_nowait())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def percentile(values: list, quantile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+async def benchmark(args) -> dict:
+    """Runs the conversations at every concurrency level."""
+    import app  # pylint: disable=import-outside-toplevel
+
+    with open(args.frames, encoding="utf-8") as frames_file:
+        utterances = json.load(frames_file)
+    # pylint: disable=protected-access
+    app.DIALOG._luis_recognizer = StubRecognizer(utterances)
+    telemetry_queue = app.TELEMETRY_CLIENT._client.channel.queue
+    telemetry_queue._sender = NullSender()
+    telemetry_queue._sender.queue = telemetry_queue
+
+    if args.conversations:
+        conversations = recorded_conversations(args.conversations)
+    else:
+        conversations = synthetic_conversations(utterances, args.count, args.seed)
+
+    client = TestClient(TestServer(app.init_func(None)))
+    await client.start_server()
+    results = []
+    try:
+        # Warm up imports, caches and the connection pool.
+        await Replay(client).run(conversations[:4], 4)
+
+        for concurrency in args.levels:
+            replay = Replay(client)
+            gc.collect()
+            blocks = sys.getallocatedblocks()
+            start = time.perf_counter()
+            await replay.run(conversations, concurrency)
+            elapsed = time.perf_counter() - start
+            gc.collect()
+            turns = len(replay.latencies)
+            results.append(
+                {
+                    "concurrency": concurrency,
+                    "conversations": len(conversations),
+                    "turns": turns,
+                    "errors": replay.errors,
+                    "turns_per_sec": turns / elapsed,
+                    "p50_ms": percentile(replay.latencies, 0.50) * 1000,
+                    "p99_ms": percentile(replay.latencies, 0.99) * 1000,
+                    "retained_blocks_per_turn": (sys.getallocatedblocks() - blocks) / turns,
+                    # Kilobytes on Linux, bytes on macOS.
+                    "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                }
+            )
+            print(
+                "concurrency {concurrency:>4}: {turns_per_sec:8.1f} turns/s "
+                "p50 {p50_ms:7.2f} ms p99 {p99_ms:7.2f} ms "
+                "{retained_blocks_per_turn:8.1f} blocks/turn".format(**results[-1])
+            )
+    finally:
+        await client.close()
+
+    return {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """Prints the change of throughput and latency against a previous report."""
+    previous = {result["concurrency"]: result for result in baseline["results"]}
+    print(f"Compared to {baseline.get('commit') or 'baseline'}:")
+    for result in report["results"]:
+        old = previous.get(result["concurrency"])
+        if old is None:
+            continue
+        changes = [
+            f"{key} {100 * (result[key] - old[key]) / old[key]:+.1f}%"
+            for key in ("turns_per_sec", "p50_ms", "p99_ms")
+            if old[key]
+        ]
+        print(f"concurrency {result['concurrency']:>4}: " + ", ".join(changes))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Replay conversations through the bot")
+    parser.add_argument("--frames", default=FRAMES, help="LUIS utterances used by the stub recognizer")
+    parser.add_argument(
+        "--conversations", help="Recorded conversations, one JSON list of user texts per line"
+    )
+    parser.add_argument("--count", type=int, default=200, help="Number of synthetic conversations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 8, 32], help="Concurrency levels")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report")
+    parser.add_argument("--baseline", help="Previous JSON report to compare with")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    ARGS = parse_args(sys.argv[1:])
+    REPORT = asyncio.run(benchmark(ARGS))
+    with open(ARGS.output, "w", encoding="utf-8") as output_file:
+        json.dump(REPORT, output_file, indent=2)
+    if ARGS.baseline:
+        with open(ARGS.baseline, encoding="utf-8") as baseline_file:
+            compare(REPORT, json.load(baseline_file))
@@ -2,7 +2,6 @@
 # Licensed under the MIT License.
 
 """Main dialog to welcome users."""
-import json
 import os.path
 
 from typing import List
@@ -15,8 +14,11 @@ from botbuilder.core import (
 )
 from botbuilder.schema import Activity, Attachment, ChannelAccount
 from helpers.activity_helper import create_activity_reply
+from helpers.card_cache import CardCache
 from .dialog_bot import DialogBot
 
+CARDS_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), "../cards")
+
 
 class DialogAndWelcomeBot(DialogBot):
     """Main dialog to welcome users."""
@@ -27,11 +29,14 @@ class DialogAndWelcomeBot(DialogBot):
         user_state: UserState,
         dialog: Dialog,
         telemetry_client: BotTelemetryClient,
+        welcome_cards: CardCache = None,
     ):
         super(DialogAndWelcomeBot, self).__init__(
             conversation_state, user_state, dialog, telemetry_client
         )
         self.telemetry_client = telemetry_client
+        # The welcome card is read once here, greeting users does not touch the disk.
+        self.welcome_cards = welcome_cards or CardCache(CARDS_PATH, "welcomeCard")
 
     async def on_members_added_activity(
         self, members_added: List[ChannelAccount], turn_context: TurnContext
@@ -41,7 +46,9 @@ class DialogAndWelcomeBot(DialogBot):
             # To learn more about Adaptive Cards, see https://aka.ms/msbot-adaptivecards
             # for more details.
             if member.id != turn_context.activity.recipient.id:
-                welcome_card = self.create_adaptive_card_attachment()
+                welcome_card = self.create_adaptive_card_attachment(
+                    turn_context.activity.locale
+                )
                 response = self.create_response(turn_context.activity, welcome_card)
                 await turn_context.send_activity(response)
 
@@ -51,14 +58,7 @@ class DialogAndWelcomeBot(DialogBot):
         response.attachments = [attachment]
         return response
 
-    # Load attachment from file.
-    def create_adaptive_card_attachment(self):
+    # Attachment of the cached card, in the language of the user when available.
+    def create_adaptive_card_attachment(self, locale: str = None) -> Attachment:
         """Create an adaptive card."""
-        relative_path = os.path.abspath(os.path.dirname(__file__))
-        path = os.path.join(relative_path, "../cards/welcomeCard.json")
-        with open(path) as card_file:
-            card = json.load(card_file)
-
-        return Attachment(
-            content_type="application/vnd.microsoft.card.adaptive", content=card
-        )
+        return self.welcome_cards.attachment(locale)
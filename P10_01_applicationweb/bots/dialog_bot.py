@@ -2,6 +2,8 @@
 # Licensed under the MIT License.
 """Implements bot Activity handler."""
 
+from typing import List
+
 from botbuilder.core import (
     ActivityHandler,
     ConversationState,
@@ -11,6 +13,9 @@ from botbuilder.core import (
     NullTelemetryClient,
 )
 from botbuilder.dialogs import Dialog, DialogExtensions
+from botbuilder.schema import Activity, ResourceResponse
+
+import observability
 
 
 class DialogBot(ActivityHandler):
@@ -37,7 +42,22 @@ class DialogBot(ActivityHandler):
         self.dialog = dialog
         self.telemetry_client = telemetry_client
 
+    async def on_turn(self, turn_context: TurnContext):
+        turn_context.on_send_activities(self._time_send_activities)
+        await super().on_turn(turn_context)
+
+    @staticmethod
+    async def _time_send_activities(
+        turn_context: TurnContext, activities: List[Activity], next_send
+    ) -> List[ResourceResponse]:
+        with observability.timed("send_activity"):
+            return await next_send()
+
     async def on_message_activity(self, turn_context: TurnContext):
+        # Load the state up front so that storage latency is measured on its own.
+        with observability.timed("state_load"):
+            await self.conversation_state.load(turn_context)
+
         await DialogExtensions.run_dialog(
             self.dialog,
             turn_context,
@@ -45,8 +65,9 @@ class DialogBot(ActivityHandler):
         )
 
         # Save any state changes that might have occured during the turn.
-        await self.conversation_state.save_changes(turn_context, False)
-        await self.user_state.save_changes(turn_context, False)
+        with observability.timed("save_changes"):
+            await self.conversation_state.save_changes(turn_context, False)
+            await self.user_state.save_changes(turn_context, False)
 
     @property
     def telemetry_client(self) -> BotTelemetryClient:
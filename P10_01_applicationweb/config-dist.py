@@ -10,12 +10,49 @@ class DefaultConfig:
     """Configuration for the bot."""
 
     PORT = 3978
+    # Number of worker processes started by server.py
+    WEB_WORKERS = int(os.environ.get("WebWorkers", str(os.cpu_count() or 1)))
     APP_ID = os.environ.get("MicrosoftAppId", "")
     APP_PASSWORD = os.environ.get("MicrosoftAppPassword", "")
     LUIS_APP_ID = os.environ.get("LuisAppId", "")
     LUIS_API_KEY = os.environ.get("LuisAPIKey", "")
     # LUIS endpoint host name, ie "westus.api.cognitive.microsoft.com"
+    # or the local stand-in server (P10_02_outils/tools/luis_server.py), ie "http://localhost:8080"
     LUIS_API_HOST_NAME = os.environ.get("LuisAPIHostName", "")
+    # Cache of LUIS results for repeated inputs, a size of 0 disables it
+    LUIS_CACHE_SIZE = int(os.environ.get("LuisCacheSize", "1000"))
+    LUIS_CACHE_TTL = float(os.environ.get("LuisCacheTTL", "3600"))
+    # Seconds a turn waits for LUIS, including the wait for a free connection
+    LUIS_TIMEOUT = float(os.environ.get("LuisTimeout", "3"))
+    # Maximum number of concurrent LUIS calls (and of connections kept alive) per worker
+    LUIS_MAX_CONCURRENCY = int(os.environ.get("LuisMaxConcurrency", "32"))
+    # LUIS is not called for LuisBreakerReset seconds after LuisBreakerFailures consecutive failures,
+    # bookings are then made by prompting the user for each detail
+    LUIS_BREAKER_FAILURES = int(os.environ.get("LuisBreakerFailures", "5"))
+    LUIS_BREAKER_RESET = float(os.environ.get("LuisBreakerReset", "30"))
+    # Start recognizing the answer to the intro prompt once its turn is authenticated, before the state is loaded
+    LUIS_PREFETCH = os.environ.get("LuisPrefetch", "false").lower() == "true"
+    # Utterances explained by the local recognizer with at least this confidence skip LUIS,
+    # a value above 1.0 disables the local recognizer
+    LOCAL_RECOGNIZER_THRESHOLD = float(os.environ.get("LocalRecognizerThreshold", "1.0"))
+    # Seconds between checks of the welcome card files for changes, 0 loads them only at startup
+    WELCOME_CARD_RELOAD_INTERVAL = float(os.environ.get("WelcomeCardReloadInterval", "0"))
+    # Folder of the SQLite state databases, relative to the bot folder, an empty value keeps the state in memory
+    STATE_STORAGE_PATH = os.environ.get("StateStoragePath", "state")
+    STATE_STORAGE_SHARDS = int(os.environ.get("StateStorageShards", "4"))
+    # Abandoned conversations are removed after this number of seconds, 0 keeps them
+    STATE_TTL = float(os.environ.get("StateTTL", "86400"))
+    # Log records waiting to be exported, records are dropped when the queue is full
+    LOG_QUEUE_SIZE = int(os.environ.get("LogQueueSize", "10000"))
+    # Share of records below ERROR that are exported
+    LOG_SAMPLE_RATE = float(os.environ.get("LogSampleRate", "1.0"))
+    LOG_BATCH_SIZE = int(os.environ.get("LogBatchSize", "100"))
+    LOG_EXPORT_INTERVAL = float(os.environ.get("LogExportInterval", "15"))
+    # Interval in seconds over which turn stage percentiles are computed and exported
+    LATENCY_EXPORT_INTERVAL = float(os.environ.get("LatencyExportInterval", "60"))
     APPINSIGHTS_INSTRUMENTATION_KEY = os.environ.get(
         "AppInsightsInstrumentationKey", ""
     )
+    APPINSIGHTS_INSTRUMENTATION = os.environ.get(
+        "AppInsightsInstrumentationCnx", ""
+    )
@@ -12,6 +12,7 @@ from botbuilder.schema import InputHints
 from .cancel_and_help_dialog import CancelAndHelpDialog
 from .start_date_resolver_dialog import StartDateResolverDialog
 from .end_date_resolver_dialog import EndDateResolverDialog
+import observability
 
 def is_ambiguous(timex: str) -> bool:
     """Ensure time is correct."""
@@ -60,6 +61,7 @@ class BookingDialog(CancelAndHelpDialog):
 
         self.initial_dialog_id = WaterfallDialog.__name__
 
+    @observability.timed_step
     async def destination_step(
         self, step_context: WaterfallStepContext
     ) -> DialogTurnResult:
@@ -76,6 +78,7 @@ class BookingDialog(CancelAndHelpDialog):
 
         return await step_context.next(booking_details.destination)
 
+    @observability.timed_step
     async def origin_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         """Prompt for origin city."""
         booking_details = step_context.options
@@ -92,6 +95,7 @@ class BookingDialog(CancelAndHelpDialog):
 
         return await step_context.next(booking_details.origin)
 
+    @observability.timed_step
     async def departure_date_step(
         self, step_context: WaterfallStepContext
     ) -> DialogTurnResult:
@@ -110,6 +114,7 @@ class BookingDialog(CancelAndHelpDialog):
 
         return await step_context.next(booking_details.departure_date)
 
+    @observability.timed_step
     async def return_date_step(
         self, step_context: WaterfallStepContext
     ) -> DialogTurnResult:
@@ -129,6 +134,7 @@ class BookingDialog(CancelAndHelpDialog):
 
         return await step_context.next(booking_details.return_date)
 
+    @observability.timed_step
     async def budget_step(
         self, step_context: WaterfallStepContext
         ) -> DialogTurnResult:
@@ -146,6 +152,7 @@ class BookingDialog(CancelAndHelpDialog):
             )
         return await step_context.next(booking_details.budget)
 
+    @observability.timed_step
     async def confirm_step(
         self, step_context: WaterfallStepContext
     ) -> DialogTurnResult:
@@ -167,6 +174,7 @@ class BookingDialog(CancelAndHelpDialog):
             ConfirmPrompt.__name__, PromptOptions(prompt=MessageFactory.text(msg))
         )
 
+    @observability.timed_step
     async def final_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         """Complete the interaction and end the dialog."""
         if step_context.result:
@@ -21,16 +21,8 @@ from flight_booking_recognizer import FlightBookingRecognizer
 from helpers.luis_helper import LuisHelper, Intent
 from .booking_dialog import BookingDialog
 
-from config import DefaultConfig
-import logging
-from opencensus.ext.azure.log_exporter import AzureLogHandler
+import observability
 from datetime import datetime
-from opencensus.ext.azure import metrics_exporter
-from opencensus.stats import aggregation as aggregation_module
-from opencensus.stats import measure as measure_module
-from opencensus.stats import stats as stats_module
-from opencensus.stats import view as view_module
-from opencensus.tags import tag_map as tag_map_module
 
 class MainDialog(ComponentDialog):
     def __init__(
@@ -46,44 +38,8 @@ class MainDialog(ComponentDialog):
         text_prompt.telemetry_client = self.telemetry_client
 
         booking_dialog.telemetry_client = self.telemetry_client
-        self.logger = logging.getLogger(__name__)
-        configuration = DefaultConfig()
-        self.logger.addHandler(AzureLogHandler(connection_string=configuration.APPINSIGHTS_INSTRUMENTATION))
-
-        stats = stats_module.stats
-        view_manager = stats.view_manager
-        stats_recorder = stats.stats_recorder
-
-        self.accepted_measure = measure_module.MeasureInt("Accepted",
-                                           "number of accepted booking",
-                                           "Accepted")
-        accepted_view = view_module.View("Accepted Booking view",
-                               "number of Accepted booking",
-                               [],
-                               self.accepted_measure,
-                               aggregation_module.CountAggregation())
-        view_manager.register_view(accepted_view)
-
-        self.canceled_measure = measure_module.MeasureInt("Canceled",
-                                           "number of canceled booking",
-                                           "Canceled")
-        canceled_view = view_module.View("Canceled Booking view",
-                               "number of Canceled booking",
-                               [],
-                               self.canceled_measure,
-                               aggregation_module.CountAggregation())
-        view_manager.register_view(canceled_view)
-
-
-        self.accepted_mmap = stats_recorder.new_measurement_map()
-        self.tmap_accepted = tag_map_module.TagMap()
-
-        self.canceled_mmap = stats_recorder.new_measurement_map()
-        self.tmap_canceled = tag_map_module.TagMap()
-
-        configuration = DefaultConfig()
-        exporter = metrics_exporter.new_metrics_exporter(connection_string=configuration.APPINSIGHTS_INSTRUMENTATION)
-        view_manager.register_exporter(exporter)
+        self.logger = observability.get_logger(__name__)
+        observability.start()
 
         wf_dialog = WaterfallDialog(
             "WFDialog", [self.intro_step, self.act_step, self.final_step]
@@ -99,6 +55,7 @@ class MainDialog(ComponentDialog):
 
         self.initial_dialog_id = "WFDialog"
 
+    @observability.timed_step
     async def intro_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         if not self._luis_recognizer.is_configured:
             await step_context.context.send_activity(
@@ -119,10 +76,15 @@ class MainDialog(ComponentDialog):
             message_text, message_text, InputHints.expecting_input
         )
 
+        # The answer is recognized by act_step, it can be prefetched by app.messages.
+        self._luis_recognizer.expect_intro_answer(
+            step_context.context.activity.conversation.id
+        )
         return await step_context.prompt(
             TextPrompt.__name__, PromptOptions(prompt=prompt_message)
         )
 
+    @observability.timed_step
     async def act_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         if not self._luis_recognizer.is_configured:
             # LUIS is not configured, we just run the BookingDialog path with an empty BookingDetailsInstance.
@@ -162,14 +124,14 @@ class MainDialog(ComponentDialog):
 
         return await step_context.next(None)
 
+    @observability.timed_step
     async def final_step(self, step_context: WaterfallStepContext) -> DialogTurnResult:
         # If the child dialog ("BookingDialog") was cancelled or the user failed to confirm,
         # the Result here will be null.
         if step_context.result is not None:
             result = step_context.result
 
-            self.accepted_mmap.measure_int_put(self.accepted_measure, 1)
-            self.accepted_mmap.record(self.tmap_accepted)
+            observability.record_int(observability.ACCEPTED_MEASURE)
 
             departure_date = datetime.strptime(result.departure_date, "%Y-%m-%d").date()
             return_date = datetime.strptime(result.return_date, "%Y-%m-%d").date()
@@ -183,8 +145,7 @@ class MainDialog(ComponentDialog):
             await step_context.context.send_activity(message)
         else:
             self.logger.error("The dialog had been canceled or not confirmed by user")
-            self.canceled_mmap.measure_int_put(self.canceled_measure, 1)
-            self.canceled_mmap.record(self.tmap_canceled)
+            observability.record_int(observability.CANCELED_MEASURE)
 
 
         prompt_message = "What else can I do for you?"
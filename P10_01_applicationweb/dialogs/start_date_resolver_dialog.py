@@ -13,9 +13,7 @@ from botbuilder.dialogs.prompts import (
 )
 from botbuilder.schema import InputHints
 from .cancel_and_help_dialog import CancelAndHelpDialog
-import logging
-from opencensus.ext.azure.log_exporter import AzureLogHandler
-from config import DefaultConfig
+import observability
 
 class StartDateResolverDialog(CancelAndHelpDialog):
     def __init__(
@@ -30,9 +28,7 @@ class StartDateResolverDialog(CancelAndHelpDialog):
         )
 
         self.telemetry_client = telemetry_client
-        self.logger = logging.getLogger(__name__)
-        configuration = DefaultConfig()
-        self.logger.addHandler(AzureLogHandler(connection_string=configuration.APPINSIGHTS_INSTRUMENTATION))
+        self.logger = observability.get_logger(__name__)
 
         date_time_prompt = DateTimePrompt(
                 DateTimePrompt.__name__,
@@ -68,9 +64,9 @@ class StartDateResolverDialog(CancelAndHelpDialog):
         reprompt_msg = MessageFactory.text(
             reprompt_msg_text, reprompt_msg_text, InputHints.expecting_input
         )
-        self.logger.error(f"Unrecognized departure date: {step_context.options}")
         if timex is None:
             # We were not given any date at all so prompt the user.
+            self.logger.error("Unrecognized departure date: %s", timex)
             return await step_context.prompt(
                 DateTimePrompt.__name__,
                 PromptOptions(prompt=prompt_msg, retry_prompt=reprompt_msg),
@@ -78,6 +74,7 @@ class StartDateResolverDialog(CancelAndHelpDialog):
         # We have a Date we just need to check it is unambiguous.
         if "definite" not in Timex(timex).types:
             # This is essentially a "reprompt" of the data we were given up front.
+            self.logger.error("Unrecognized departure date: %s", timex)
             return await step_context.prompt(
                 DateTimePrompt.__name__, PromptOptions(prompt=reprompt_msg)
             )
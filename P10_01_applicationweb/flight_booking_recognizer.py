@@ -1,23 +1,229 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-from botbuilder.ai.luis import LuisApplication, LuisRecognizer, LuisPredictionOptions
+import asyncio
+import json
+import os.path
+import re
+import sys
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from botbuilder.ai.luis import LuisTelemetryConstants
+from botbuilder.ai.luis.luis_util import LuisUtil
+from botbuilder.ai.luis.activity_util import ActivityUtil
 from botbuilder.core import (
+    IntentScore,
     Recognizer,
     RecognizerResult,
     TurnContext,
     BotTelemetryClient,
     NullTelemetryClient,
 )
+from botbuilder.schema import Activity, ActivityTypes
 
 from config import DefaultConfig
+from helpers.luis_client import LuisClient, LuisUnavailableError
+from helpers.recognizer_cache import RecognizerCache, activity_key
+
+MODEL_PATH = os.path.join(
+    os.path.abspath(os.path.dirname(__file__)), "cognitiveModels/FlightBooking.json"
+)
+
+TOKEN_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}|\$?\d[\d,]*(?:\.\d+)?|\w+|[^\w\s]")
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}$")
+MONEY_PATTERN = re.compile(r"\$?(\d[\d,]*(?:\.\d+)?)$")
+
+# Words that carry no entity but are expected in a booking request.
+FILLER_WORDS = {
+    "a", "an", "and", "book", "budget", "for", "flight", "flights", "fly", "from", "go",
+    "going", "i", "is", "leave", "leaving", "like", "me", "my", "of", "on", "please",
+    "return", "returning", "the", "to", "travel", "trip", "want", "with", "would",
+    ".", ",", "!", "$",
+}
+BOOKING_WORDS = {"book", "flight", "flights", "fly", "go", "going", "travel", "trip"}
+HELP_WORDS = {"help", "?"}
+CANCEL_WORDS = {"cancel", "quit"}
+
+
+class LocalRecognizer:
+    """Recognizes simple utterances without calling LUIS.
+
+    Airports are found with a token trie built from the Airport closed list of the LUIS model,
+    ISO dates and amounts with regular expressions. The confidence is the share of tokens explained.
+    Utterances whose entities are ambiguous (a role found twice, a city without "from" or "to",
+    the same origin and destination, an invalid date) are left to LUIS with a null confidence.
+    """
+
+    def __init__(self, model_path: str = MODEL_PATH):
+        self._airports = {}
+        with open(model_path) as model_file:
+            model = json.load(model_file)
+        for closed_list in model.get("closedLists", []):
+            if closed_list["name"] != "Airport":
+                continue
+            for sub_list in closed_list["subLists"]:
+                for synonym in [sub_list["canonicalForm"]] + sub_list["list"]:
+                    self._add_airport(synonym, sub_list["canonicalForm"])
+
+    def _add_airport(self, synonym: str, canonical_form: str) -> None:
+        node = self._airports
+        for token in TOKEN_PATTERN.findall(synonym.lower()):
+            node = node.setdefault(token, {})
+        node[None] = canonical_form
+
+    def _match_airport(self, tokens: List[str], start: int) -> int:
+        """Returns the index after the longest airport starting at start, or start."""
+        node, end = self._airports, start
+        for index in range(start, len(tokens)):
+            node = node.get(tokens[index])
+            if node is None:
+                break
+            if None in node:
+                end = index + 1
+        return end
+
+    def recognize_text(self, text: str) -> Tuple[RecognizerResult, float]:
+        """Returns the recognizer result of an utterance and its confidence."""
+        matches = list(TOKEN_PATTERN.finditer(text or ""))
+        tokens = [match.group().lower() for match in matches]
+        if not tokens:
+            return None, 0.0
+
+        if len(tokens) == 1 and tokens[0] in HELP_WORDS:
+            return self._result(text, "None", {}), 1.0
+        if len(tokens) == 1 and tokens[0] in CANCEL_WORDS:
+            return self._result(text, "Cancel", {}), 1.0
+
+        entities: Dict[str, List[Tuple[int, int, str]]] = {}
+        covered = 0
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            previous = tokens[index - 1] if index > 0 else ""
+            end = self._match_airport(tokens, index)
+            if end > index:
+                following = tokens[end] if end < len(tokens) else ""
+                if previous == "from" or (following == "to" and previous != "to"):
+                    role = "or_city"
+                elif previous == "to":
+                    role = "dst_city"
+                else:
+                    # "Paris" alone could be the origin or the destination
+                    return None, 0.0
+                entities.setdefault(role, []).append(
+                    (matches[index].start(), matches[end - 1].end(), None)
+                )
+                covered += end - index
+                index = end
+                continue
+
+            if DATE_PATTERN.match(token):
+                try:
+                    date.fromisoformat(token)
+                except ValueError:
+                    return None, 0.0
+                role = "end_date" if "str_date" in entities else "str_date"
+                entities.setdefault(role, []).append(
+                    (matches[index].start(), matches[index].end(), token)
+                )
+                covered += 1
+            elif MONEY_PATTERN.match(token) and (
+                token.startswith("$") or previous in ("of", "budget", "is")
+            ):
+                start = matches[index].start() + (1 if token.startswith("$") else 0)
+                entities.setdefault("budget", []).append(
+                    (start, matches[index].end(), None)
+                )
+                covered += 1
+            elif token in FILLER_WORDS:
+                covered += 1
+            index += 1
+
+        if not entities and not BOOKING_WORDS.intersection(tokens):
+            return None, 0.0
+
+        if any(len(spans) > 1 for spans in entities.values()):
+            return None, 0.0
+        cities = [
+            text[spans[0][0]:spans[0][1]].lower()
+            for role, spans in entities.items()
+            if role in ("or_city", "dst_city")
+        ]
+        if len(cities) == 2 and cities[0] == cities[1]:
+            return None, 0.0
+
+        confidence = covered / len(tokens)
+        return self._result(text, "book", entities, confidence), confidence
+
+    @staticmethod
+    def _result(
+        text: str,
+        intent: str,
+        entities: Dict[str, List[Tuple[int, int, str]]],
+        score: float = 1.0,
+    ) -> RecognizerResult:
+        """Builds a result shaped like the LUIS v2 recognizer output."""
+        result_entities = {"$instance": {}}
+        for name, spans in entities.items():
+            result_entities[name] = [text[start:end].lower() for start, end, _ in spans]
+            result_entities["$instance"][name] = [
+                {
+                    "startIndex": start,
+                    "endIndex": end,
+                    "text": text[start:end],
+                    "type": name,
+                    "score": score,
+                }
+                for start, end, _ in spans
+            ]
+            for start, end, timex in spans:
+                if timex:
+                    result_entities.setdefault("datetime", []).append(
+                        {"type": "date", "timex": [timex]}
+                    )
+                    result_entities["$instance"].setdefault("datetime", []).append(
+                        {
+                            "startIndex": start,
+                            "endIndex": end,
+                            "text": text[start:end],
+                            "type": "builtin.datetimeV2.date",
+                        }
+                    )
+
+        return RecognizerResult(
+            text=text,
+            altered_text=None,
+            intents={intent: IntentScore(score)},
+            entities=result_entities,
+        )
 
 
 class FlightBookingRecognizer(Recognizer):
+    LUIS_TRACE_TYPE = "https://www.luis.ai/schemas/trace"
+    # Turn state key of the recognition started by prefetch
+    PREFETCH_KEY = "FlightBookingRecognizer.prefetch"
+    MAX_AWAITING_INTRO = 10000
+
     def __init__(
         self, configuration: DefaultConfig, telemetry_client: BotTelemetryClient = None
     ):
-        self._recognizer = None
+        self._client = None
+        self._telemetry_client = telemetry_client or NullTelemetryClient()
+        # LUIS calls in progress by cache key, shared by the turns sending the same utterance
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        # Conversations whose next message is recognized, when prefetch is enabled
+        self._awaiting_intro = OrderedDict() if configuration.LUIS_PREFETCH else None
+        self._cache = None
+        if configuration.LUIS_CACHE_SIZE > 0:
+            self._cache = RecognizerCache(
+                configuration.LUIS_CACHE_SIZE, configuration.LUIS_CACHE_TTL
+            )
+        self._local_threshold = configuration.LOCAL_RECOGNIZER_THRESHOLD
+        self._local_recognizer = None
+        if self._local_threshold <= 1.0:
+            self._local_recognizer = LocalRecognizer()
 
         luis_is_configured = (
             configuration.LUIS_APP_ID
@@ -25,25 +231,186 @@ class FlightBookingRecognizer(Recognizer):
             and configuration.LUIS_API_HOST_NAME
         )
         if luis_is_configured:
-            # Set the recognizer options depending on which endpoint version you want to use e.g v2 or v3.
-            # More details can be found in https://docs.microsoft.com/azure/cognitive-services/luis/luis-migration-api-v3
-            luis_application = LuisApplication(
+            # The v2 endpoint is called, see https://docs.microsoft.com/azure/cognitive-services/luis/luis-migration-api-v3
+            # A scheme can be given to use a local stand-in server, e.g "http://localhost:8080"
+            endpoint = configuration.LUIS_API_HOST_NAME
+            if not endpoint.startswith(("http://", "https://")):
+                endpoint = "https://" + endpoint
+            self._client = LuisClient(
                 configuration.LUIS_APP_ID,
                 configuration.LUIS_API_KEY,
-                "https://" + configuration.LUIS_API_HOST_NAME,
-            )
-
-            options = LuisPredictionOptions()
-            options.telemetry_client = telemetry_client or NullTelemetryClient()
-
-            self._recognizer = LuisRecognizer(
-                luis_application, prediction_options=options
+                endpoint,
+                timeout=configuration.LUIS_TIMEOUT,
+                max_concurrency=configuration.LUIS_MAX_CONCURRENCY,
+                failure_threshold=configuration.LUIS_BREAKER_FAILURES,
+                reset_timeout=configuration.LUIS_BREAKER_RESET,
             )
 
     @property
     def is_configured(self) -> bool:
         # Returns true if luis is configured in the config.py and initialized.
-        return self._recognizer is not None
+        return self._client is not None
+
+    async def close(self) -> None:
+        """Closes the connections to LUIS."""
+        if self._client is not None:
+            await self._client.close()
+
+    async def _predict(self, utterance: str) -> Tuple[RecognizerResult, object]:
+        """Calls LUIS, or returns a booking result without entities when LUIS is unavailable.
+
+        The booking dialog then prompts the user for every detail, so the bot keeps serving.
+        Returns the recognizer result and the LUIS result, None when degraded.
+        """
+        try:
+            luis_result = await self._client.predict(utterance)
+        except LuisUnavailableError as error:
+            print(f"LUIS unavailable: {error}", file=sys.stderr)
+            self._telemetry_client.track_metric("LuisUnavailable", 1)
+            result = RecognizerResult(
+                text=utterance, intents={"book": IntentScore(0.0)}, entities={}
+            )
+            result.properties["degraded"] = True
+            return result, None
+
+        result = RecognizerResult(
+            text=utterance,
+            altered_text=luis_result.altered_query,
+            intents=LuisUtil.get_intents(luis_result),
+            entities=LuisUtil.extract_entities_and_metadata(
+                luis_result.entities, luis_result.composite_entities, True
+            ),
+        )
+        LuisUtil.add_properties(luis_result, result)
+        return result, luis_result
+
+    async def _recognize_luis(self, utterance: str, key: tuple) -> Tuple[RecognizerResult, object]:
+        """Calls LUIS, concurrent calls with the same key share the LUIS call and its result."""
+        call = self._in_flight.get(key)
+        if call is None:
+            call = asyncio.ensure_future(self._predict(utterance))
+            self._in_flight[key] = call
+            call.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self._telemetry_client.track_metric("LuisCoalesced", 1)
+        # A turn cancelled while waiting does not cancel the call of the others
+        return await asyncio.shield(call)
+
+    async def _recognize_activity(self, activity: Activity) -> Tuple[RecognizerResult, object]:
+        """Recognizes a message with the local recognizer, the cache or LUIS.
+
+        Returns the recognizer result and the LUIS result when LUIS was called, None otherwise.
+        """
+        if self._local_recognizer is not None:
+            result, confidence = self._local_recognizer.recognize_text(activity.text)
+            if confidence >= self._local_threshold:
+                self._telemetry_client.track_metric("LocalRecognizerHit", 1)
+                return result, None
+
+        utterance = activity.text
+        if not utterance or utterance.isspace():
+            return (
+                RecognizerResult(
+                    text=utterance, intents={"": IntentScore(score=1.0)}, entities={}
+                ),
+                None,
+            )
+
+        key = activity_key(activity)
+        if self._cache is None:
+            return await self._recognize_luis(utterance, key)
+
+        # Frequent inputs ("book a flight", "yes", "Paris") are served without calling LUIS.
+        result = self._cache.get(key)
+        if result is not None:
+            self._telemetry_client.track_metric("LuisCacheHit", 1)
+            return result, None
+
+        self._telemetry_client.track_metric("LuisCacheMiss", 1)
+        result, luis_result = await self._recognize_luis(utterance, key)
+        # Degraded results are not cached, LUIS is called again on the next turn
+        if not result.properties.get("degraded"):
+            self._cache.set(key, result)
+        return result, luis_result
+
+    def expect_intro_answer(self, conversation_id: str) -> None:
+        """Marks a conversation whose next message answers the intro prompt and will be recognized."""
+        if self._awaiting_intro is not None:
+            self._awaiting_intro[conversation_id] = True
+            self._awaiting_intro.move_to_end(conversation_id)
+            while len(self._awaiting_intro) > self.MAX_AWAITING_INTRO:
+                self._awaiting_intro.popitem(last=False)
+
+    def prefetch(self, activity: Activity) -> Optional[asyncio.Future]:
+        """Starts recognizing a message answering the intro prompt, before the state of its turn is loaded.
+
+        To be called once the turn is authenticated, an unauthenticated request must neither
+        call LUIS nor consume the mark of the conversation. Returns the recognition, to be
+        stored in the turn state under PREFETCH_KEY, or None when prefetch is disabled or the
+        conversation is not waiting for the intro answer.
+        """
+        if (
+            self._awaiting_intro is None
+            or self._client is None
+            or activity.type != ActivityTypes.message
+            or activity.conversation is None
+            or self._awaiting_intro.pop(activity.conversation.id, None) is None
+        ):
+            return None
+
+        prefetch = asyncio.ensure_future(self._recognize_activity(activity))
+        # The turn may fail before recognizing, e.g when the state cannot be loaded
+        prefetch.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return prefetch
+
+    def _track_luis_result(
+        self, result: RecognizerResult, turn_context: TurnContext
+    ) -> None:
+        """Logs the LuisResult telemetry event, with the properties of the LuisRecognizer."""
+        intents = sorted(result.intents.items(), key=lambda item: item[1].score, reverse=True)
+        properties = {
+            LuisTelemetryConstants.application_id_property: self._client.app_id,
+            LuisTelemetryConstants.entities_property: json.dumps(result.entities),
+            LuisTelemetryConstants.from_id_property: turn_context.activity.from_property.id,
+        }
+        for index, (name_property, score_property) in enumerate(
+            (
+                (LuisTelemetryConstants.intent_property, LuisTelemetryConstants.intent_score_property),
+                (LuisTelemetryConstants.intent2_property, LuisTelemetryConstants.intent_score2_property),
+            )
+        ):
+            name, score = intents[index] if index < len(intents) else ("", None)
+            properties[name_property] = name
+            properties[score_property] = "{:.2f}".format(score.score if score else 0)
+        self._telemetry_client.track_event(
+            LuisTelemetryConstants.luis_result, properties
+        )
 
     async def recognize(self, turn_context: TurnContext) -> RecognizerResult:
-        return await self._recognizer.recognize(turn_context)
+        prefetch = turn_context.turn_state.pop(self.PREFETCH_KEY, None)
+        if prefetch is not None:
+            self._telemetry_client.track_metric("LuisPrefetchHit", 1)
+            result, luis_result = await prefetch
+        else:
+            result, luis_result = await self._recognize_activity(turn_context.activity)
+        if luis_result is None:
+            return result
+
+        self._track_luis_result(result, turn_context)
+
+        trace_info = {
+            "recognizerResult": LuisUtil.recognizer_result_as_dict(result),
+            "luisModel": {"ModelID": self._client.app_id},
+            "luisOptions": {"Staging": False},
+            "luisResult": LuisUtil.luis_result_as_dict(luis_result),
+        }
+        await turn_context.send_activity(
+            ActivityUtil.create_trace(
+                turn_context.activity,
+                "LuisRecognizer",
+                trace_info,
+                self.LUIS_TRACE_TYPE,
+                "Luis Trace",
+            )
+        )
+        return result
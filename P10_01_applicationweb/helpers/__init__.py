@@ -2,6 +2,13 @@
 # Licensed under the MIT License.
 """Helpers module."""
 
-from . import activity_helper, luis_helper, dialog_helper
+from . import activity_helper, card_cache, luis_client, luis_helper, dialog_helper, recognizer_cache
 
-__all__ = ["activity_helper", "dialog_helper", "luis_helper"]
+__all__ = [
+    "activity_helper",
+    "card_cache",
+    "dialog_helper",
+    "luis_client",
+    "luis_helper",
+    "recognizer_cache",
+]
@@ -0,0 +1,81 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""In memory cache of adaptive cards with per-locale variants."""
+
+import copy
+import json
+import os
+import sys
+import time
+from typing import Dict, Tuple
+
+from botbuilder.schema import Attachment
+
+ADAPTIVE_CARD = "application/vnd.microsoft.card.adaptive"
+
+
+class CardCache:
+    """Adaptive cards loaded once from <directory>/<name>.json and <name>.<locale>.json.
+
+    Cards are parsed at startup, each call returns a copy so that a caller filling a card
+    in never changes the cached one.
+    When reload_interval is positive, the files are checked at most once per interval
+    and the cards whose file changed are reloaded, an invalid file keeps the previous cards.
+    """
+
+    def __init__(self, directory: str, name: str, reload_interval: float = 0):
+        self.directory = directory
+        self.name = name
+        self.reload_interval = reload_interval
+        # locale ("" for the default card) -> (mtime, card)
+        self._cards: Dict[str, Tuple[float, dict]] = {}
+        self._next_check = 0.0
+        self.reload()
+
+    def _files(self) -> Dict[str, str]:
+        """Returns the card files by locale."""
+        files = {}
+        for entry in os.scandir(self.directory):
+            parts = entry.name.split(".")
+            if parts[0] != self.name or parts[-1] != "json" or len(parts) > 3:
+                continue
+            locale = parts[1].lower() if len(parts) == 3 else ""
+            files[locale] = entry.path
+        return files
+
+    def reload(self) -> None:
+        """Loads the cards whose file is new or changed."""
+        cards = {}
+        for locale, path in self._files().items():
+            mtime = os.stat(path).st_mtime
+            cached = self._cards.get(locale)
+            if cached is not None and cached[0] == mtime:
+                cards[locale] = cached
+                continue
+            with open(path, encoding="utf-8") as card_file:
+                cards[locale] = (mtime, json.load(card_file))
+        if "" not in cards:
+            raise FileNotFoundError(
+                os.path.join(self.directory, self.name + ".json")
+            )
+        self._cards = cards
+
+    def get(self, locale: str = None) -> dict:
+        """Returns a copy of the card of a locale, e.g "fr-FR", falling back on its language then the default card."""
+        if self.reload_interval > 0 and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.reload_interval
+            try:
+                self.reload()
+            except (OSError, ValueError) as error:
+                # A card being edited may be incomplete, keep the previous version.
+                print(f"Card {self.name} not reloaded: {error}", file=sys.stderr)
+
+        locale = (locale or "").lower()
+        for candidate in (locale, locale.split("-")[0]):
+            if candidate in self._cards:
+                return copy.deepcopy(self._cards[candidate][1])
+        return copy.deepcopy(self._cards[""][1])
+
+    def attachment(self, locale: str = None) -> Attachment:
+        """Returns an adaptive card attachment."""
+        return Attachment(content_type=ADAPTIVE_CARD, content=self.get(locale))
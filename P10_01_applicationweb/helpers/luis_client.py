@@ -0,0 +1,157 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Pooled asynchronous client of the LUIS v2 prediction endpoint with a circuit breaker."""
+
+import asyncio
+import time
+
+import aiohttp
+from azure.cognitiveservices.language.luis.runtime.models import LuisResult
+
+
+class LuisUnavailableError(Exception):
+    """LUIS did not answer in time, failed or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling a failing service for a while.
+
+    After failure_threshold consecutive failures the circuit opens and calls are refused
+    for reset_timeout seconds. Then a single trial call is let through: its success closes
+    the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        """Returns True when a call can be made."""
+        if self._opened_at is None:
+            return True
+        if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+            return False
+        self._trial = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._trial = False
+
+    def cancel_trial(self) -> None:
+        """Lets another call be the trial, e.g. when the trial call was cancelled."""
+        self._trial = False
+
+
+class LuisClient:
+    """Calls the LUIS v2 prediction endpoint through a shared aiohttp session.
+
+    The session keeps at most max_concurrency connections alive to LUIS and is created on
+    the first call, in the event loop of the bot. A call waiting for a connection counts in
+    its timeout, so a turn never waits for LUIS longer than timeout seconds.
+    """
+
+    def __init__(
+        self,
+        app_id: str,
+        endpoint_key: str,
+        endpoint: str,
+        timeout: float = 3.0,
+        max_concurrency: int = 32,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.app_id = app_id
+        self.url = f"{endpoint.rstrip('/')}/luis/v2.0/apps/{app_id}"
+        self.params = {
+            "verbose": "false",
+            "staging": "false",
+            "spellCheck": "false",
+            "log": "true",
+        }
+        self.headers = {
+            "Ocp-Apim-Subscription-Key": endpoint_key,
+            "Accept": "application/json",
+        }
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency, keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector, headers=self.headers
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def _post(self, session: aiohttp.ClientSession, text: str) -> dict:
+        async with self._semaphore:
+            async with session.post(self.url, params=self.params, json=text) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise LuisUnavailableError(f"LUIS answered {response.status}")
+                response.raise_for_status()
+                return await response.json()
+
+    async def predict(self, text: str) -> LuisResult:
+        """Returns the LUIS prediction of an utterance.
+
+        Raises LuisUnavailableError when LUIS is throttling, failing, too slow or the circuit is open.
+        """
+        if not self.breaker.allow():
+            raise LuisUnavailableError("LUIS circuit breaker is open")
+
+        session = self._get_session()
+        try:
+            body = await asyncio.wait_for(self._post(session, text), self.timeout)
+            result = LuisResult.deserialize(body)
+        except aiohttp.ClientResponseError as error:
+            # Errors 4xx come from the request or the configuration, LUIS itself answered.
+            self.breaker.record_success()
+            raise LuisUnavailableError(f"LUIS answered {error.status}") from error
+        except LuisUnavailableError:
+            self.breaker.record_failure()
+            raise
+        except (asyncio.TimeoutError, aiohttp.ClientError) as error:
+            self.breaker.record_failure()
+            raise LuisUnavailableError(
+                f"LUIS call failed: {error.__class__.__name__} {error}"
+            ) from error
+        except asyncio.CancelledError:
+            # The turn is over, it tells nothing about LUIS.
+            self.breaker.cancel_trial()
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            # The body is not JSON or not a prediction.
+            self.breaker.record_failure()
+            raise LuisUnavailableError(
+                f"Invalid LUIS answer: {error.__class__.__name__} {error}"
+            ) from error
+
+        self.breaker.record_success()
+        return result
+
+    async def close(self) -> None:
+        """Closes the connections of the session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
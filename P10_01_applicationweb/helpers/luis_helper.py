@@ -5,6 +5,7 @@ from typing import Dict
 from botbuilder.ai.luis import LuisRecognizer
 from botbuilder.core import IntentScore, TopIntent, TurnContext
 from booking_details import BookingDetails
+import observability
 
 
 class Intent(Enum):
@@ -36,7 +37,8 @@ class LuisHelper:
         intent = None
 
         try:
-            recognizer_result = await luis_recognizer.recognize(turn_context)
+            with observability.timed("luis"):
+                recognizer_result = await luis_recognizer.recognize(turn_context)
 
             intent = (
                 sorted(
@@ -87,7 +89,7 @@ class LuisHelper:
 
                 # Datetime --------------
                 datetime_entities = recognizer_result.entities.get("datetime", [])
-                if datetime_entities[0]['type'] == "daterange":
+                if datetime_entities and datetime_entities[0]['type'] == "daterange":
                     result.departure_date = datetime_entities[0]['timex'][0].split(',')[0].strip('(')
                     result.return_date = datetime_entities[0]['timex'][0].split(',')[1].strip(')')
 
@@ -0,0 +1,56 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Bounded LRU/TTL cache of recognizer results."""
+
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from botbuilder.core import RecognizerResult, TurnContext
+from botbuilder.schema import Activity
+
+
+def cache_key(turn_context: TurnContext) -> tuple:
+    """Key of a turn: normalized utterance, locale and reference day for datetime resolution."""
+    return activity_key(turn_context.activity)
+
+
+def activity_key(activity: Activity) -> tuple:
+    """Key of a message activity, see cache_key."""
+    text = " ".join((activity.text or "").lower().split())
+    reference = (activity.timestamp or datetime.utcnow()).date().isoformat()
+    return text, activity.locale or "", reference
+
+
+class RecognizerCache:
+    """Least recently used cache of recognizer results with a time to live."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key: tuple) -> RecognizerResult:
+        """Returns the cached result or None."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key: tuple, result: RecognizerResult) -> None:
+        """Stores a result, evicting the least recently used one when full."""
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,319 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Shared logging and metrics setup for the bot.
+
+Handlers, exporters and views are created once per process, on first use, and
+registration is idempotent: building dialogs several times (tests, workers, reload)
+never stacks handlers or exporter threads.
+
+Log records go through a bounded queue drained by a listener thread, so logging never
+blocks the event loop: records are dropped (and counted) when the queue is full, and
+records below ERROR can be sampled. The Application Insights handler exports in batches.
+
+Turn stages are timed with timed() / timed_step(). Latencies are recorded in a distribution
+view and, because the Azure exporter ignores distributions, their p50/p95/p99 over each
+export interval are also published as gauges tagged with the stage and the quantile.
+"""
+import atexit
+import functools
+import logging
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+from opencensus.stats import aggregation as aggregation_module
+from opencensus.stats import measure as measure_module
+from opencensus.stats import stats as stats_module
+from opencensus.stats import view as view_module
+from opencensus.tags import tag_key as tag_key_module
+from opencensus.tags import tag_map as tag_map_module
+from opencensus.tags import tag_value as tag_value_module
+
+from config import DefaultConfig
+
+CONFIG = DefaultConfig()
+
+ACCEPTED_MEASURE = measure_module.MeasureInt(
+    "Accepted", "number of accepted booking", "Accepted"
+)
+CANCELED_MEASURE = measure_module.MeasureInt(
+    "Canceled", "number of canceled booking", "Canceled"
+)
+LOG_DROPPED_MEASURE = measure_module.MeasureInt(
+    "LogDropped", "number of log records dropped because the log queue was full", "Records"
+)
+STAGE_LATENCY_MEASURE = measure_module.MeasureFloat(
+    "TurnStageLatency", "latency of a turn stage", "ms"
+)
+STAGE_PERCENTILE_MEASURE = measure_module.MeasureFloat(
+    "TurnStageLatencyPercentile", "percentile of the latency of a turn stage", "ms"
+)
+STAGE_KEY = tag_key_module.TagKey("stage")
+QUANTILE_KEY = tag_key_module.TagKey("quantile")
+LATENCY_BOUNDARIES = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+QUANTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+
+# Latency samples of the current export interval, by stage.
+_SAMPLES = {}
+_SAMPLES_SIZE = 10000
+_NEXT_PUBLISH = 0.0
+
+_LOCK = threading.RLock()
+_LOG_HANDLER = None
+_LOG_LISTENER = None
+_METRICS_STARTED = False
+_VIEWS = {}
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every record at or above ERROR and a share of the others."""
+
+    def __init__(self, rate: float):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR or self.rate >= 1.0:
+            return True
+        if random.random() < self.rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that never blocks: records are dropped when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            record_int(LOG_DROPPED_MEASURE)
+
+
+def _get_log_handler() -> logging.Handler:
+    """Returns the process wide queue handler feeding Application Insights, None if not configured."""
+    global _LOG_HANDLER, _LOG_LISTENER  # pylint: disable=global-statement
+    with _LOCK:
+        if _LOG_HANDLER is None and CONFIG.APPINSIGHTS_INSTRUMENTATION:
+            # pylint: disable=import-outside-toplevel
+            from opencensus.ext.azure.log_exporter import AzureLogHandler
+
+            azure_handler = AzureLogHandler(
+                connection_string=CONFIG.APPINSIGHTS_INSTRUMENTATION,
+                max_batch_size=CONFIG.LOG_BATCH_SIZE,
+                export_interval=CONFIG.LOG_EXPORT_INTERVAL,
+            )
+            log_queue = queue.Queue(maxsize=CONFIG.LOG_QUEUE_SIZE)
+            _LOG_HANDLER = DroppingQueueHandler(log_queue)
+            _LOG_HANDLER.addFilter(SamplingFilter(CONFIG.LOG_SAMPLE_RATE))
+            _LOG_LISTENER = QueueListener(
+                log_queue, azure_handler, respect_handler_level=True
+            )
+            _LOG_LISTENER.start()
+            atexit.register(_LOG_LISTENER.stop)
+        return _LOG_HANDLER
+
+
+def log_stats() -> dict:
+    """Returns the number of log records dropped and sampled out in this process."""
+    with _LOCK:
+        if _LOG_HANDLER is None:
+            return {"dropped": 0, "sampled_out": 0}
+        return {
+            "dropped": _LOG_HANDLER.dropped,
+            "sampled_out": sum(
+                log_filter.sampled_out
+                for log_filter in _LOG_HANDLER.filters
+                if isinstance(log_filter, SamplingFilter)
+            ),
+        }
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns a logger shipping its records to Application Insights."""
+    logger = logging.getLogger(name)
+    handler = _get_log_handler()
+    with _LOCK:
+        if handler is not None and handler not in logger.handlers:
+            logger.addHandler(handler)
+    return logger
+
+
+def register_view(view: view_module.View) -> None:
+    """Registers a stats view once."""
+    with _LOCK:
+        if view.name not in _VIEWS:
+            stats_module.stats.view_manager.register_view(view)
+            _VIEWS[view.name] = view
+
+
+def _start_metrics() -> None:
+    """Registers the booking views and the metrics exporter once."""
+    global _METRICS_STARTED  # pylint: disable=global-statement
+    with _LOCK:
+        if _METRICS_STARTED:
+            return
+        _METRICS_STARTED = True
+
+        register_view(
+            view_module.View(
+                "Accepted Booking view",
+                "number of Accepted booking",
+                [],
+                ACCEPTED_MEASURE,
+                aggregation_module.CountAggregation(),
+            )
+        )
+        register_view(
+            view_module.View(
+                "Canceled Booking view",
+                "number of Canceled booking",
+                [],
+                CANCELED_MEASURE,
+                aggregation_module.CountAggregation(),
+            )
+        )
+        register_view(
+            view_module.View(
+                "Turn Stage Latency view",
+                "distribution of the latency of turn stages",
+                [STAGE_KEY],
+                STAGE_LATENCY_MEASURE,
+                aggregation_module.DistributionAggregation(LATENCY_BOUNDARIES),
+            )
+        )
+        register_view(
+            view_module.View(
+                "Turn Stage Latency Percentile view",
+                "p50, p95 and p99 of the latency of turn stages",
+                [STAGE_KEY, QUANTILE_KEY],
+                STAGE_PERCENTILE_MEASURE,
+                aggregation_module.LastValueAggregation(),
+            )
+        )
+        register_view(
+            view_module.View(
+                "Dropped Log view",
+                "number of dropped log records",
+                [],
+                LOG_DROPPED_MEASURE,
+                aggregation_module.CountAggregation(),
+            )
+        )
+
+        if CONFIG.APPINSIGHTS_INSTRUMENTATION:
+            # pylint: disable=import-outside-toplevel
+            from opencensus.ext.azure import metrics_exporter
+
+            exporter = metrics_exporter.new_metrics_exporter(
+                connection_string=CONFIG.APPINSIGHTS_INSTRUMENTATION
+            )
+            stats_module.stats.view_manager.register_exporter(exporter)
+
+
+def start() -> None:
+    """Initializes metrics, safe to call several times."""
+    _start_metrics()
+
+
+def record_int(measure: measure_module.MeasureInt, value: int = 1) -> None:
+    """Records a value of an integer measure."""
+    _start_metrics()
+    measurement_map = stats_module.stats.stats_recorder.new_measurement_map()
+    measurement_map.measure_int_put(measure, value)
+    measurement_map.record(tag_map_module.TagMap())
+
+
+def _percentile(samples: list, quantile: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+def _publish_percentiles(now: float) -> None:
+    """Publishes the percentiles of the interval which has just ended."""
+    global _SAMPLES, _NEXT_PUBLISH  # pylint: disable=global-statement
+    with _LOCK:
+        if not _NEXT_PUBLISH:
+            _NEXT_PUBLISH = now + CONFIG.LATENCY_EXPORT_INTERVAL
+        if now < _NEXT_PUBLISH:
+            return
+        samples, _SAMPLES = _SAMPLES, {}
+        _NEXT_PUBLISH = now + CONFIG.LATENCY_EXPORT_INTERVAL
+
+    for stage, (values, _) in samples.items():
+        for quantile_name, quantile in QUANTILES:
+            tag_map = tag_map_module.TagMap()
+            tag_map.insert(STAGE_KEY, tag_value_module.TagValue(stage))
+            tag_map.insert(QUANTILE_KEY, tag_value_module.TagValue(quantile_name))
+            measurement_map = stats_module.stats.stats_recorder.new_measurement_map()
+            measurement_map.measure_float_put(
+                STAGE_PERCENTILE_MEASURE, _percentile(values, quantile)
+            )
+            measurement_map.record(tag_map)
+
+
+def record_latency(stage: str, milliseconds: float) -> None:
+    """Records the latency of a turn stage."""
+    _start_metrics()
+    tag_map = tag_map_module.TagMap()
+    tag_map.insert(STAGE_KEY, tag_value_module.TagValue(stage))
+    measurement_map = stats_module.stats.stats_recorder.new_measurement_map()
+    measurement_map.measure_float_put(STAGE_LATENCY_MEASURE, milliseconds)
+    measurement_map.record(tag_map)
+
+    with _LOCK:
+        values, count = _SAMPLES.get(stage, ([], 0))
+        count += 1
+        if len(values) < _SAMPLES_SIZE:
+            values.append(milliseconds)
+        else:
+            # Reservoir sampling keeps the interval percentiles unbiased.
+            index = random.randrange(count)
+            if index < _SAMPLES_SIZE:
+                values[index] = milliseconds
+        _SAMPLES[stage] = (values, count)
+
+    _publish_percentiles(time.monotonic())
+
+
+def latency_percentiles() -> dict:
+    """Returns the p50/p95/p99 in ms of each stage over the current interval."""
+    with _LOCK:
+        samples = {stage: list(values) for stage, (values, _) in _SAMPLES.items()}
+    return {
+        stage: {name: _percentile(values, quantile) for name, quantile in QUANTILES}
+        for stage, values in samples.items()
+        if values
+    }
+
+
+@contextmanager
+def timed(stage: str):
+    """Times the enclosed block, which may await, as a turn stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_latency(stage, (time.perf_counter() - start) * 1000.0)
+
+
+def timed_step(function):
+    """Times a coroutine, e.g a waterfall step, as a stage named after it."""
+    stage = function.__qualname__
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        with timed(stage):
+            return await function(*args, **kwargs)
+
+    return wrapper
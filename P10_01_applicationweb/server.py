@@ -0,0 +1,285 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Production launcher running the bot in several pre-forked aiohttp workers.
+
+The master process binds the listening socket once and forks the workers that accept
+connections on it. The bot (app.py) is only imported
+in the workers, after the fork, so that exporter threads and event loops are never shared.
+
+Signals sent to the master:
+- SIGHUP: graceful reload, new workers are started then the old ones finish their requests.
+- SIGTERM / SIGINT: graceful shutdown.
+
+On Azure Portal: App Service >> Web App Configuration >> General Settings
+Update <Startup Command> with:
+python3.8 server.py --host 0.0.0.0 --port 8000
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import time
+
+from config import DefaultConfig
+
+CONFIG = DefaultConfig()
+
+
+def create_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """Create the listening socket shared by the workers."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+
+async def serve(sock: socket.socket, worker: int, generation: int, args) -> None:
+    """Run the bot in a worker until SIGTERM is received."""
+    # pylint: disable=import-outside-toplevel
+    from aiohttp import web
+    import app as bot_app
+
+    started = time.time()
+
+    async def health(req: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "status": "ok",
+                "pid": os.getpid(),
+                "worker": worker,
+                "generation": generation,
+                "uptime": time.time() - started,
+            }
+        )
+
+    application = bot_app.init_func(None)
+    application.router.add_get("/health", health)
+
+    runner = web.AppRunner(application, handle_signals=False)
+    await runner.setup()
+    await web.SockSite(runner, sock, shutdown_timeout=args.shutdown_timeout).start()
+    if args.health_port:
+        # Each worker can be probed on its own port, the shared socket reaches any of them.
+        # On reload the worker of the previous generation holds the port until it stops.
+        await web.TCPSite(
+            runner, "127.0.0.1", args.health_port + worker, reuse_port=True
+        ).start()
+
+    stop = asyncio.Event()
+    asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    await stop.wait()
+
+    # Stop accepting connections and let in-flight requests finish.
+    await runner.cleanup()
+
+
+def run_worker(sock: socket.socket, worker: int, generation: int, args) -> None:
+    """Entry point of a forked worker."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    if args.uvloop:
+        try:
+            import uvloop  # pylint: disable=import-outside-toplevel
+
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            print("uvloop is not installed, using the default event loop", file=sys.stderr)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(serve(sock, worker, generation, args))
+    finally:
+        loop.close()
+
+
+class Master:
+    """Forks, monitors and reloads the workers.
+
+    A worker exiting within min_uptime seconds of its start is restarted after an exponential
+    backoff, the master gives up after max_restarts quick exits in a row of the same worker
+    (e.g. a bad configuration making every worker crash at import).
+    """
+
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, sock: socket.socket, args):
+        self.sock = sock
+        self.args = args
+        self.generation = 0
+        self.workers = {}  # pid -> worker index
+        self.started = {}  # pid -> start time
+        self.failures = {}  # worker index -> quick exits in a row
+        self.pending = {}  # worker index -> time of its restart
+        self.reload = False
+        self.stopping = False
+        self.failed = False
+
+    def spawn(self, worker: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, worker, self.generation, self.args)
+            except BaseException:  # pylint: disable=broad-except
+                import traceback  # pylint: disable=import-outside-toplevel
+
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)  # pylint: disable=protected-access
+        self.workers[pid] = worker
+        self.started[pid] = time.monotonic()
+
+    def on_worker_exit(self, worker: int, uptime: float, now: float) -> None:
+        """Schedules the restart of a worker that died unexpectedly."""
+        if uptime < self.args.min_uptime:
+            self.failures[worker] = self.failures.get(worker, 0) + 1
+        else:
+            self.failures[worker] = 0
+
+        failures = self.failures[worker]
+        if failures > self.args.max_restarts:
+            print(
+                f"Worker {worker} exited {failures} times within {self.args.min_uptime}s of its start, stopping",
+                file=sys.stderr,
+            )
+            self.failed = True
+            self.stopping = True
+            return
+
+        delay = min(self.args.restart_backoff * 2 ** (failures - 1), self.MAX_BACKOFF) if failures else 0
+        print(f"Worker {worker} exited, restarting in {delay:.1f}s", file=sys.stderr)
+        self.pending[worker] = now + delay
+
+    def spawn_pending(self, now: float) -> None:
+        """Restarts the workers whose backoff is over."""
+        for worker, start in list(self.pending.items()):
+            if start <= now:
+                del self.pending[worker]
+                self.spawn(worker)
+
+    def spawn_all(self) -> None:
+        for worker in range(self.args.workers):
+            self.spawn(worker)
+
+    def signal_workers(self, pids, signum: int) -> None:
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def on_reload(self, *_) -> None:
+        self.reload = True
+
+    def on_stop(self, *_) -> None:
+        self.stopping = True
+
+    def run(self) -> int:
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+
+        self.spawn_all()
+        print(
+            f"Serving on {self.args.host}:{self.args.port} with {self.args.workers} workers",
+            file=sys.stderr,
+        )
+
+        retiring = set()
+        while not self.stopping:
+            if self.reload:
+                self.reload = False
+                self.generation += 1
+                retiring.update(self.workers)
+                self.workers = {}
+                self.pending = {}
+                self.failures = {}
+                self.spawn_all()
+                self.signal_workers(retiring, signal.SIGTERM)
+
+            self.spawn_pending(time.monotonic())
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0:
+                time.sleep(0.5)
+                continue
+
+            now = time.monotonic()
+            started = self.started.pop(pid, now)
+            if pid in retiring:
+                retiring.discard(pid)
+            elif pid in self.workers:
+                # Replace a worker that died unexpectedly.
+                self.on_worker_exit(self.workers.pop(pid), now - started, now)
+
+        pids = set(self.workers) | retiring
+        self.signal_workers(pids, signal.SIGTERM)
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        return 1 if self.failed else 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run the bot in several worker processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=CONFIG.PORT)
+    parser.add_argument(
+        "--workers", type=int, default=CONFIG.WEB_WORKERS, help="Number of worker processes"
+    )
+    parser.add_argument("--backlog", type=int, default=128)
+    parser.add_argument(
+        "--shutdown-timeout",
+        dest="shutdown_timeout",
+        type=float,
+        default=30.0,
+        help="Seconds given to in-flight requests on reload or shutdown",
+    )
+    parser.add_argument(
+        "--health-port",
+        dest="health_port",
+        type=int,
+        default=0,
+        help="Worker N also serves /health on 127.0.0.1:<health-port + N>",
+    )
+    parser.add_argument(
+        "--min-uptime",
+        dest="min_uptime",
+        type=float,
+        default=10.0,
+        help="A worker exiting sooner after its start is restarted with a backoff",
+    )
+    parser.add_argument(
+        "--restart-backoff",
+        dest="restart_backoff",
+        type=float,
+        default=1.0,
+        help="Delay in seconds before the first restart of a worker exiting quickly, doubled each time",
+    )
+    parser.add_argument(
+        "--max-restarts",
+        dest="max_restarts",
+        type=int,
+        default=5,
+        help="The master stops after this number of quick exits in a row of a worker",
+    )
+    parser.add_argument("--uvloop", action="store_true", help="Use uvloop if installed")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    ARGS = parse_args(sys.argv[1:])
+    sys.exit(Master(create_socket(ARGS.host, ARGS.port, ARGS.backlog), ARGS).run())
@@ -0,0 +1,194 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+"""Persistent bot state storage backed by sharded SQLite databases."""
+
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from botbuilder.core import Storage, StoreItem
+
+
+def _get_e_tag(item) -> str:
+    if isinstance(item, dict):
+        return item.get("e_tag", None)
+    return getattr(item, "e_tag", None)
+
+
+def _set_e_tag(item, e_tag: str) -> None:
+    if isinstance(item, dict):
+        item["e_tag"] = e_tag
+    else:
+        item.e_tag = e_tag
+
+
+class _Shard:
+    """One SQLite database in WAL mode, shared by every worker process."""
+
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.next_purge = 0.0
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections are opened lazily so that forked workers never share one.
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "key TEXT PRIMARY KEY, e_tag TEXT, value BLOB, expires REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS state_expires ON state (expires)"
+            )
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def read(self, keys: List[str]) -> Dict[str, object]:
+        placeholders = ",".join("?" * len(keys))
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT key, value FROM state WHERE key IN ({placeholders}) "
+                "AND (expires IS NULL OR expires > ?)",
+                (*keys, time.time()),
+            ).fetchall()
+        return {key: pickle.loads(zlib.decompress(value)) for key, value in rows}
+
+    def write(self, changes: Dict[str, StoreItem]) -> None:
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        with self.lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                placeholders = ",".join("?" * len(changes))
+                current = dict(
+                    connection.execute(
+                        f"SELECT key, e_tag FROM state WHERE key IN ({placeholders}) "
+                        "AND (expires IS NULL OR expires > ?)",
+                        (*changes.keys(), now),
+                    ).fetchall()
+                )
+
+                rows = []
+                for key, change in changes.items():
+                    new_e_tag = _get_e_tag(change)
+                    if new_e_tag == "":
+                        raise Exception("sqlite_storage.write(): etag missing")
+                    old_e_tag = current.get(key)
+                    if (
+                        old_e_tag is not None
+                        and new_e_tag is not None
+                        and new_e_tag != "*"
+                        and new_e_tag != old_e_tag
+                    ):
+                        raise KeyError(
+                            "Etag conflict.\nOriginal: %s\r\nCurrent: %s"
+                            % (new_e_tag, old_e_tag)
+                        )
+
+                    # The caller keeps the new e_tag so that a later write in the same turn succeeds.
+                    e_tag = uuid.uuid4().hex
+                    _set_e_tag(change, e_tag)
+                    value = zlib.compress(pickle.dumps(change, pickle.HIGHEST_PROTOCOL))
+                    rows.append((key, e_tag, value, expires))
+
+                connection.executemany(
+                    "INSERT OR REPLACE INTO state (key, e_tag, value, expires) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                if self.ttl and now >= self.next_purge:
+                    connection.execute(
+                        "DELETE FROM state WHERE expires IS NOT NULL AND expires <= ?", (now,)
+                    )
+                    self.next_purge = now + min(self.ttl, 60)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def delete(self, keys: List[str]) -> None:
+        placeholders = ",".join("?" * len(keys))
+        with self.lock:
+            self.connection.execute(
+                f"DELETE FROM state WHERE key IN ({placeholders})", keys
+            )
+
+
+class SqliteStorage(Storage):
+    """Storage of bot state in SQLite databases, safe to share between worker processes.
+
+    Keys are spread over several databases to reduce write lock contention.
+    Reads and writes of a turn are batched per database and run in a thread pool,
+    writes use e_tags for optimistic concurrency and state expires after ttl seconds
+    without being written.
+    """
+
+    def __init__(self, directory: str, shards: int = 4, ttl: float = 0, max_workers: int = 4):
+        super(SqliteStorage, self).__init__()
+        os.makedirs(directory, exist_ok=True)
+        self._shards = [
+            _Shard(os.path.join(directory, f"state-{index}.db"), ttl)
+            for index in range(shards)
+        ]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _group(self, keys) -> Dict[_Shard, list]:
+        groups = {}
+        for key in keys:
+            shard = self._shards[zlib.crc32(key.encode("utf-8")) % len(self._shards)]
+            groups.setdefault(shard, []).append(key)
+        return groups
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+    async def read(self, keys: List[str]):
+        data = {}
+        if not keys:
+            return data
+
+        results = await asyncio.gather(
+            *(self._run(shard.read, shard_keys) for shard, shard_keys in self._group(keys).items())
+        )
+        for result in results:
+            data.update(result)
+        return data
+
+    async def write(self, changes: Dict[str, StoreItem]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+
+        await asyncio.gather(
+            *(
+                self._run(shard.write, {key: changes[key] for key in shard_keys})
+                for shard, shard_keys in self._group(changes.keys()).items()
+            )
+        )
+
+    async def delete(self, keys: List[str]):
+        if not keys:
+            return
+
+        await asyncio.gather(
+            *(self._run(shard.delete, shard_keys) for shard, shard_keys in self._group(keys).items())
+        )
@@ -0,0 +1,71 @@
+import unittest
+import os
+import sys
+import inspect
+from unittest import mock
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, currentdir)
+# No telemetry nor storage file during the tests
+os.environ.update(AppInsightsInstrumentationCnx="", StateStoragePath="")
+import app
+from botbuilder.core import TurnContext
+from flight_booking_recognizer import FlightBookingRecognizer
+from recognizer_test import FakeClient, get_recognizer
+
+ACTIVITY = {
+    "type": "message", "text": "I want to go to Paris", "channelId": "test", "serviceUrl": "http://localhost",
+    "from": {"id": "user"}, "recipient": {"id": "bot"}, "conversation": {"id": "conversation"}, "id": "1",
+}
+
+
+class FakeRequest:
+
+    headers = {"Content-Type": "application/json", "Authorization": "Bearer forged"}
+
+    async def json(self):
+        return ACTIVITY
+
+
+class test_messages(unittest.IsolatedAsyncioTestCase):
+
+    """Test the prefetch of the intro answer by the message handler"""
+
+    async def asyncSetUp(self):
+        self.client = FakeClient()
+        self.recognizer = get_recognizer(self.client, prefetch=True)
+        self.recognizer.expect_intro_answer("conversation")
+        self.turn_states = []
+
+        async def on_turn(turn_context):
+            self.turn_states.append(dict(turn_context.turn_state))
+
+        patcher = mock.patch.multiple(app, RECOGNIZER=self.recognizer, BOT=mock.Mock(on_turn=on_turn))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_unauthenticated(self):
+        """Test a request refused by the adapter neither calls LUIS nor consumes the intro mark"""
+        with self.assertRaises(Exception):
+            await app.messages(FakeRequest())
+        self.assertEqual(self.client.calls, [])
+        self.assertIn("conversation", self.recognizer._awaiting_intro)
+
+    async def test_authenticated(self):
+        """Test the intro answer is recognized once the turn is authenticated"""
+        async def process_activity(activity, auth_header, logic):
+            await logic(TurnContext(app.ADAPTER, activity))
+
+        with mock.patch.object(app.ADAPTER, "process_activity", process_activity):
+            await app.messages(FakeRequest())
+        prefetch = self.turn_states[0][FlightBookingRecognizer.PREFETCH_KEY]
+        result, _ = await prefetch
+        self.assertEqual(result.entities["dst_city"], ["paris"])
+        self.assertEqual(self.client.calls, ["I want to go to Paris"])
+        self.assertNotIn("conversation", self.recognizer._awaiting_intro)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import os
+import sys
+import json
+import inspect
+import tempfile
+from unittest import mock
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from helpers import card_cache
+from helpers.card_cache import CardCache
+
+CARDS_PATH = os.path.join(parentdir, "cards")
+
+
+class test_card_cache(unittest.TestCase):
+
+    """Test the adaptive card cache"""
+
+    def test_copy(self):
+        """Test a modified card does not change the cached one"""
+        cards = CardCache(CARDS_PATH, "welcomeCard")
+        card = cards.get()
+        card["body"].clear()
+        card["changed"] = True
+
+        self.assertNotIn("changed", cards.get())
+        self.assertTrue(cards.get()["body"])
+        self.assertEqual(cards.attachment("fr-FR").content, cards.get())
+
+
+class test_card_cache_files(unittest.TestCase):
+
+    """Test the card files of each locale and their reload"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.write("card.json", {"text": "Hello"})
+        self.write("card.fr.json", {"text": "Bonjour"})
+        self.write("card.de-DE.json", {"text": "Guten Tag"})
+        self.write("other.json", {"text": "Other"})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.directory.name, name)
+        with open(path, "w", encoding="utf-8") as card_file:
+            card_file.write(content if isinstance(content, str) else json.dumps(content))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_locale(self):
+        """Test a locale falls back on its language then on the default card"""
+        cards = CardCache(self.directory.name, "card")
+        self.assertEqual(cards.get("fr-FR"), {"text": "Bonjour"})
+        self.assertEqual(cards.get("fr"), {"text": "Bonjour"})
+        self.assertEqual(cards.get("de-DE"), {"text": "Guten Tag"})
+        self.assertEqual(cards.get("de-AT"), {"text": "Hello"})
+        self.assertEqual(cards.get("en-US"), {"text": "Hello"})
+        self.assertEqual(cards.get(), {"text": "Hello"})
+
+        os.remove(os.path.join(self.directory.name, "card.json"))
+        with self.assertRaises(FileNotFoundError):
+            CardCache(self.directory.name, "card")
+
+    def test_reload(self):
+        """Test changed files are reloaded at most once per interval"""
+        with mock.patch.object(card_cache.time, "monotonic", return_value=100):
+            cards = CardCache(self.directory.name, "card", reload_interval=10)
+            self.assertEqual(cards.get("fr-FR"), {"text": "Bonjour"})
+
+        self.write("card.fr.json", {"text": "Salut"}, mtime=1000)
+        self.write("card.es.json", {"text": "Hola"})
+        with mock.patch.object(card_cache.time, "monotonic", return_value=110):
+            self.assertEqual(cards.get("fr-FR"), {"text": "Salut"})
+            # Not checked again before the interval
+            self.write("card.fr.json", {"text": "Coucou"}, mtime=2000)
+            self.assertEqual(cards.get("fr-FR"), {"text": "Salut"})
+            self.assertEqual(cards.get("es"), {"text": "Hola"})
+
+        with mock.patch.object(card_cache.time, "monotonic", return_value=120):
+            self.assertEqual(cards.get("fr-FR"), {"text": "Coucou"})
+
+        # Without reload interval the files are read once
+        cards = CardCache(self.directory.name, "card")
+        self.write("card.fr.json", {"text": "Bonjour"}, mtime=3000)
+        self.assertEqual(cards.get("fr-FR"), {"text": "Coucou"})
+
+    def test_invalid_file(self):
+        """Test a card being edited keeps the previous version"""
+        with mock.patch.object(card_cache.time, "monotonic", return_value=100):
+            cards = CardCache(self.directory.name, "card", reload_interval=10)
+            cards.get()
+
+        self.write("card.json", '{"text": "Hel', mtime=1000)
+        with mock.patch.object(card_cache.time, "monotonic", return_value=110), mock.patch("sys.stderr"):
+            self.assertEqual(cards.get(), {"text": "Hello"})
+
+        self.write("card.json", {"text": "Hi"}, mtime=2000)
+        with mock.patch.object(card_cache.time, "monotonic", return_value=120):
+            self.assertEqual(cards.get(), {"text": "Hi"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+import asyncio
+import os
+import sys
+import inspect
+from unittest import mock
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from helpers import luis_client
+from helpers.luis_client import CircuitBreaker, LuisClient, LuisUnavailableError
+
+LUIS_RESPONSE = {
+    "query": "Hello",
+    "topScoringIntent": {"intent": "None", "score": 0.9},
+    "entities": [],
+}
+
+
+class test_circuit_breaker(unittest.TestCase):
+
+    """Test the states of the circuit breaker"""
+
+    def test_transitions(self):
+        """Test the circuit opens, lets a single trial through, then closes or opens again"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        with mock.patch.object(luis_client.time, "monotonic", return_value=100):
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertTrue(breaker.is_open)
+            self.assertFalse(breaker.allow())
+
+        # Half open: a single trial call
+        with mock.patch.object(luis_client.time, "monotonic", return_value=110):
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            # The trial failed, the circuit opens again
+            breaker.record_failure()
+            self.assertFalse(breaker.allow())
+
+        with mock.patch.object(luis_client.time, "monotonic", return_value=120):
+            self.assertTrue(breaker.allow())
+            breaker.record_success()
+            self.assertFalse(breaker.is_open)
+            self.assertTrue(breaker.allow())
+            self.assertTrue(breaker.allow())
+            self.assertEqual(breaker.failures, 0)
+
+    def test_cancel_trial(self):
+        """Test another call can be the trial after a cancelled one"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        with mock.patch.object(luis_client.time, "monotonic", return_value=100):
+            breaker.record_failure()
+        with mock.patch.object(luis_client.time, "monotonic", return_value=110):
+            self.assertTrue(breaker.allow())
+            breaker.cancel_trial()
+            self.assertTrue(breaker.is_open)
+            self.assertTrue(breaker.allow())
+
+
+class test_luis_client(unittest.IsolatedAsyncioTestCase):
+
+    """Test how LUIS errors are reported by the client"""
+
+    async def asyncSetUp(self):
+        self.client = LuisClient("app", "key", "http://localhost", timeout=0.05, failure_threshold=1)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def answer(self, body=None, delay=0, error=None):
+        async def post(session, text):
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            return body
+        self.client._post = post
+
+    def open_circuit(self):
+        """Opens the circuit, its reset timeout is over so the next call is a trial"""
+        self.client.breaker.record_failure()
+        self.client.breaker._opened_at -= self.client.breaker.reset_timeout
+
+    async def test_predict(self):
+        """Test a prediction closes the circuit"""
+        self.open_circuit()
+        self.answer(LUIS_RESPONSE)
+        result = await self.client.predict("Hello")
+        self.assertEqual(result.top_scoring_intent.intent, "None")
+        self.assertFalse(self.client.breaker.is_open)
+
+    async def test_timeout(self):
+        """Test a slow answer is reported as unavailable and opens the circuit"""
+        self.answer(LUIS_RESPONSE, delay=1)
+        with self.assertRaises(LuisUnavailableError):
+            await self.client.predict("Hello")
+        self.assertTrue(self.client.breaker.is_open)
+        with self.assertRaisesRegex(LuisUnavailableError, "open"):
+            await self.client.predict("Hello")
+
+    async def test_invalid_answer(self):
+        """Test an answer which is not a prediction fails the trial"""
+        self.open_circuit()
+        self.answer(error=ValueError("not JSON"))
+        with self.assertRaises(LuisUnavailableError):
+            await self.client.predict("Hello")
+        self.assertTrue(self.client.breaker.is_open)
+        self.assertFalse(self.client.breaker._trial)
+
+        self.open_circuit()
+        self.answer("not a prediction")
+        with self.assertRaises(LuisUnavailableError):
+            await self.client.predict("Hello")
+        self.assertFalse(self.client.breaker._trial)
+
+    async def test_cancelled_trial(self):
+        """Test a cancelled trial does not keep the circuit open"""
+        self.open_circuit()
+        self.answer(LUIS_RESPONSE, delay=0.02)
+        task = asyncio.ensure_future(self.client.predict("Hello"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.answer(LUIS_RESPONSE)
+        await self.client.predict("Hello")
+        self.assertFalse(self.client.breaker.is_open)
+
+
+if __name__ == '__main__':
+    unittest.main()
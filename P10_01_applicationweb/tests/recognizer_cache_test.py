@@ -0,0 +1,59 @@
+import unittest
+import os
+import sys
+import inspect
+from datetime import datetime
+from unittest import mock
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from botbuilder.core import RecognizerResult
+from botbuilder.schema import Activity
+from helpers import recognizer_cache
+
+
+class test_recognizer_cache(unittest.TestCase):
+
+    """Test the LRU/TTL cache of recognizer results"""
+
+    def test_activity_key(self):
+        """Test keys ignore case and spacing but not the locale or the day"""
+        timestamp = datetime(2022, 5, 1, 10)
+        key = recognizer_cache.activity_key(Activity(text="Book  a Flight ", locale="en-US", timestamp=timestamp))
+        self.assertEqual(key, ("book a flight", "en-US", "2022-05-01"))
+        self.assertEqual(key, recognizer_cache.activity_key(
+            Activity(text="book a flight", locale="en-US", timestamp=datetime(2022, 5, 1, 23))))
+        self.assertNotEqual(key, recognizer_cache.activity_key(
+            Activity(text="book a flight", locale="fr-FR", timestamp=timestamp)))
+        self.assertNotEqual(key, recognizer_cache.activity_key(
+            Activity(text="book a flight", locale="en-US", timestamp=datetime(2022, 5, 2))))
+
+    def test_ttl(self):
+        """Test entries expire after their time to live"""
+        cache = recognizer_cache.RecognizerCache(10, ttl=60)
+        result = RecognizerResult(text="yes")
+        with mock.patch.object(recognizer_cache.time, "monotonic", return_value=100):
+            cache.set("key", result)
+        with mock.patch.object(recognizer_cache.time, "monotonic", return_value=159):
+            self.assertIs(cache.get("key"), result)
+        with mock.patch.object(recognizer_cache.time, "monotonic", return_value=161):
+            self.assertIsNone(cache.get("key"))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_lru(self):
+        """Test the least recently used entry is evicted"""
+        cache = recognizer_cache.RecognizerCache(2, ttl=60)
+        cache.set("first", RecognizerResult(text="first"))
+        cache.set("second", RecognizerResult(text="second"))
+        cache.get("first")
+        cache.set("third", RecognizerResult(text="third"))
+        self.assertEqual(len(cache), 2)
+        self.assertIsNotNone(cache.get("first"))
+        self.assertIsNone(cache.get("second"))
+        self.assertIsNotNone(cache.get("third"))
+
+
+if __name__ == '__main__':
+    unittest.main()
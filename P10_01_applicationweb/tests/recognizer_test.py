@@ -0,0 +1,186 @@
+import unittest
+import asyncio
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from botbuilder.core import TurnContext
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount
+from azure.cognitiveservices.language.luis.runtime.models import LuisResult
+from config import DefaultConfig
+from flight_booking_recognizer import FlightBookingRecognizer, LocalRecognizer
+from helpers.luis_client import LuisUnavailableError
+
+LUIS_RESPONSE = {
+    "query": "I want to go to Paris",
+    "topScoringIntent": {"intent": "book", "score": 0.9},
+    "entities": [{"entity": "paris", "type": "dst_city", "startIndex": 16, "endIndex": 20, "score": 0.9}],
+}
+
+
+class FakeAdapter:
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_activities(self, context, activities):
+        self.sent += activities
+        return []
+
+
+class FakeClient:
+
+    """LUIS client answering LUIS_RESPONSE, or failing while unavailable is True or error is set"""
+
+    app_id = "app"
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.unavailable = False
+        self.error = None
+
+    async def predict(self, text):
+        self.calls.append(text)
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        if self.unavailable:
+            raise LuisUnavailableError("LUIS answered 503")
+        return LuisResult.deserialize(LUIS_RESPONSE)
+
+    async def close(self):
+        pass
+
+
+def get_config(cache_size=10, prefetch=False):
+    configuration = DefaultConfig()
+    configuration.LUIS_CACHE_SIZE = cache_size
+    configuration.LOCAL_RECOGNIZER_THRESHOLD = 2.0
+    configuration.LUIS_PREFETCH = prefetch
+    return configuration
+
+
+def get_recognizer(client, **kwargs):
+    recognizer = FlightBookingRecognizer(get_config(**kwargs))
+    recognizer._client = client
+    return recognizer
+
+
+def get_context(text, conversation="conversation"):
+    activity = Activity(
+        type=ActivityTypes.message, text=text, channel_id="test", locale="en-US",
+        from_property=ChannelAccount(id="user"), recipient=ChannelAccount(id="bot"),
+        conversation=ConversationAccount(id=conversation))
+    return TurnContext(FakeAdapter(), activity)
+
+
+class test_local_recognizer(unittest.TestCase):
+
+    """Test the local recognizer"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.recognizer = LocalRecognizer()
+
+    def get_entities(self, text):
+        result, confidence = self.recognizer.recognize_text(text)
+        if result is None:
+            return None, confidence
+        return {name: values for name, values in result.entities.items() if name != "$instance"}, confidence
+
+    def test_roles(self):
+        """Test cities get their role from the words around them"""
+        self.assertEqual(self.get_entities("London to Paris"),
+                         ({"or_city": ["london"], "dst_city": ["paris"]}, 1.0))
+        self.assertEqual(self.get_entities("fly from Paris to London"),
+                         ({"or_city": ["paris"], "dst_city": ["london"]}, 1.0))
+        self.assertEqual(self.get_entities("fly to London from Paris"),
+                         ({"dst_city": ["london"], "or_city": ["paris"]}, 1.0))
+        entities, confidence = self.get_entities("book a flight to Paris on 2022-05-01 and return on 2022-05-08 for $500")
+        self.assertEqual(confidence, 1.0)
+        self.assertEqual(entities["str_date"], ["2022-05-01"])
+        self.assertEqual(entities["end_date"], ["2022-05-08"])
+        self.assertEqual(entities["budget"], ["500"])
+
+    def test_ambiguous(self):
+        """Test ambiguous utterances are left to LUIS"""
+        self.assertEqual(self.get_entities("paris to paris"), (None, 0.0))
+        self.assertEqual(self.get_entities("fly to Paris to London"), (None, 0.0))
+        self.assertEqual(self.get_entities("Paris"), (None, 0.0))
+        self.assertEqual(self.get_entities("fly to paris on 2022-13-45"), (None, 0.0))
+        self.assertEqual(self.get_entities("fly to paris on 2022-05-01 and 2022-05-08 or 2022-05-09"), (None, 0.0))
+
+
+class test_recognizer(unittest.IsolatedAsyncioTestCase):
+
+    """Test FlightBookingRecognizer"""
+
+    async def test_cache(self):
+        """Test LUIS results are cached but not degraded ones"""
+        client = FakeClient()
+        client.unavailable = True
+        recognizer = get_recognizer(client)
+
+        result = await recognizer.recognize(get_context("I want to go to Paris"))
+        self.assertEqual(list(result.intents), ["book"])
+        self.assertEqual(result.entities, {})
+        self.assertTrue(result.properties["degraded"])
+
+        client.unavailable = False
+        context = get_context("I want to go to Paris")
+        result = await recognizer.recognize(context)
+        self.assertEqual(result.entities["dst_city"], ["paris"])
+        self.assertEqual(len(client.calls), 2)
+        self.assertEqual(context.adapter.sent[0].type, ActivityTypes.trace)
+
+        result = await recognizer.recognize(get_context("i want to go  to paris"))
+        self.assertEqual(result.entities["dst_city"], ["paris"])
+        self.assertEqual(len(client.calls), 2)
+
+
+    async def test_single_flight(self):
+        """Test concurrent identical utterances share a single LUIS call"""
+        client = FakeClient(delay=0.01)
+        recognizer = get_recognizer(client, cache_size=0)
+        results = await asyncio.gather(
+            recognizer.recognize(get_context("I want to go to Paris", "first")),
+            recognizer.recognize(get_context("I want to go to Paris", "second")))
+        self.assertEqual(len(client.calls), 1)
+        self.assertEqual([result.entities["dst_city"] for result in results], [["paris"], ["paris"]])
+        self.assertEqual(recognizer._in_flight, {})
+
+    async def test_single_flight_cancel(self):
+        """Test a cancelled turn does not cancel the LUIS call shared with another turn"""
+        client = FakeClient(delay=0.01)
+        recognizer = get_recognizer(client, cache_size=0)
+        cancelled = asyncio.ensure_future(recognizer.recognize(get_context("I want to go to Paris", "first")))
+        waiting = asyncio.ensure_future(recognizer.recognize(get_context("I want to go to Paris", "second")))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+
+        result = await waiting
+        self.assertTrue(cancelled.cancelled())
+        self.assertEqual(result.entities["dst_city"], ["paris"])
+        self.assertEqual(len(client.calls), 1)
+
+    async def test_single_flight_error(self):
+        """Test a failed LUIS call is not shared with later turns"""
+        client = FakeClient()
+        client.error = RuntimeError("bug")
+        recognizer = get_recognizer(client, cache_size=0)
+        with self.assertRaises(RuntimeError):
+            await recognizer.recognize(get_context("I want to go to Paris"))
+        self.assertEqual(recognizer._in_flight, {})
+
+        client.error = None
+        result = await recognizer.recognize(get_context("I want to go to Paris"))
+        self.assertEqual(result.entities["dst_city"], ["paris"])
+        self.assertEqual(len(client.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
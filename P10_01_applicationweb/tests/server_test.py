@@ -0,0 +1,117 @@
+import unittest
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import inspect
+import subprocess
+import urllib.request
+from unittest import mock
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import server
+
+
+class test_master(unittest.TestCase):
+
+    """Test the restart of workers by the master"""
+
+    def setUp(self):
+        args = server.parse_args(["--workers", "2", "--max-restarts", "3"])
+        self.master = server.Master(None, args)
+        self.spawned = []
+        self.master.spawn = self.spawned.append
+
+    def test_backoff(self):
+        """Test quick exits are restarted with an exponential backoff"""
+        delays = []
+        for _ in range(3):
+            self.master.on_worker_exit(0, uptime=1, now=100)
+            delays.append(self.master.pending[0] - 100)
+        self.assertEqual(delays, [1, 2, 4])
+        self.assertFalse(self.master.stopping)
+
+        self.master.spawn_pending(103)
+        self.assertEqual(self.spawned, [])
+        self.master.spawn_pending(104)
+        self.assertEqual(self.spawned, [0])
+        self.assertEqual(self.master.pending, {})
+
+        # A worker which ran long enough is restarted at once
+        self.master.on_worker_exit(0, uptime=60, now=200)
+        self.assertEqual(self.master.pending, {0: 200})
+        self.assertEqual(self.master.failures[0], 0)
+
+    def test_give_up(self):
+        """Test the master stops after too many quick exits"""
+        with mock.patch("sys.stderr"):
+            for _ in range(4):
+                self.master.on_worker_exit(1, uptime=1, now=100)
+        self.assertTrue(self.master.stopping)
+        self.assertTrue(self.master.failed)
+        self.assertNotIn(0, self.master.failures)
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_health(port):
+    """Health of the worker probed on port, None while it does not answer"""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=0.5) as response:
+            return json.load(response)
+    except OSError:
+        return None
+
+
+@unittest.skipUnless(hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT"), "Workers are forked")
+class test_reload(unittest.TestCase):
+
+    """Test a reload of the workers started by server.py"""
+
+    def wait_for(self, port, generation, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            health = get_health(port)
+            if health is not None and health["generation"] == generation:
+                return health
+            time.sleep(0.2)
+        self.fail(f"Generation {generation} not serving on port {port}")
+
+    def test_reload_health_port(self):
+        """Test the new workers can serve /health on the ports of the old ones"""
+        health_port = get_free_port()
+        # Stands for a worker of the previous generation still holding the health port
+        previous = socket.socket()
+        previous.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        previous.bind(("127.0.0.1", health_port))
+        previous.listen()
+        self.addCleanup(previous.close)
+        # No telemetry nor storage file during the tests
+        env = dict(os.environ, AppInsightsInstrumentationCnx="", StateStoragePath="")
+        master = subprocess.Popen(
+            [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(get_free_port()), "--workers", "1",
+             "--health-port", str(health_port), "--shutdown-timeout", "1"],
+            cwd=parentdir, env=env, stderr=subprocess.PIPE, text=True)
+        try:
+            self.wait_for(health_port, 0)
+            for generation in (1, 2):
+                master.send_signal(signal.SIGHUP)
+                self.wait_for(health_port, generation)
+            self.assertIsNone(master.poll())
+        finally:
+            master.terminate()
+            _, errors = master.communicate(timeout=30)
+        self.assertNotIn("exited", errors)
+        self.assertEqual(master.returncode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
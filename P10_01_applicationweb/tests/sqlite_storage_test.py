@@ -0,0 +1,105 @@
+import unittest
+import os
+import sys
+import inspect
+import tempfile
+import zlib
+from unittest import mock
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import sqlite_storage
+
+
+class Details:
+
+    """State object stored with pickle"""
+
+    def __init__(self, destination):
+        self.destination = destination
+        self.e_tag = "*"
+
+
+class test_sqlite_storage(unittest.IsolatedAsyncioTestCase):
+
+    """Test the SQLite storage of the bot state"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = sqlite_storage.SqliteStorage(self.directory.name, shards=3, ttl=10)
+
+    def tearDown(self):
+        self.storage._executor.shutdown()
+        self.directory.cleanup()
+
+    async def test_round_trip(self):
+        """Test objects and dicts are read as written"""
+        await self.storage.write({"object": Details("Paris"), "dict": {"count": 2, "e_tag": "*"}})
+        data = await self.storage.read(["object", "dict", "missing"])
+        self.assertEqual(sorted(data), ["dict", "object"])
+        self.assertIsInstance(data["object"], Details)
+        self.assertEqual(data["object"].destination, "Paris")
+        self.assertEqual(data["dict"]["count"], 2)
+
+        await self.storage.delete(["object"])
+        self.assertEqual(list(await self.storage.read(["object", "dict"])), ["dict"])
+
+    async def test_e_tag(self):
+        """Test a write with an outdated e_tag is refused"""
+        await self.storage.write({"key": {"count": 1}})
+        first = (await self.storage.read(["key"]))["key"]
+        second = (await self.storage.read(["key"]))["key"]
+
+        first["count"] = 2
+        await self.storage.write({"key": first})
+        # The e_tag of the caller is updated, so it can write again
+        await self.storage.write({"key": first})
+
+        second["count"] = 3
+        with self.assertRaises(KeyError):
+            await self.storage.write({"key": second})
+        self.assertEqual((await self.storage.read(["key"]))["key"]["count"], 2)
+
+        second["e_tag"] = "*"
+        await self.storage.write({"key": second})
+        self.assertEqual((await self.storage.read(["key"]))["key"]["count"], 3)
+
+    async def test_ttl(self):
+        """Test state expires and is purged"""
+        with mock.patch.object(sqlite_storage.time, "time", return_value=100):
+            await self.storage.write({"old": {"e_tag": "*"}})
+        with mock.patch.object(sqlite_storage.time, "time", return_value=105):
+            self.assertEqual(list(await self.storage.read(["old"])), ["old"])
+        with mock.patch.object(sqlite_storage.time, "time", return_value=111):
+            self.assertEqual(await self.storage.read(["old"]), {})
+            for index in range(20):
+                await self.storage.write({f"new {index}": {"e_tag": "*"}})
+
+        rows = sum(
+            shard.connection.execute("SELECT COUNT(*) FROM state WHERE key = 'old'").fetchone()[0]
+            for shard in self.storage._shards)
+        self.assertEqual(rows, 0)
+
+    async def test_shards(self):
+        """Test keys are spread over the databases by crc32"""
+        keys = [f"conversation {index}" for index in range(30)]
+        await self.storage.write({key: {"e_tag": "*"} for key in keys})
+        for index, shard in enumerate(self.storage._shards):
+            stored = [row[0] for row in shard.connection.execute("SELECT key FROM state")]
+            self.assertEqual(sorted(stored), sorted(
+                key for key in keys if zlib.crc32(key.encode("utf-8")) % 3 == index))
+            self.assertTrue(stored)
+        self.assertEqual(len(await self.storage.read(keys)), 30)
+
+    def test_connection_per_process(self):
+        """Test a forked process opens its own connection"""
+        shard = self.storage._shards[0]
+        connection = shard.connection
+        self.assertIs(shard.connection, connection)
+        with mock.patch.object(sqlite_storage.os, "getpid", return_value=os.getpid() + 1):
+            self.assertIsNot(shard.connection, connection)
+
+
+if __name__ == '__main__':
+    unittest.main()
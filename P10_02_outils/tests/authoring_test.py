@@ -0,0 +1,284 @@
+import unittest
+import os
+import sys
+import inspect
+import threading
+import asyncio
+from unittest import mock
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir) + '/tools'
+sys.path.insert(0, parentdir)
+import authoring_and_predict
+from msrest.exceptions import HttpOperationError
+
+
+class FakeResponse:
+
+    """HTTP response of a throttled call"""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def http_error(status_code):
+    error = HttpOperationError.__new__(HttpOperationError)
+    error.response = FakeResponse(status_code)
+    return error
+
+
+class FakeResult:
+
+    def __init__(self, has_error):
+        self.has_error = has_error
+
+
+class FakeExamples:
+
+    """Examples API throttling the first call"""
+
+    def __init__(self):
+        self.batches = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def batch(self, app_id, version, batch):
+        with self.lock:
+            self.calls += 1
+            if self.calls == 1:
+                raise http_error(429)
+            self.batches.append(batch)
+        return [FakeResult(utterance["text"] == "bad") for utterance in batch]
+
+
+class FakeClient:
+
+    def __init__(self):
+        self.examples = FakeExamples()
+
+
+class FakeStatus:
+
+    def __init__(self, model_id, status):
+        self.model_id = model_id
+        self.details = FakeResult(False)
+        self.details.status = status
+        self.details.failure_reason = "bad utterances"
+
+
+class FakeTrain:
+
+    """Train API returning a list of statuses per call"""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = 0
+
+    def get_status(self, app_id, version):
+        statuses = self.statuses[min(self.calls, len(self.statuses) - 1)]
+        self.calls += 1
+        return [FakeStatus(index, status) for index, status in enumerate(statuses)]
+
+
+def fake_luis(statuses, timeout=600):
+    luis = authoring_and_predict.CreateLUIS.__new__(authoring_and_predict.CreateLUIS)
+    luis.client = FakeClient()
+    luis.client.train = FakeTrain(statuses)
+    luis.app_id = "app"
+    luis.app_name = "Fly Me test"
+    luis.version = "0.1"
+    luis.timeout = timeout
+    return luis
+
+
+class test_authoring(unittest.TestCase):
+
+    """Test batch upload of utterances"""
+
+    def test_get_chunks(self):
+        """Test chunks are at most of the given size and keep all items"""
+        chunks = authoring_and_predict.get_chunks(list(range(250)), 100)
+        self.assertEqual([len(chunk) for chunk in chunks], [100, 100, 50])
+        self.assertEqual(sum(chunks, []), list(range(250)))
+        self.assertEqual(authoring_and_predict.get_chunks([], 100), [])
+
+    def test_with_retry(self):
+        """Test throttled calls are retried and other errors raised"""
+        calls = []
+
+        def throttled():
+            calls.append(1)
+            if len(calls) < 3:
+                raise http_error(429)
+            return "done"
+
+        self.assertEqual(authoring_and_predict.with_retry(throttled, backoff=0), "done")
+        self.assertEqual(len(calls), 3)
+
+        def failing():
+            raise http_error(400)
+
+        with self.assertRaises(HttpOperationError):
+            authoring_and_predict.with_retry(failing, backoff=0)
+
+    def test_add_utterance(self):
+        """Test utterances are uploaded in batches"""
+        utterances = [{"text": f"utterance {index}"} for index in range(230)] + [{"text": "bad"}]
+        luis = authoring_and_predict.CreateLUIS.__new__(authoring_and_predict.CreateLUIS)
+        luis.client = FakeClient()
+        luis.app_id = "app"
+        luis.version = "0.1"
+        luis.workers = 2
+        luis.train = "utterances.json"
+        with mock.patch.object(authoring_and_predict, "get_json", return_value=utterances), \
+                mock.patch.object(authoring_and_predict.time, "sleep"):
+            luis.add_utterance()
+
+        batches = luis.client.examples.batches
+        self.assertEqual(sorted(len(batch) for batch in batches), [31, 100, 100])
+        uploaded = [utterance for batch in batches for utterance in batch]
+        self.assertEqual(sorted(u["text"] for u in uploaded), sorted(u["text"] for u in utterances))
+
+    def test_wait_for_training(self):
+        """Test training is polled until every model is trained"""
+        luis = fake_luis([["Queued", "InProgress"], ["Success", "InProgress"], ["Success", "UpToDate"]])
+        asyncio.run(luis.wait_for_training(initial_delay=0.001))
+        self.assertEqual(luis.client.train.calls, 3)
+
+        luis = fake_luis([["InProgress", "Fail"]])
+        with self.assertRaises(RuntimeError):
+            asyncio.run(luis.wait_for_training(initial_delay=0.001))
+
+        luis = fake_luis([["InProgress"]], timeout=0.01)
+        with self.assertRaises(TimeoutError):
+            asyncio.run(luis.wait_for_training(initial_delay=0.004))
+
+    def test_get_utterance_key(self):
+        """Test utterance keys ignore case, spacing and entity order"""
+        get_utterance_key = authoring_and_predict.get_utterance_key
+        key = get_utterance_key(" From Rome to  Paris", "book", [("or_city", 6, 10), ("dst_city", 15, 20)])
+        self.assertEqual(key, get_utterance_key("from rome to paris", "book", [("dst_city", 13, 18), ("or_city", 5, 9)]))
+        self.assertNotEqual(key, get_utterance_key("from rome to paris", "None", [("dst_city", 13, 18), ("or_city", 5, 9)]))
+        self.assertNotEqual(key, get_utterance_key("from rome to paris", "book", [("dst_city", 13, 18)]))
+
+    def test_get_utterance_key_span(self):
+        """Test utterance keys change when only a span changes"""
+        get_utterance_key = authoring_and_predict.get_utterance_key
+        key = get_utterance_key("fly to new york", "book", [("dst_city", 7, 15)])
+        self.assertNotEqual(key, get_utterance_key("fly to new york", "book", [("dst_city", 7, 10)]))
+        self.assertNotEqual(key, get_utterance_key("fly to new york", "book", [("dst_city", 11, 15)]))
+        self.assertEqual(key, get_utterance_key("Fly to  New York", "book", [("dst_city", 8, 16)]))
+
+    def test_get_token_spans(self):
+        """Test tokens of LUIS are found in the utterance"""
+        spans = authoring_and_predict.get_token_spans("Fly to Rome, $500", ["fly", "to", "rome", ",", "$", "500"])
+        self.assertEqual(spans, [(0, 3), (4, 6), (7, 11), (11, 12), (13, 14), (14, 17)])
+
+    def test_get_next_version(self):
+        """Test versions are incremented"""
+        self.assertEqual(authoring_and_predict.get_next_version("0.1"), "0.2")
+        self.assertEqual(authoring_and_predict.get_next_version("0.9"), "0.10")
+        self.assertEqual(authoring_and_predict.get_next_version("beta"), "beta.1")
+
+    def test_update(self):
+        """Test only the changes of the train set are applied to a clone of the version"""
+        service = FakeAuthoring({
+            "0.1": [("Go to Paris", "book", [("dst_city", 6, 11)]), ("Go to Rome", "book", [("dst_city", 6, 10)]),
+                    ("Hello", "None", [])]})
+        train = [
+            {"text": "go to  paris", "intentName": "book",
+             "entityLabels": [{"entityName": "dst_city", "startCharIndex": 7, "endCharIndex": 12}]},
+            # Only the span changed
+            {"text": "Go to Rome", "intentName": "book",
+             "entityLabels": [{"entityName": "dst_city", "startCharIndex": 3, "endCharIndex": 10}]},
+        ]
+        luis = fake_update(service)
+        with mock.patch.object(authoring_and_predict, "get_json", return_value=train):
+            asyncio.run(luis.run())
+
+        self.assertEqual(sorted(service.utterances), ["0.1", "0.2"])
+        self.assertEqual(sorted(service.utterances["0.2"].values()), [
+            ("Go to Paris", "book", [("dst_city", 6, 11)]), ("Go to Rome", "book", [("dst_city", 3, 10)])])
+        self.assertEqual(len(service.utterances["0.1"]), 3)
+        self.assertEqual(service.published, ["0.2"])
+
+        # Nothing to do when the train set has not changed
+        luis = fake_update(service, "0.2")
+        with mock.patch.object(authoring_and_predict, "get_json", return_value=train):
+            asyncio.run(luis.run())
+        self.assertEqual(sorted(service.utterances), ["0.1", "0.2"])
+        self.assertEqual(service.published, ["0.2"])
+
+
+def get_entity_label(text, name, start, end):
+    """Entity label of an example, given in tokens by LUIS"""
+    return mock.Mock(entity_name=name, start_token_index=len(text[:start].split()),
+                     end_token_index=len(text[:end].split()) - 1)
+
+
+class FakeAuthoring:
+
+    """Authoring API keeping the utterances of each version in memory"""
+
+    def __init__(self, versions):
+        self.ids = iter(range(1, 1000))
+        self.utterances = {
+            version: {next(self.ids): utterance for utterance in utterances}
+            for version, utterances in versions.items()}
+        self.published = []
+        self.versions = self
+        self.examples = self
+        self.train = self
+        self.apps = self
+
+    def clone(self, app_id, version_id, version=None):
+        self.utterances[version] = {next(self.ids): u for u in self.utterances[version_id].values()}
+        return version
+
+    def list(self, app_id, version, skip=0, take=100):
+        items = sorted(self.utterances[version].items())[skip:skip + take]
+        return [mock.Mock(id=example_id, text=text, tokenized_text=text.lower().split(), intent_label=intent,
+                          entity_labels=[get_entity_label(text, *entity) for entity in entities])
+                for example_id, (text, intent, entities) in items]
+
+    def delete(self, app_id, version, example_id):
+        del self.utterances[version][example_id]
+
+    def batch(self, app_id, version, batch):
+        for utterance in batch:
+            self.utterances[version][next(self.ids)] = (
+                utterance["text"], utterance["intentName"],
+                [(entity["entityName"], entity["startCharIndex"], entity["endCharIndex"])
+                 for entity in utterance["entityLabels"]])
+        return [FakeResult(False) for _ in batch]
+
+    def train_version(self, app_id, version):
+        pass
+
+    def get_status(self, app_id, version):
+        return [FakeStatus(0, "Success")]
+
+    def update_settings(self, app_id, is_public):
+        pass
+
+    def publish(self, app_id, version, is_staging):
+        self.published.append(version)
+
+
+def fake_update(service, version="0.1"):
+    luis = authoring_and_predict.UpdateLUIS.__new__(authoring_and_predict.UpdateLUIS)
+    luis.client = service
+    luis.app_id = "app"
+    luis.base_version = version
+    luis.version = authoring_and_predict.get_next_version(version)
+    luis.app_name = "app " + luis.version
+    luis.workers = 2
+    luis.timeout = 10
+    luis.train = "utterances.json"
+    luis.PAGE_SIZE = 1
+    return luis
+
+
+if __name__ == '__main__':
+    unittest.main()
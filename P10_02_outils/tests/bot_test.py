@@ -14,7 +14,7 @@ class test_luis(unittest.TestCase):
     def setUp(self):
         """Init tests, by requesting luis."""
         configuration = DefaultConfig()
-        client = LUISRuntimeClient('https://' + configuration.LUIS_API_HOST_NAME,CognitiveServicesCredentials(configuration.LUIS_API_KEY))
+        client = LUISRuntimeClient(configuration.LUIS_ENDPOINT,CognitiveServicesCredentials(configuration.LUIS_API_KEY))
         request ='I  want to travel from Paris to New York from november 2 and return on november 10 2021 with a budget of 2500'
         self.response = client.prediction.resolve(configuration.LUIS_APP_ID, query=request)
         self.log = logging.getLogger( "SomeTest.testSomething" )
@@ -18,6 +18,11 @@ class DefaultConfig:
     LUIS_API_KEY = os.environ.get("LuisAPIKey", "06517d0c606c4cafb0ab434f6ff14bfc")
     # LUIS endpoint host name, ie "westus.api.cognitive.microsoft.com"
     LUIS_API_HOST_NAME = os.environ.get("LuisAPIHostName", "westeurope.api.cognitive.microsoft.com")
+    # Full LUIS endpoint URL, ie "http://localhost:8080" for the local stand-in server (tools/luis_server.py)
+    LUIS_ENDPOINT = os.environ.get(
+        "LuisEndpoint",
+        LUIS_API_HOST_NAME if LUIS_API_HOST_NAME.startswith(("http://", "https://")) else "https://" + LUIS_API_HOST_NAME
+    )
     APPINSIGHTS_INSTRUMENTATION_KEY = os.environ.get(
         "AppInsightsInstrumentationKey", "9856beed-3403-4ace-9f41-d7da4e9838d5"
     )
@@ -0,0 +1,119 @@
+import uuid
+import os.path
+import json
+import csv
+import unittest
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, currentdir)
+parentdir = os.path.dirname(currentdir) + '/tools'
+sys.path.insert(0, parentdir)
+import evaluation
+import do_predictions
+from predictions_test import UTTERANCES, RESPONSES, FakePredict
+
+
+def get_evaluation():
+    result = evaluation.Evaluation()
+    for utterance in UTTERANCES:
+        result.add(utterance, RESPONSES[utterance["text"]])
+    return result
+
+
+class test_evaluation(unittest.TestCase):
+
+    """Test evaluation metrics"""
+
+    def test_match_spans(self):
+        """Test spans are matched when they overlap with the same key"""
+        gold = evaluation.np.array([[0, 0, 5], [0, 10, 15], [1, 0, 5]])
+        predicted = evaluation.np.array([[1, 4, 8], [0, 3, 12], [2, 0, 5]])
+        gold_matched, predicted_matched = evaluation.match_spans(gold, predicted)
+        self.assertEqual(gold_matched.tolist(), [True, True, True])
+        self.assertEqual(predicted_matched.tolist(), [True, True, False])
+
+        predicted = evaluation.np.array([[0, 5, 10]])
+        gold_matched, predicted_matched = evaluation.match_spans(gold, predicted)
+        self.assertEqual(gold_matched.tolist(), [False, False, False])
+        self.assertEqual(predicted_matched.tolist(), [False])
+
+    def test_compute(self):
+        """Test intent and entity metrics"""
+        metrics = get_evaluation().compute(samples=0)
+        self.assertEqual(metrics["intent"]["labels"], ["book", "None"])
+        self.assertEqual(metrics["intent"]["confusion_matrix"], [[2, 0], [1, 0]])
+        self.assertAlmostEqual(metrics["intent"]["accuracy"], 2 / 3)
+        self.assertAlmostEqual(metrics["intent"]["scores"]["book"]["precision"], 2 / 3)
+        self.assertEqual(metrics["intent"]["scores"]["book"]["recall"], 1)
+        self.assertEqual(metrics["intent"]["scores"]["None"]["f1"], 0)
+
+        entities = metrics["entities"]
+        self.assertEqual(entities["dst_city"]["precision"], 1)
+        self.assertEqual(entities["dst_city"]["recall"], 0.5)
+        self.assertAlmostEqual(entities["dst_city"]["f1"], 2 / 3)
+        self.assertEqual(entities["or_city"]["f1"], 1)
+        self.assertEqual(entities["budget"]["support"], 0)
+        self.assertAlmostEqual(entities["micro"]["recall"], 2 / 3)
+        self.assertAlmostEqual(entities["micro"]["f1"], 0.8)
+        self.assertNotIn("f1_interval", entities["micro"])
+
+        with self.assertRaises(ValueError):
+            evaluation.Evaluation().compute()
+
+    def test_bootstrap(self):
+        """Test confidence intervals are reproducible and contain the scores"""
+        result = get_evaluation()
+        metrics = result.compute(samples=200, seed=1)
+        self.assertEqual(metrics, result.compute(samples=200, seed=1))
+        low, high = metrics["intent"]["accuracy_interval"]
+        self.assertTrue(0 <= low <= metrics["intent"]["accuracy"] <= high <= 1)
+        low, high = metrics["entities"]["micro"]["f1_interval"]
+        self.assertTrue(0 <= low <= metrics["entities"]["micro"]["f1"] <= high <= 1)
+
+    def test_save(self):
+        """Test metrics are written as JSON and CSV"""
+        folder = str(uuid.uuid4())
+        os.makedirs(folder)
+        metrics = get_evaluation().save(folder, samples=50, seed=1)
+
+        with open(os.path.join(folder, 'evaluation.json')) as json_file:
+            self.assertEqual(json.load(json_file), metrics)
+        with open(os.path.join(folder, 'metrics.csv')) as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        self.assertEqual([row['label'] for row in rows],
+                         ['book', 'None'] + evaluation.ENTITIES + ['micro'])
+        with open(os.path.join(folder, 'confusion_matrix.csv')) as csv_file:
+            self.assertEqual(list(csv.reader(csv_file)),
+                             [['true/predicted', 'book', 'None'], ['book', '2', '0'], ['None', '1', '0']])
+        for filename in os.listdir(folder):
+            os.remove(os.path.join(folder, filename))
+        os.rmdir(folder)
+
+    def test_update_accuracy(self):
+        """Test means are computed on all the values"""
+        predict = do_predictions.Predict(config={})
+        for value in (1, 0, 1):
+            predict.update_accuracy("dst_city", value, "mean")
+        self.assertAlmostEqual(predict.accuracy["dst_city"], 2 / 3)
+
+    def test_predict(self):
+        """Test predictions are collected for the evaluation"""
+        filename = str(uuid.uuid4()) + ".tmp"
+        with open(filename, 'w') as fp:
+            json.dump(UTTERANCES, fp)
+        predict = FakePredict(config={})
+        accuracy = predict.predict_concurrent(filename, "all", workers=2, rate=100)
+        os.remove(filename)
+
+        self.assertEqual(len(predict.evaluation), 3)
+        self.assertEqual(accuracy["intent"], 2)
+        self.assertEqual(accuracy["dst_city"], 0.5)
+        self.assertEqual(accuracy["or_city"], 1)
+        self.assertAlmostEqual(accuracy["accuracy"], (1 + 0.5 + 0) / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import os
+import sys
+import inspect
+
+from aiohttp.test_utils import TestClient, TestServer
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir) + '/tools'
+sys.path.insert(0, parentdir)
+import luis_server
+
+MODEL_FILE = os.path.join(os.path.dirname(currentdir), "../P10_01_applicationweb/cognitiveModels/FlightBooking.json")
+TRAIN_FILE = os.path.join(parentdir, "frames/frames_train.json")
+
+
+class test_stand_in_model(unittest.TestCase):
+
+    """Test stand-in LUIS model"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.model = luis_server.StandInModel(MODEL_FILE, [TRAIN_FILE])
+
+    def test_known_utterance(self):
+        """Test that dataset utterances are answered with their labels"""
+        intent, score, entities = self.model.analyze("I want to go to Kabul from Baltimore")
+        self.assertEqual(intent, "book")
+        self.assertIn({'type': 'dst_city', 'start': 16, 'end': 21, 'text': 'Kabul'}, entities)
+        self.assertIn({'type': 'or_city', 'start': 27, 'end': 36, 'text': 'Baltimore'}, entities)
+
+    def test_rules(self):
+        """Test rule based labels of an unknown utterance"""
+        intent, score, entities = self.model.analyze(
+            "book a flight from Paris to New York on 2022-01-01 and return on 2022-02-01 for $2000")
+        found = {entity['type']: entity['text'] for entity in entities}
+        self.assertEqual(intent, "book")
+        self.assertEqual(found, {'or_city': 'Paris', 'dst_city': 'New York', 'str_date': '2022-01-01',
+                                 'end_date': '2022-02-01', 'budget': '$2000'})
+
+    def test_timex(self):
+        """Test timex of dates"""
+        match = luis_server.DATE_PATTERN.search("leaving on Saturday, August 13, 2016")
+        self.assertEqual(luis_server.get_timex(match), "2016-08-13")
+        match = luis_server.DATE_PATTERN.search("on the 17th of August")
+        self.assertEqual(luis_server.get_timex(match), "XXXX-08-17")
+
+    def test_cancel(self):
+        """Test cancel intent"""
+        self.assertEqual(self.model.analyze("cancel")[0], "Cancel")
+
+
+class test_luis_server(unittest.IsolatedAsyncioTestCase):
+
+    """Test stand-in LUIS server routes"""
+
+    async def asyncSetUp(self):
+        model = luis_server.StandInModel(MODEL_FILE)
+        self.client = TestClient(TestServer(luis_server.create_app(model)))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def test_v3(self):
+        """Test the v3 prediction route"""
+        response = await self.client.get("/luis/prediction/v3.0/apps/app/slots/production/predict",
+                                         params={'query': 'go to paris', 'verbose': 'true'})
+        self.assertEqual(response.status, 200)
+        prediction = (await response.json())["prediction"]
+        self.assertEqual(prediction["topIntent"], "book")
+        self.assertEqual(prediction["entities"]["$instance"]["dst_city"][0]["type"], "dst_city")
+        self.assertEqual(prediction["entities"]["$instance"]["dst_city"][0]["text"], "paris")
+
+    async def test_v2(self):
+        """Test the v2 prediction route"""
+        response = await self.client.get("/luis/v2.0/apps/app", params={'q': 'fly to berlin on 2022-01-01'})
+        self.assertEqual(response.status, 200)
+        result = await response.json()
+        self.assertEqual(result["topScoringIntent"]["intent"], "book")
+        types = [entity["type"] for entity in result["entities"]]
+        self.assertIn("dst_city", types)
+        self.assertIn("builtin.datetimeV2.date", types)
+
+    async def test_error_rate(self):
+        """Test injected errors"""
+        await self.client.close()
+        model = luis_server.StandInModel(MODEL_FILE)
+        self.client = TestClient(TestServer(luis_server.create_app(model, error_rate=1.0, error_status=429)))
+        await self.client.start_server()
+        response = await self.client.get("/luis/v2.0/apps/app", params={'q': 'go to paris'})
+        self.assertEqual(response.status, 429)
+
+if __name__ == '__main__':
+    unittest.main()
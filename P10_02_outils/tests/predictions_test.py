@@ -0,0 +1,293 @@
+import uuid
+import os.path
+import json
+import time
+import unittest
+import os
+import sys
+import inspect
+import threading
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir) + '/tools'
+sys.path.insert(0, parentdir)
+import do_predictions
+import prediction_cache
+
+UTTERANCES = [
+    {"text": "Get me to Atlanta!", "intentName": "book",
+     "entityLabels": [{"startCharIndex": 10, "endCharIndex": 17, "entityName": "dst_city"}]},
+    {"text": "I want to go to Kabul from Baltimore", "intentName": "book",
+     "entityLabels": [{"startCharIndex": 16, "endCharIndex": 21, "entityName": "dst_city"},
+                      {"startCharIndex": 27, "endCharIndex": 36, "entityName": "or_city"}]},
+    {"text": "Hello", "intentName": "None", "entityLabels": []},
+]
+
+RESPONSES = {
+    "Get me to Atlanta!": {"prediction": {"topIntent": "book", "entities": {
+        "$instance": {"dst_city": [{"type": "dst_city", "text": "Atlanta", "startIndex": 10, "length": 7}]}}}},
+    "I want to go to Kabul from Baltimore": {"prediction": {"topIntent": "book", "entities": {
+        "$instance": {"or_city": [{"type": "or_city", "text": "Baltimore", "startIndex": 27, "length": 9}]}}}},
+    "Hello": {"prediction": {"topIntent": "book", "entities": {}}},
+}
+
+
+class FakePredict(do_predictions.Predict):
+
+    """Predict without network calls"""
+
+    def luis_predict(self, query, bucket=None):
+        if bucket is not None:
+            bucket.acquire()
+        return RESPONSES[query], True
+
+
+class QuotaPredict(FakePredict):
+
+    """Predict answering a quota error after a number of calls"""
+
+    def __init__(self, quota, **kwargs):
+        super().__init__(**kwargs)
+        self.queries = []
+        self.quota = quota
+
+    def luis_predict(self, query, bucket=None):
+        self.queries.append(query)
+        if len(self.queries) > self.quota:
+            return {"error": {"code": "403", "message": "Out of call volume quota"}}, True
+        return super().luis_predict(query, bucket)
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+
+    """LUIS endpoint failing every other request"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        server.keys.append(self.headers.get("Ocp-Apim-Subscription-Key"))
+        server.clients.add(self.client_address)
+        if len(server.requests) % 2:
+            body, status = b'{"error": "unavailable"}', 503
+        else:
+            body, status = json.dumps(RESPONSES["Hello"]).encode(), 200
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class test_do_predictions(unittest.TestCase):
+
+    """Test predictions"""
+
+    def setUp(self):
+        self.filename = str(uuid.uuid4()) + ".tmp"
+        with open(self.filename, 'w') as fp:
+            json.dump(UTTERANCES, fp)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_get_utterances(self):
+        """Test the number of utterances to predict"""
+        self.assertEqual(len(do_predictions.get_utterances(self.filename, 2)), 2)
+        self.assertEqual(len(do_predictions.get_utterances(self.filename, 0)), 1)
+        self.assertEqual(len(do_predictions.get_utterances(self.filename, "all")), 3)
+
+    def test_token_bucket(self):
+        """Test that the token bucket limits the request rate"""
+        bucket = do_predictions.TokenBucket(rate=20, capacity=1)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+        with self.assertRaises(ValueError):
+            do_predictions.TokenBucket(rate=0)
+
+    def test_predict_concurrent(self):
+        """Test that concurrent predictions give the same accuracy as sequential ones"""
+        expected = FakePredict(config={}).predict(self.filename, "all")
+        accuracy = FakePredict(config={}).predict_concurrent(self.filename, "all", workers=3, rate=100)
+        self.assertEqual(accuracy, expected)
+
+    def test_resume(self):
+        """Test that a resumed run only predicts the utterances missing in the checkpoint"""
+        expected = FakePredict(config={}).predict_concurrent(self.filename, "all", workers=2, rate=100)
+        checkpoint_file = str(uuid.uuid4()) + ".tmp"
+
+        checkpoint = do_predictions.Checkpoint(checkpoint_file)
+        predict = QuotaPredict(1, config={}, checkpoint=checkpoint)
+        with self.assertRaisesRegex(do_predictions.PredictionError, "quota"), \
+                mock.patch.object(do_predictions.time, "sleep"):
+            predict.predict(self.filename, "all")
+        self.assertEqual(len(predict.queries), 2)
+        checkpoint.close()
+
+        checkpoint = do_predictions.Checkpoint(checkpoint_file, resume=True)
+        self.assertEqual(list(checkpoint.predictions), [0])
+        self.assertIsNone(checkpoint.get(0, "Hello"))
+        predict = QuotaPredict(10, config={}, checkpoint=checkpoint)
+        accuracy = predict.predict_concurrent(self.filename, "all", workers=2, rate=100)
+        checkpoint.close()
+        self.assertEqual(accuracy, expected)
+        self.assertEqual(sorted(predict.queries), sorted(u["text"] for u in UTTERANCES[1:]))
+
+        # Everything is in the checkpoint, an interrupted line is ignored
+        with open(checkpoint_file, "a") as checkpoint_file_content:
+            checkpoint_file_content.write('{"index": 3, "te')
+        checkpoint = do_predictions.Checkpoint(checkpoint_file, resume=True)
+        predict = QuotaPredict(0, config={}, checkpoint=checkpoint)
+        self.assertEqual(predict.predict(self.filename, "all"), expected)
+        checkpoint.close()
+        self.assertEqual(predict.queries, [])
+
+        # The interrupted line is removed, so the next prediction is on its own line
+        checkpoint = do_predictions.Checkpoint(checkpoint_file, resume=True)
+        checkpoint.write(3, "Hello", RESPONSES["Hello"])
+        checkpoint.close()
+        with open(checkpoint_file) as checkpoint_file_content:
+            records = [json.loads(line) for line in checkpoint_file_content]
+        self.assertEqual([record["index"] for record in records], [0, 1, 2, 3])
+
+        # Without resume the checkpoint is emptied
+        do_predictions.Checkpoint(checkpoint_file).close()
+        self.assertEqual(os.path.getsize(checkpoint_file), 0)
+        os.remove(checkpoint_file)
+
+    def test_quota_concurrent(self):
+        """Test that concurrent predictions stop on an error"""
+        predict = QuotaPredict(1, config={})
+        with self.assertRaises(do_predictions.PredictionError):
+            predict.predict_concurrent(self.filename, "all", workers=1, rate=100)
+        self.assertEqual(len(predict.evaluation), 1)
+
+    def test_session(self):
+        """Test that failed requests are retried on a kept alive connection"""
+        server = ThreadingHTTPServer(("localhost", 0), FlakyHandler)
+        server.requests, server.keys, server.clients = [], [], set()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        config = {"predictionEndpoint": f"http://localhost:{server.server_port}/", "app_id": "app",
+                  "predictionKey": "key"}
+        predict = do_predictions.Predict(config=config, session=do_predictions.create_session(backoff=0))
+        try:
+            for _ in range(2):
+                self.assertEqual(predict.luis_predict("Hello"), (RESPONSES["Hello"], True))
+        finally:
+            predict.close()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(len(server.requests), 4)
+        self.assertTrue(server.requests[0].startswith("/luis/prediction/v3.0/apps/app/slots/production/predict?"))
+        self.assertNotIn("subscription-key", server.requests[0])
+        self.assertEqual(server.keys, ["key"] * 4)
+        self.assertEqual(len(server.clients), 1)
+
+
+class FakeResponse:
+
+    def json(self):
+        return {"error": "stale"}
+
+
+class FakeSession:
+
+    """HTTP session answering without network"""
+
+    def __init__(self):
+        self.headers = {}
+
+    def get(self, url, params=None, timeout=None):
+        return FakeResponse()
+
+
+class test_prediction_cache(unittest.TestCase):
+
+    """Test prediction cache"""
+
+    def setUp(self):
+        self.filename = str(uuid.uuid4()) + ".tmp"
+
+    def tearDown(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+    def test_key(self):
+        """Test that the key depends on the model version and the query"""
+        key = prediction_cache.PredictionCache.key("app", "production", "0.1", "Hello", {'verbose': 'true'})
+        self.assertEqual(key, prediction_cache.PredictionCache.key("app", "production", "0.1", "Hello", {'verbose': 'true'}))
+        self.assertNotEqual(key, prediction_cache.PredictionCache.key("app", "production", "0.2", "Hello", {'verbose': 'true'}))
+        self.assertNotEqual(key, prediction_cache.PredictionCache.key("app", "production", "0.1", "Hi", {'verbose': 'true'}))
+
+    def test_get_set(self):
+        """Test that a stored prediction is returned"""
+        cache = prediction_cache.PredictionCache(self.filename)
+        self.assertIsNone(cache.get("key"))
+        cache.set("key", "app", "production", "0.1", "Hello", RESPONSES["Hello"])
+        self.assertEqual(cache.get("key"), RESPONSES["Hello"])
+        cache.close()
+
+    def test_evict(self):
+        """Test that least recently used predictions are evicted"""
+        size = len(json.dumps(RESPONSES["Hello"]))
+        cache = prediction_cache.PredictionCache(self.filename, max_size=2 * size)
+        cache.set("first", "app", "production", "0.1", "Hello", RESPONSES["Hello"])
+        cache.set("second", "app", "production", "0.1", "Hello", RESPONSES["Hello"])
+        cache.get("first")
+        cache.set("third", "app", "production", "0.1", "Hello", RESPONSES["Hello"])
+        self.assertIsNotNone(cache.get("first"))
+        self.assertIsNone(cache.get("second"))
+        self.assertIsNotNone(cache.get("third"))
+        cache.close()
+
+    def test_predict_from_cache(self):
+        """Test that cached predictions do not call LUIS"""
+        config = {"predictionEndpoint": "http://localhost/", "app_id": "app", "predictionKey": "key", "version": "0.1"}
+        cache = prediction_cache.PredictionCache(self.filename)
+        key = prediction_cache.PredictionCache.key("app", "production", "0.1", "Hello", {
+            'query': "Hello",
+            'timezoneOffset': '0',
+            'verbose': 'true',
+            'show-all-intents': 'true',
+            'spellCheck': 'false',
+            'staging': 'false',
+        })
+        cache.set(key, "app", "production", "0.1", "Hello", RESPONSES["Hello"])
+
+        predict = do_predictions.Predict(config=config, cache=cache)
+        self.assertEqual(predict.luis_predict("Hello"), (RESPONSES["Hello"], False))
+
+        # Cached predictions are not rate limited
+        bucket = mock.Mock()
+        self.assertEqual(predict.luis_predict("Hello", bucket), (RESPONSES["Hello"], False))
+        bucket.acquire.assert_not_called()
+
+        # Without a version, the cache is not used
+        del config["version"]
+        cache.set(prediction_cache.PredictionCache.key("app", "production", "", "Hello", {
+            'query': "Hello",
+            'timezoneOffset': '0',
+            'verbose': 'true',
+            'show-all-intents': 'true',
+            'spellCheck': 'false',
+            'staging': 'false',
+        }), "app", "production", "", "Hello", RESPONSES["Hello"])
+        predict = do_predictions.Predict(config=config, cache=cache, session=FakeSession())
+        self.assertEqual(predict.luis_predict("Hello", bucket), ({"error": "stale"}, True))
+        bucket.acquire.assert_called_once_with()
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -32,6 +32,45 @@ class test_train_test_split(unittest.TestCase):
         expected = {'startCharIndex': 27, 'endCharIndex': 35, 'entityName': 'dst_city'}
         self.assertEqual(train_test_split.get_entity(arg, text), expected)
 
+    def test_entity_span_locator(self):
+        """Test entity values are found as whole words, on distinct occurrences, or fuzzily"""
+        text = "Parisians fly from Paris to PARIS, TX on Sept 5 with 2000$"
+        locator = train_test_split.EntitySpanLocator(text)
+        self.assertEqual(locator.find_all(['paris'])['paris'], [(19, 24), (28, 33)])
+
+        entity_labels = locator.locate([
+            {'key': 'or_city', 'val': 'Paris'},
+            {'key': 'dst_city', 'val': 'paris'},
+            {'key': 'str_date', 'val': 'sept. 5'},
+            {'key': 'budget', 'val': '2000'},
+            {'key': 'end_date', 'val': 'december 24'},
+        ])
+        self.assertEqual(entity_labels, [
+            {'startCharIndex': 19, 'endCharIndex': 24, 'entityName': 'or_city'},
+            {'startCharIndex': 28, 'endCharIndex': 33, 'entityName': 'dst_city'},
+            {'startCharIndex': 41, 'endCharIndex': 47, 'entityName': 'str_date'},
+            {'startCharIndex': 53, 'endCharIndex': 57, 'entityName': 'budget'},
+            None,
+        ])
+
+        with self.assertRaises(ValueError):
+            train_test_split.get_entity_index(text, 'december 24')
+        self.assertEqual(train_test_split.get_entity({'key': 'dst_city', 'val': 'Rome'}, text), {})
+
+    def test_get_intents(self):
+        """Test intents and entities of a turn"""
+        turn = {'labels': {'acts': [{'args': [
+            {'key': 'intent', 'val': 'book'},
+            {'key': 'dst_city', 'val': 'Rome'},
+            {'key': 'or_city', 'val': 'Rome'},
+            {'key': 'budget', 'val': '-1'},
+            {'key': 'n_adults', 'val': '2'},
+        ]}]}}
+        self.assertEqual(train_test_split.get_intents(turn, 'From Rome to Rome for 2'), ('book', [
+            {'startCharIndex': 5, 'endCharIndex': 9, 'entityName': 'dst_city'},
+            {'startCharIndex': 13, 'endCharIndex': 17, 'entityName': 'or_city'},
+        ]))
+
     def test_save_intents(self):
         """Test if to save intents to a file"""
         outputfile = str(uuid.uuid4()) + ".tmp"
@@ -55,6 +94,132 @@ class test_train_test_split(unittest.TestCase):
             train_test_split.get_train_test_size(100, 100)
             train_test_split.get_train_test_size(0.90, 0.20)
 
+    def test_read_conversations(self):
+        """Test conversations are read one at a time from JSON and JSONL files"""
+        conversations = [{'id': index, 'turns': [{'text': 'a ] , "b" ' * index}]} for index in range(50)]
+        for content in (json.dumps(conversations, indent=2),
+                        "\n".join(json.dumps(conversation) for conversation in conversations)):
+            inputfile = str(uuid.uuid4()) + ".tmp"
+            with open(inputfile, 'w') as fp:
+                fp.write(content)
+            self.assertEqual(list(train_test_split.read_conversations(inputfile, chunk_size=7)), conversations)
+            self.assertEqual(list(train_test_split.read_conversations(inputfile)), conversations)
+            os.remove(inputfile)
+
+    def test_json_array_writer(self):
+        """Test streamed arrays are written as json.dump does"""
+        outputfile = str(uuid.uuid4()) + ".tmp"
+        items = [{'text': 'Hello', 'entityLabels': []}, {'text': 'Bye', 'entityLabels': [1]}]
+        for count in (0, 1, 2):
+            with train_test_split.JsonArrayWriter(outputfile) as writer:
+                for item in items[:count]:
+                    writer.write(item)
+            with open(outputfile) as json_file:
+                self.assertEqual(json_file.read(), json.dumps(items[:count]))
+        os.remove(outputfile)
+
+    def test_convert_to_luis(self):
+        """Test conversations are converted and split in order, with or without a process pool"""
+        folder = str(uuid.uuid4())
+        os.makedirs(folder)
+        inputfile = os.path.join(folder, 'frames.json')
+        conversations = [
+            {'turns': [{'text': f'Go to Paris {index}', 'labels': {'acts': [
+                {'args': [{'key': 'dst_city', 'val': 'Paris'}]}]}}]}
+            for index in range(10)]
+        with open(inputfile, 'w') as fp:
+            json.dump(conversations, fp)
+
+        for workers in (1, 2):
+            train_test_split.convert_to_luis(inputfile, folder, 0.8, workers)
+
+            with open(os.path.join(folder, 'frames_train.json')) as json_file:
+                train = json.load(json_file)
+            with open(os.path.join(folder, 'frames_test.json')) as json_file:
+                test = json.load(json_file)
+            self.assertEqual([intent['text'] for intent in train + test],
+                             [conversation['turns'][0]['text'] for conversation in conversations])
+            self.assertEqual(len(train), 8)
+            self.assertEqual(train[0]['entityLabels'], [{'startCharIndex': 6, 'endCharIndex': 11, 'entityName': 'dst_city'}])
+        for filename in os.listdir(folder):
+            os.remove(os.path.join(folder, filename))
+        os.rmdir(folder)
+
+    def test_get_assignments(self):
+        """Test seeded, stratified and k-fold assignments"""
+        strata = [('dst_city',)] * 60 + [('dst_city', 'or_city')] * 30 + [()] * 10
+
+        assignments = train_test_split.get_assignments(100, 0.8)
+        self.assertEqual(list(assignments), [1] * 80 + [0] * 20)
+
+        assignments = train_test_split.get_assignments(100, 0.8, seed=42)
+        self.assertEqual(assignments, train_test_split.get_assignments(100, 0.8, seed=42))
+        self.assertNotEqual(assignments, train_test_split.get_assignments(100, 0.8))
+        self.assertEqual(sum(assignments), 80)
+
+        assignments = train_test_split.get_assignments(100, 0.8, seed=42, strata=strata)
+        self.assertEqual(sum(assignments[:60]), 48)
+        self.assertEqual(sum(assignments[60:90]), 24)
+        self.assertEqual(sum(assignments[90:]), 8)
+
+        assignments = train_test_split.get_assignments(100, 0.8, seed=42, strata=strata, folds=5)
+        self.assertEqual(sorted(set(assignments)), [0, 1, 2, 3, 4])
+        self.assertEqual([list(assignments[90:]).count(fold) for fold in range(5)], [2] * 5)
+
+    def test_get_assignments_small_strata(self):
+        """Test small strata do not change the size of the train set"""
+        strata = list(range(100))
+        for seed in (None, 42):
+            assignments = train_test_split.get_assignments(100, 0.75, seed=seed, strata=strata)
+            self.assertEqual(sum(assignments), 75)
+
+        # 20 strata of 2 conversations and 20 of 3
+        strata = [index // 2 for index in range(40)] + [20 + index // 3 for index in range(60)]
+        assignments = train_test_split.get_assignments(100, 0.75, seed=42, strata=strata)
+        self.assertEqual(sum(assignments), 75)
+        for stratum in set(strata):
+            train = sum(assignment for assignment, other in zip(assignments, strata) if other == stratum)
+            # Each stratum gets the floor or the ceiling of its share
+            self.assertLess(abs(train - strata.count(stratum) * 0.75), 1)
+
+        # Singleton strata are spread over the folds
+        assignments = train_test_split.get_assignments(10, 0.8, strata=list(range(10)), folds=5)
+        self.assertEqual([list(assignments).count(fold) for fold in range(5)], [2] * 5)
+
+    def test_get_train_counts(self):
+        """Test the train set is split with the largest remainders"""
+        self.assertEqual(train_test_split.get_train_counts([3, 2, 5], 0.5), [2, 1, 2])
+        self.assertEqual(train_test_split.get_train_counts([1] * 4, 0.75), [1, 1, 1, 0])
+        self.assertEqual(train_test_split.get_train_counts([], 0.75), [])
+
+    def test_convert_to_luis_folds(self):
+        """Test each conversation is in the test set of exactly one fold and in the train set of the others"""
+        folder = str(uuid.uuid4())
+        os.makedirs(folder)
+        inputfile = os.path.join(folder, 'frames.json')
+        conversations = [
+            {'turns': [{'text': f'Go to Paris {index}', 'labels': {'acts': [
+                {'args': [{'key': 'dst_city', 'val': 'Paris'}] if index % 2 else []}]}}]}
+            for index in range(10)]
+        with open(inputfile, 'w') as fp:
+            json.dump(conversations, fp)
+
+        train_test_split.convert_to_luis(inputfile, folder, 0.8, seed=1, stratify=True, folds=3)
+
+        texts = sorted(conversation['turns'][0]['text'] for conversation in conversations)
+        tested = []
+        for fold in range(1, 4):
+            with open(os.path.join(folder, f'frames_train_{fold}.json')) as json_file:
+                train = [intent['text'] for intent in json.load(json_file)]
+            with open(os.path.join(folder, f'frames_test_{fold}.json')) as json_file:
+                test = [intent['text'] for intent in json.load(json_file)]
+            self.assertEqual(sorted(train + test), texts)
+            tested += test
+        self.assertEqual(sorted(tested), texts)
+        for filename in os.listdir(folder):
+            os.remove(os.path.join(folder, filename))
+        os.rmdir(folder)
+
     def test_parser(self):
         """Test command line parameters"""
         parser = train_test_split.parse_args(['--in', 'filename'])
@@ -69,5 +234,14 @@ class test_train_test_split(unittest.TestCase):
         parser = train_test_split.parse_args(['--out', 'folder'])
         self.assertEqual(parser.folder, 'folder')
 
+        parser = train_test_split.parse_args(['--workers', '4'])
+        self.assertEqual(parser.workers, 4)
+
+        parser = train_test_split.parse_args(['--seed', '42', '--stratify', '--folds', '5'])
+        self.assertEqual((parser.seed, parser.stratify, parser.folds), (42, True, 5))
+
+        parser = train_test_split.parse_args([])
+        self.assertEqual((parser.seed, parser.stratify, parser.folds), (None, False, 0))
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,12 @@ from azure.cognitiveservices.language.luis.authoring import LUISAuthoringClient
 from azure.cognitiveservices.language.luis.authoring.models import ApplicationCreateObject
 from azure.cognitiveservices.language.luis.runtime import LUISRuntimeClient
 from msrest.authentication import CognitiveServicesCredentials
+from msrest.exceptions import HttpOperationError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import hashlib
 import json
+import random
 import time
 import uuid
 import argparse
@@ -30,40 +35,184 @@ def get_json(filename):
     return content
 
 
+def get_normalized_index(text, index):
+    """
+    Get the position of a character once spacing is normalized, see get_utterance_key
+
+    Args:
+        text (string): Utterance
+        index (int): Position of a character which is not a space, or end of a span
+
+    Returns:
+        int: Position in the normalized utterance
+    """
+    prefix = " ".join(text[:index].split())
+    # The spaces before the character become a single one, unless they start the utterance
+    if prefix and text[index - 1].isspace():
+        return len(prefix) + 1
+    return len(prefix)
+
+
+def get_token_spans(text, tokens):
+    """
+    Get the position of each token of an utterance tokenized by LUIS
+
+    Args:
+        text (string): Utterance
+        tokens (list): Tokens, in the order of the utterance
+
+    Returns:
+        list: Start and end (excluded) of each token
+    """
+    lowered = text.lower()
+    spans = []
+    position = 0
+    for token in tokens:
+        start = lowered.find(token.lower(), position)
+        if start < 0:
+            start = position
+        position = start + len(token)
+        spans.append((start, position))
+    return spans
+
+
+def get_utterance_key(text, intent, entities):
+    """
+    Get the key used to compare utterances, independent of case, spacing and entity order
+
+    Args:
+        text (string): Utterance
+        intent (string): Intent name
+        entities (list): Entity name, start and end (excluded) of each entity label
+
+    Returns:
+        string: Hash of the normalized utterance, intent and entity labels
+    """
+    normalized = " ".join(text.lower().split())
+    labels = [[name, get_normalized_index(text, start), get_normalized_index(text, end)]
+              for name, start, end in entities]
+    content = json.dumps([normalized, intent, sorted(labels)])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_next_version(version):
+    """
+    Get the version following a version, e.g 0.2 after 0.1
+
+    Args:
+        version (string): Version
+
+    Returns:
+        string: Next version
+    """
+    parts = version.split(".")
+    if parts[-1].isdigit():
+        parts[-1] = str(int(parts[-1]) + 1)
+    else:
+        parts.append("1")
+    return ".".join(parts)
+
+
+def get_chunks(items, size):
+    """
+    Split a list in chunks
+
+    Args:
+        items (list): Items to split
+        size (int): Maximum size of a chunk
+
+    Returns:
+        list: List of chunks
+    """
+    return [items[index:index + size] for index in range(0, len(items), size)]
+
+
+def with_retry(call, retries=5, backoff=1.0):
+    """
+    Call an authoring API, retrying with exponential backoff when throttled (HTTP 429)
+
+    Args:
+        call (function): Function calling the API
+        retries (int): Maximum number of retries
+        backoff (float): Delay before the first retry, in seconds
+
+    Returns:
+        object: Result of the call
+    """
+    for attempt in range(retries + 1):
+        try:
+            return call()
+        except HttpOperationError as error:
+            response = error.response
+            if response is None or response.status_code != 429 or attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            time.sleep(delay + random.uniform(0, backoff))
+
+
 class CreateLUIS:
     VERSION = "0.1"
     INTENT_NAME = "FlyMeIntent"
-    APP_NAME = "Fly Me " + str(uuid.uuid4())
+    # Maximum number of utterances of a batch upload
+    BATCH_SIZE = 100
+    # Training statuses of a model still being trained
+    TRAINING = ("Queued", "InProgress")
 
-    def __init__(self, trainset_file):
+    def __init__(self, trainset_file, workers=4, timeout=600):
         """
         Init class
 
         Args:
             trainset_file (string): Filename for train set
+            workers (int): Number of batches uploaded concurrently
+            timeout (float): Maximum training time, in seconds
         """
         self.train = trainset_file
+        self.workers = workers
+        self.timeout = timeout
+        # Each instance creates its own application, so that several can be built at once
+        self.app_name = "Fly Me " + str(uuid.uuid4())
+        self.version = self.VERSION
         self.config = get_json("./config.json")
-        self.create_application()
-        self.create_intents()
-        self.create_entities()
-        self.add_utterance()
-        self.train_version()
-        self.publish()
-        self.single_test()
 
-    def create_application(self):
+    async def run(self):
         """
-        Create LUIS application
+        Create, train, publish and test the application
+        """
+        loop = asyncio.get_running_loop()
+        # The authoring client is synchronous, its calls run in threads.
+        await loop.run_in_executor(None, self.create_application)
+        await loop.run_in_executor(None, self.create_intents)
+        await loop.run_in_executor(None, self.create_entities)
+        await loop.run_in_executor(None, self.add_utterance)
+        await self.train_version()
+        await loop.run_in_executor(None, self.publish)
+        await loop.run_in_executor(None, self.single_test)
+
+    def create_client(self):
+        """
+        Create LUIS authoring client
+
+        Returns:
+            LUISAuthoringClient: Authoring client
         """
-        client = LUISAuthoringClient(
+        return LUISAuthoringClient(
             self.config["authoringEndpoint"],
             CognitiveServicesCredentials(self.config["authoringKey"])
         )
 
+    def create_application(self):
+        """
+        Create LUIS application
+        """
+        client = self.create_client()
+
         # define app basics
         app_definition = ApplicationCreateObject(
-            name=self.APP_NAME, initial_version_id=self.VERSION, culture='en-us')
+            name=self.app_name, initial_version_id=self.version, culture='en-us')
 
         # create app
         app_id = client.apps.add(app_definition)
@@ -80,7 +229,7 @@ class CreateLUIS:
         """
         intents = ["book"]
         for intent in intents:
-            self.client.model.add_intent(self.app_id, self.VERSION, intent)
+            self.client.model.add_intent(self.app_id, self.version, intent)
             print(f"Created LUIS intent: {intent}")
 
     def add_entity(self, name, prebuilt_feature_not_nequired_definition):
@@ -92,9 +241,9 @@ class CreateLUIS:
             prebuilt_feature_not_nequired_definition (feature_relation_create_object): A Feature relation information
         """
         entity = self.client.model.add_entity(
-            self.app_id, self.VERSION, name=name)
+            self.app_id, self.version, name=name)
         self.client.features.add_entity_feature(
-            self.app_id, self.VERSION, entity, prebuilt_feature_not_nequired_definition)
+            self.app_id, self.version, entity, prebuilt_feature_not_nequired_definition)
         print(f"Entity: {name} added")
 
     def create_entities(self):
@@ -104,7 +253,7 @@ class CreateLUIS:
         # Prebuilt entities
         prebuilt_entities = ["datetimeV2", "money", "geographyV2"]
         self.client.model.add_prebuilt(
-            self.app_id, self.VERSION, prebuilt_extractor_names=prebuilt_entities)
+            self.app_id, self.version, prebuilt_extractor_names=prebuilt_entities)
         print(f"Added prebuilt entities: {prebuilt_entities}")
 
         prebuilt_feature_not_required_definition_geography = {
@@ -126,35 +275,90 @@ class CreateLUIS:
         self.add_entity(
             "budget", prebuilt_feature_not_required_definition_money)
 
+    def add_batch(self, batch):
+        """
+        Add a batch of utterances to model
+
+        Args:
+            batch (list): Utterances
+
+        Returns:
+            int: Number of utterances rejected
+        """
+        results = with_retry(
+            lambda: self.client.examples.batch(self.app_id, self.version, batch))
+        return sum(1 for result in results if result.has_error)
+
     def add_utterance(self):
         """
         Read utterance from file and add them to model
         """
-        utterances = get_json(self.train)
+        self.add_utterances(get_json(self.train))
 
-        for utterance in utterances:
-            self.client.examples.add(self.app_id, self.VERSION, utterance, {
-                                     "enableNestedChildren": True})
-        print(f"{len(utterances)} utterances added")
+    def add_utterances(self, utterances):
+        """
+        Add utterances to model, in batches uploaded concurrently
 
-    def train_version(self):
+        Args:
+            utterances (list): Utterances
+        """
+        batches = get_chunks(utterances, self.BATCH_SIZE)
+
+        uploaded = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.add_batch, batch): len(batch) for batch in batches}
+            for future in as_completed(futures):
+                failed += future.result()
+                uploaded += futures[future]
+                print(f"{uploaded}/{len(utterances)} utterances uploaded")
+
+        print(f"{uploaded - failed} utterances added, {failed} rejected")
+
+    async def train_version(self):
         """
         Train Model
         """
-        self.client.train.train_version(self.app_id, self.VERSION)
-        waiting = True
-        while waiting:
-            info = self.client.train.get_status(self.app_id, self.VERSION)
-
-            # get_status returns a list of training statuses, one for each model. Loop through them and make sure all are done.
-            waiting = any(map(
-                lambda x: 'Queued' == x.details.status or 'InProgress' == x.details.status, info))
-            if waiting:
-                print("Waiting 10 seconds for training to complete...")
-                time.sleep(10)
-            else:
-                print("Application trained")
-                waiting = False
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, self.client.train.train_version, self.app_id, self.version)
+        await self.wait_for_training()
+        print(f"{self.app_name}: application trained")
+
+    async def wait_for_training(self, initial_delay=1.0, max_delay=30.0):
+        """
+        Wait for the training of every model, polling with exponential backoff and jitter
+
+        Args:
+            initial_delay (float): Delay before the second poll, in seconds
+            max_delay (float): Maximum delay between polls, in seconds
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        delay = initial_delay
+        trained = None
+        while True:
+            info = await loop.run_in_executor(
+                None, self.client.train.get_status, self.app_id, self.version)
+
+            # get_status returns a list of training statuses, one for each model.
+            failed = [x for x in info if x.details.status == "Fail"]
+            if failed:
+                raise RuntimeError(
+                    f"{self.app_name}: training failed for model {failed[0].model_id}: "
+                    f"{failed[0].details.failure_reason}")
+
+            done = sum(1 for x in info if x.details.status not in self.TRAINING)
+            if done != trained:
+                trained = done
+                print(f"{self.app_name}: {done}/{len(info)} models trained")
+            if done == len(info):
+                return
+
+            if loop.time() + delay > deadline:
+                raise TimeoutError(f"{self.app_name}: training not finished after {self.timeout}s")
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, max_delay)
 
     def publish(self):
         """
@@ -163,7 +367,7 @@ class CreateLUIS:
         try:
             self.client.apps.update_settings(self.app_id, is_public=True)
             self.client.apps.publish(
-                self.app_id, self.VERSION, is_staging=False)
+                self.app_id, self.version, is_staging=False)
         except Exception as e:
             print("ERROR: " + e)
 
@@ -194,18 +398,184 @@ class CreateLUIS:
         print("Entities: {}".format(prediction_response.prediction.entities))
 
 
+class UpdateLUIS(CreateLUIS):
+
+    """Update an existing application with the changes of a train set only"""
+
+    # Number of utterances per page when listing the examples of a version
+    PAGE_SIZE = 500
+
+    def __init__(self, trainset_file, workers=4, timeout=600, app_id=None, version=None, new_version=None):
+        """
+        Init class
+
+        Args:
+            trainset_file (string): Filename for train set
+            workers (int): Number of requests sent concurrently
+            timeout (float): Maximum training time, in seconds
+            app_id (string): Application ID, from config.json by default
+            version (string): Version to update, from config.json by default
+            new_version (string): Version created from it, the next version by default
+        """
+        super(UpdateLUIS, self).__init__(trainset_file, workers, timeout)
+        self.app_id = app_id or self.config["app_id"]
+        self.base_version = version or self.config.get("version") or self.VERSION
+        self.version = new_version or get_next_version(self.base_version)
+        self.app_name = f"{self.app_id} {self.version}"
+        self.client = self.create_client()
+
+    def list_utterances(self, version):
+        """
+        List the utterances of a version
+
+        Args:
+            version (string): Version
+
+        Returns:
+            dict: Utterance IDs by utterance key
+        """
+        utterances = {}
+        skip = 0
+        while True:
+            page = with_retry(lambda: self.client.examples.list(
+                self.app_id, version, skip=skip, take=self.PAGE_SIZE))
+            for utterance in page:
+                # Labels of the examples are given in tokens
+                tokens = get_token_spans(utterance.text, utterance.tokenized_text or utterance.text.split())
+                key = get_utterance_key(
+                    utterance.text, utterance.intent_label,
+                    [(entity.entity_name, tokens[entity.start_token_index][0], tokens[entity.end_token_index][1])
+                     for entity in utterance.entity_labels or []])
+                utterances.setdefault(key, []).append(utterance.id)
+            if len(page) < self.PAGE_SIZE:
+                return utterances
+            skip += self.PAGE_SIZE
+
+    def get_changes(self, existing):
+        """
+        Compare the train set with the utterances of the application
+
+        Args:
+            existing (dict): Utterance IDs by utterance key
+
+        Returns:
+            tuple: Utterances to add, keys of the utterances to delete
+        """
+        wanted = {}
+        for utterance in get_json(self.train):
+            key = get_utterance_key(
+                utterance["text"], utterance["intentName"],
+                [(entity["entityName"], entity["startCharIndex"], entity["endCharIndex"])
+                 for entity in utterance["entityLabels"]])
+            wanted.setdefault(key, utterance)
+        added = [utterance for key, utterance in wanted.items() if key not in existing]
+        deleted = [key for key in existing if key not in wanted]
+        return added, deleted
+
+    def delete_utterances(self, ids):
+        """
+        Delete utterances from model
+
+        Args:
+            ids (list): Utterance IDs
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(with_retry, lambda example_id=example_id: self.client.examples.delete(
+                    self.app_id, self.version, example_id))
+                for example_id in ids]
+            for future in as_completed(futures):
+                future.result()
+        print(f"{len(ids)} utterances deleted")
+
+    async def run(self):
+        """
+        Clone the version, apply the changes of the train set then train and publish it
+        """
+        loop = asyncio.get_running_loop()
+        existing = await loop.run_in_executor(None, self.list_utterances, self.base_version)
+        added, deleted = self.get_changes(existing)
+        print(f"{self.app_name}: {len(added)} utterances to add, {len(deleted)} to delete")
+        if not added and not deleted:
+            print(f"Version {self.base_version} is up to date, nothing to train")
+            return
+
+        await loop.run_in_executor(None, lambda: with_retry(lambda: self.client.versions.clone(
+            self.app_id, self.base_version, version=self.version)))
+        print(f"Cloned version {self.base_version} to {self.version}")
+
+        if deleted:
+            # Example IDs are specific to a version, they are listed again in the clone.
+            cloned = await loop.run_in_executor(None, self.list_utterances, self.version)
+            ids = [example_id for key in deleted for example_id in cloned.get(key, [])]
+            await loop.run_in_executor(None, self.delete_utterances, ids)
+        if added:
+            await loop.run_in_executor(None, self.add_utterances, added)
+
+        await self.train_version()
+        await loop.run_in_executor(None, self.publish)
+        print(f"Version {self.version} published, set it in config.json for the next update")
+
+
+async def create_all(filenames, workers=4, timeout=600):
+    """
+    Create, train and publish one application per train set, in parallel
+
+    Args:
+        filenames (list): Filenames of the train sets
+        workers (int): Number of batches uploaded concurrently per application
+        timeout (float): Maximum training time, in seconds
+    """
+    await asyncio.gather(*(CreateLUIS(filename, workers, timeout).run() for filename in filenames))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create/train/publish/test LUID model')
 
     help_file = """
-    Filename. File containing LUIS JSON file to train
+    Filename. File containing LUIS JSON file to train, several files are trained and published in parallel
     """
 
-    parser.add_argument("--file", dest='input_file', type=str, help=help_file, required=True)
-    args = parser.parse_args()
+    help_workers = """
+    Number of batches of utterances uploaded concurrently
+    """
+
+    help_timeout = """
+    Maximum training time in seconds
+    """
 
-    if not os.path.isfile(args.input_file):
-        print(f"Input file {args.input_file} not found")
-        exit();
+    parser.add_argument("--file", dest='input_files', type=str, help=help_file, required=True, nargs="+")
+    parser.add_argument("--workers", dest='workers', type=int, default=4, help=help_workers)
+    help_incremental = """
+    Update the application of config.json instead of creating one: its version is cloned and only
+    the utterances added to or removed from the train set are uploaded or deleted
+    """
+
+    help_version = """
+    Version updated in incremental mode, the version of config.json by default
+    """
+
+    help_new_version = """
+    Version created in incremental mode, the next version by default
+    """
+
+    parser.add_argument("--timeout", dest='timeout', type=float, default=600, help=help_timeout)
+    parser.add_argument("--incremental", dest='incremental', action="store_true", help=help_incremental)
+    parser.add_argument("--version", dest='version', type=str, help=help_version)
+    parser.add_argument("--new-version", dest='new_version', type=str, help=help_new_version)
+    args = parser.parse_args()
 
-    CreateLUIS(args.input_file)
+    for input_file in args.input_files:
+        if not os.path.isfile(input_file):
+            print(f"Input file {input_file} not found")
+            exit();
+
+    if args.incremental:
+        if len(args.input_files) > 1:
+            print("Only one file can be used in incremental mode")
+            exit();
+        asyncio.run(UpdateLUIS(
+            args.input_files[0], args.workers, args.timeout,
+            version=args.version, new_version=args.new_version).run())
+    else:
+        asyncio.run(create_all(args.input_files, args.workers, args.timeout))
@@ -1,12 +1,21 @@
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
 import argparse
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from prediction_cache import PredictionCache
+from evaluation import Evaluation
 
 # Labels
 labels = ['dst_city','or_city','str_date','end_date','budget']
 
+class PredictionError(Exception):
+    """LUIS answered an error instead of a prediction, e.g. when the quota is exceeded"""
+
 def get_json(filename):
     """Load JSON file
     Args:
@@ -19,12 +28,178 @@ def get_json(filename):
         content = json.load(jsonfile)
     return content
 
+def get_utterances(filename, count):
+    """
+    Load the utterances to predict
+
+    Args:
+        filename (string): LUIS JSON file
+        count (int): Number of sentence to analyse. Can be "all"
+
+    Returns:
+        list: utterances
+    """
+    utterances = get_json(filename)
+
+    # All utterances
+    if count == "all":
+        return utterances
+
+    # At least one utterance is always predicted
+    return utterances[:max(count, 1)]
+
+def create_session(pool_size=8, retries=3, backoff=0.5):
+    """
+    Create an HTTP session keeping its connections alive between predictions
+
+    Throttled (429) and failed (5xx) requests are retried with an exponential backoff,
+    honoring the Retry-After header. The last response is returned when all retries fail.
+
+    Args:
+        pool_size (int, optional): Maximum number of connections kept open, one per worker. Defaults to 8
+        retries (int, optional): Number of retries. Defaults to 3
+        backoff (float, optional): Backoff factor in seconds. Defaults to 0.5
+
+    Returns:
+        requests.Session: HTTP session
+    """
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """
+        Token bucket rate limiter shared between prediction workers
+
+        Args:
+            rate (float): Number of requests allowed per second (LUIS tier TPS)
+            capacity (int, optional): Maximum burst size. Defaults to rate
+        """
+        if rate <= 0:
+            raise ValueError(f"The rate should be positive, got {rate}")
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a token is available and consume it
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Checkpoint:
+    def __init__(self, filename, resume=False):
+        """
+        JSONL file where each prediction is appended as soon as it is received
+
+        Args:
+            filename (string): Checkpoint filename
+            resume (bool, optional): Keep the predictions of a previous run. Defaults to False (the file is emptied)
+        """
+        self.filename = filename
+        self.predictions = {}
+        if resume and os.path.isfile(filename):
+            complete = 0
+            with open(filename, "rb") as checkpoint_file:
+                for line in checkpoint_file:
+                    if not line.endswith(b"\n"):
+                        # Last line of an interrupted run
+                        break
+                    complete += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.predictions[record["index"]] = record
+            # New predictions must not be appended to an interrupted line
+            with open(filename, "r+b") as checkpoint_file:
+                checkpoint_file.truncate(complete)
+        self.lock = threading.Lock()
+        self.file = open(filename, "a" if resume else "w", buffering=1)
+
+    def get(self, index, text):
+        """
+        Get the prediction of an utterance stored by a previous run
+
+        Args:
+            index (int): Utterance index in the test file
+            text (string): Utterance, to ignore predictions of another test file
+
+        Returns:
+            dict: LUIS prediction, None if the utterance was not predicted
+        """
+        record = self.predictions.get(index)
+        if record is None or record["text"] != text:
+            return None
+        return record["response"]
+
+    def write(self, index, text, response):
+        """
+        Append a prediction
+
+        Args:
+            index (int): Utterance index in the test file
+            text (string): Utterance
+            response (dict): LUIS prediction
+        """
+        line = json.dumps({"index": index, "text": text, "response": response}) + "\n"
+        with self.lock:
+            self.file.write(line)
+
+    def close(self):
+        """
+        Close the checkpoint file
+        """
+        self.file.close()
+
 class Predict:
-    def __init__(self):
+    SLOT = "production"
+
+    PARAMS = {
+        'timezoneOffset': '0',
+        'verbose': 'true',
+        'show-all-intents': 'true',
+        'spellCheck': 'false',
+        'staging': 'false',
+    }
+
+    def __init__(self, config=None, cache=None, session=None, timeout=(3.05, 10), checkpoint=None):
         """
         Init Prdict class
+
+        Args:
+            config (dict, optional): LUIS configuration. Defaults to ./config.json content
+            cache (PredictionCache, optional): Cache of raw predictions. Defaults to no cache
+            session (requests.Session, optional): HTTP session. Defaults to create_session()
+            timeout (float or tuple, optional): Connect and read timeouts in seconds. Defaults to (3.05, 10)
+            checkpoint (Checkpoint, optional): Checkpoint of the predictions. Defaults to no checkpoint
         """
-        self.config = get_json("./config.json")
+        self.config = config if config is not None else get_json("./config.json")
+        self.session = session if session is not None else create_session()
+        self.timeout = timeout
+        # Prediction URL, built on first call
+        self.url = None
+        self.cache = cache
+        self.checkpoint = checkpoint
+        self.evaluation = Evaluation(labels)
+        # Number of values of each mean in accuracy
+        self.counts = {}
         self.accuracy = {
             "intent": 0,
             "dst_city": 0,
@@ -35,34 +210,44 @@ class Predict:
             "accuracy": 0
         }
 
-    def luis_predict(self, query):
+    def luis_predict(self, query, bucket=None):
         """
         Call LUIS Predict and return detailed prediction
 
         Args:
             query (string): Sentence
+            bucket (TokenBucket, optional): Rate limiter of the requests, cached predictions do not wait for it
 
         Returns:
-            dict: detailed prediction
-        """
-        params ={
-            'query': query,
-            'timezoneOffset': '0',
-            'verbose': 'true',
-            'show-all-intents': 'true',
-            'spellCheck': 'false',
-            'staging': 'false',
-            'subscription-key': self.config["predictionKey"]
-        }
+            tuple: detailed prediction, and whether LUIS was called
+        """
+        params = dict(self.PARAMS, query=query)
+        app_id = self.config["app_id"]
+        version = self.config.get("version", "")
+        # Without a version, predictions of a retrained model could not be told apart
+        use_cache = self.cache is not None and bool(version)
 
-        headers = {
-        }
+        if use_cache:
+            key = PredictionCache.key(app_id, self.SLOT, version, query, params)
+            prediction = self.cache.get(key)
+            if prediction is not None:
+                return prediction, False
 
-        prediction_endpoint = self.config["predictionEndpoint"]
-        app_id = self.config["app_id"]
+        if bucket is not None:
+            bucket.acquire()
+
+        if self.url is None:
+            prediction_endpoint = self.config["predictionEndpoint"]
+            self.url = f'{prediction_endpoint}luis/prediction/v3.0/apps/{app_id}/slots/{self.SLOT}/predict'
+            self.session.headers['Ocp-Apim-Subscription-Key'] = self.config["predictionKey"]
+
+        response = self.session.get(self.url, params=params, timeout=self.timeout)
+        prediction = response.json()
 
-        response = requests.get(f'{prediction_endpoint}luis/prediction/v3.0/apps/{app_id}/slots/production/predict', headers=headers, params=params)
-        return response.json()
+        # Only successful predictions are cached
+        if use_cache and "prediction" in prediction:
+            self.cache.set(key, app_id, self.SLOT, version, query, prediction)
+        return prediction, True
 
     def check_intent(self, utterance_intent, intent):
         """
@@ -82,12 +267,14 @@ class Predict:
         Args:
             key (string): key name
             value (float): value
-            action (string, optional): if "mean": calculate mean, by befaults it's sum
+            action (string, optional): if "mean": calculate mean of the values, by befaults it's sum
         """
-        value = value + self.accuracy[key]
-
         if action == 'mean':
-            value = value / 2.0
+            count = self.counts.get(key, 0) + 1
+            self.counts[key] = count
+            value = self.accuracy[key] + (value - self.accuracy[key]) / count
+        else:
+            value = value + self.accuracy[key]
 
         self.accuracy.update({key: value})
 
@@ -103,19 +290,66 @@ class Predict:
         acuracy_count = 0
         for entity_label in utterance:
             entity_name = entity_label['entityName']
+            found = 0
 
             try:
                 prediction_instance = prediction["$instance"]
                 if entity_name == prediction_instance[entity_name][0]["type"]:
-                    self.update_accuracy(entity_name, 1, "mean")
+                    found = 1
                     acuracy_count += 1
 
             except KeyError:
                 pass
+            if entity_name in self.accuracy:
+                self.update_accuracy(entity_name, found, "mean")
         if entity_count == 0:
             entity_count = 1
         self.update_accuracy("accuracy", acuracy_count / entity_count, "mean")
 
+    def score(self, utterance, response):
+        """
+        Update accuracy with the prediction of an utterance
+
+        Args:
+            utterance (dict): ground truth
+            response (dict): LUIS prediction
+
+        Raises:
+            PredictionError: LUIS answered an error
+        """
+        if "prediction" not in response:
+            error = response.get("error", response)
+            if isinstance(error, dict):
+                error = error.get("message", error)
+            raise PredictionError(f"No prediction for \"{utterance['text']}\": {error}")
+        self.check_intent(utterance["intentName"], response["prediction"]["topIntent"])
+        self.check_entities(utterance["entityLabels"], response["prediction"]["entities"])
+        self.evaluation.add(utterance, response)
+
+    def predict_utterance(self, index, utterance, bucket=None):
+        """
+        Predict an utterance, or get its prediction from the checkpoint when the run is resumed
+
+        Args:
+            index (int): Utterance index in the test file
+            utterance (dict): ground truth
+            bucket (TokenBucket, optional): Rate limiter of the requests
+
+        Returns:
+            tuple: LUIS prediction, and whether LUIS was called
+        """
+        if self.checkpoint is not None:
+            response = self.checkpoint.get(index, utterance['text'])
+            if response is not None:
+                return response, False
+
+        response, called = self.luis_predict(utterance['text'], bucket)
+
+        # Errors (e.g quota exceeded) are predicted again on resume
+        if self.checkpoint is not None and "prediction" in response:
+            self.checkpoint.write(index, utterance['text'], response)
+        return response, called
+
     def predict(self, filename, count=4):
         """
         Do preidctions
@@ -125,29 +359,61 @@ class Predict:
             count (int, optional): Number of sentence to analyse. Defaults to 4. Can be "all"
 
         Returns:
-            [type]: [description]
+            dict: accuracy
         """
-        utterances = get_json(filename)
+        utterances = get_utterances(filename, count)
 
-        # All utterances
-        if count == "all":
-            count = len(utterances)
+        for index, utterance in enumerate(utterances):
+            response, called = self.predict_utterance(index, utterance)
+            self.score(utterance, response)
 
-        for utterance in utterances:
-            response = self.luis_predict(utterance['text'])
-            self.check_intent(utterance["intentName"], response["prediction"]["topIntent"])
-            self.check_entities(utterance["entityLabels"],response["prediction"]["entities"])
+            # Take a break to stay in Free slot
+            if index < len(utterances) - 1 and called:
+                time.sleep(1)
 
-            # Stop when all required utterances have been predicted
-            count -= 1
-            if count <= 0:
-                break
+        return self.accuracy
 
-            # Take a break to stay in Free slot
-            time.sleep(1)
+    def predict_concurrent(self, filename, count=4, workers=8, rate=5):
+        """
+        Do predictions with concurrent requests limited to the LUIS tier rate
+
+        Predictions are scored in file order, so the accuracy is the same as predict. On an error
+        the requests not started yet are cancelled
+
+        Args:
+            filename (string): LUIS JSON file
+            count (int, optional): Number of sentence to analyse. Defaults to 4. Can be "all"
+            workers (int, optional): Number of concurrent requests. Defaults to 8
+            rate (float, optional): Maximum number of requests per second. Defaults to 5 (free tier)
+
+        Returns:
+            dict: accuracy
+        """
+        utterances = get_utterances(filename, count)
+        bucket = TokenBucket(rate)
+
+        def rate_limited_predict(index, utterance):
+            return self.predict_utterance(index, utterance, bucket)[0]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(rate_limited_predict, index, utterance)
+                       for index, utterance in enumerate(utterances)]
+            try:
+                for utterance, future in zip(utterances, futures):
+                    self.score(utterance, future.result())
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
 
         return self.accuracy
 
+    def close(self):
+        """
+        Close the connections of the HTTP session
+        """
+        self.session.close()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Test predictions from LUIS JSON file and return detailed accuracy')
 
@@ -159,13 +425,109 @@ if __name__ == "__main__":
     Number of intents to process. 'All' with process all records. Default 4
     """
     parser.add_argument("--file", dest='input_file', type=str, help=help_file, default=4, required=True)
+    help_workers = """
+    Number of concurrent requests. Default 1 (sequential predictions with a 1 second break)
+    """
+
+    help_rate = """
+    Maximum number of requests per second when workers > 1. Should match the LUIS tier. Default 5
+    """
+    help_cache = """
+    SQLite file where raw predictions are cached. Cached predictions are reused while the model version
+    ("version" in config.json) and the query do not change, nothing is cached without a version. Default: no cache
+    """
+
+    help_cache_size = """
+    Maximum size of the prediction cache in MB. Default 64
+    """
+    help_out = """
+    Folder where the evaluation is written: evaluation.json with intent confusion matrix, precision, recall
+    and F1 of intents and entities, metrics.csv and confusion_matrix.csv. Default: no evaluation
+    """
+
+    help_samples = """
+    Number of bootstrap samples of the confidence intervals, 0 to skip them. Default 1000
+    """
     parser.add_argument("--count", dest='count', type=int, default=4, help=help_count)
+    parser.add_argument("--workers", dest='workers', type=int, default=1, help=help_workers)
+    parser.add_argument("--rate", dest='rate', type=float, default=5, help=help_rate)
+    parser.add_argument("--cache", dest='cache', type=str, help=help_cache)
+    parser.add_argument("--cache-size", dest='cache_size', type=int, default=64, help=help_cache_size)
+    help_timeout = """
+    Timeout of a prediction request in seconds. Default 10
+    """
+
+    help_retries = """
+    Number of retries of throttled (429) and failed (5xx) requests, with exponential backoff. Default 3
+    """
+    parser.add_argument("--timeout", dest='timeout', type=float, default=10, help=help_timeout)
+    parser.add_argument("--retries", dest='retries', type=int, default=3, help=help_retries)
+    help_checkpoint = """
+    JSONL file where each prediction is written as soon as it is received. Default: no checkpoint
+    """
+
+    help_resume = """
+    Resume the run of the checkpoint file: utterances already predicted are scored with their stored prediction
+    """
+    parser.add_argument("--checkpoint", dest='checkpoint', type=str, help=help_checkpoint)
+    parser.add_argument("--resume", dest='resume', action='store_true', help=help_resume)
+    parser.add_argument("--out", dest='folder', type=str, help=help_out)
+    parser.add_argument("--samples", dest='samples', type=int, default=1000, help=help_samples)
     args = parser.parse_args()
 
     if not os.path.isfile(args.input_file):
         print(f"Input file {args.input_file} not found")
         exit();
 
-    predict = Predict()
-    predictions = predict.predict(args.input_file, args.count)
+    if args.folder and not os.path.isdir(args.folder):
+        print(f"Output folder {args.folder} not found")
+        exit();
+
+    if args.workers > 1 and args.rate <= 0:
+        print("The rate should be positive")
+        exit();
+
+    if args.resume and not args.checkpoint:
+        print("--resume needs a --checkpoint file")
+        exit();
+
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, args.resume)
+        if checkpoint.predictions:
+            print(f"Resuming with {len(checkpoint.predictions)} predictions from {args.checkpoint}")
+
+    cache = None
+    if args.cache:
+        cache = PredictionCache(args.cache, args.cache_size * 1024 * 1024)
+        if not get_json("./config.json").get("version"):
+            print("No \"version\" in config.json, predictions are not cached")
+
+    session = create_session(max(args.workers, 1), args.retries)
+    predict = Predict(cache=cache, session=session, timeout=(min(3.05, args.timeout), args.timeout),
+                      checkpoint=checkpoint)
+    try:
+        if args.workers > 1:
+            predictions = predict.predict_concurrent(args.input_file, args.count, args.workers, args.rate)
+        else:
+            predictions = predict.predict(args.input_file, args.count)
+    except PredictionError as error:
+        print(error)
+        if checkpoint is not None:
+            print(f"Predictions received are kept in {args.checkpoint}, run again with --resume to continue")
+        predict.close()
+        if cache is not None:
+            cache.close()
+        exit();
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
     print(predictions)
+
+    if args.folder:
+        metrics = predict.evaluation.save(args.folder, args.samples)
+        print(f"Evaluation of {metrics['utterances']} utterances written in {args.folder}")
+
+    predict.close()
+    if cache is not None:
+        cache.close()
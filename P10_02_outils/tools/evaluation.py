@@ -0,0 +1,316 @@
+import csv
+import json
+import os
+import numpy as np
+
+# Entities scored by default
+ENTITIES = ['dst_city', 'or_city', 'str_date', 'end_date', 'budget']
+
+def safe_divide(numerator, denominator):
+    """
+    Divide arrays, 0 where the denominator is 0
+
+    Args:
+        numerator (ndarray): Numerator
+        denominator (ndarray): Denominator
+
+    Returns:
+        ndarray: Quotient
+    """
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    return np.divide(numerator, denominator, out=np.zeros(np.broadcast(numerator, denominator).shape),
+                     where=denominator != 0)
+
+def get_f1(precision, recall):
+    """
+    Harmonic mean of precision and recall
+
+    Args:
+        precision (ndarray): Precision
+        recall (ndarray): Recall
+
+    Returns:
+        ndarray: F1 score
+    """
+    return safe_divide(2 * precision * recall, precision + recall)
+
+def match_spans(gold, predicted):
+    """
+    Match gold and predicted spans of the same utterance and entity which overlap
+
+    Spans are rows of (key, start, end), the key identifying the utterance and the entity,
+    end is excluded. Predicted spans are sorted by key so the candidates of each gold span
+    are found with a binary search, then all the candidate pairs are checked at once.
+
+    Args:
+        gold (ndarray): Gold spans, shape (n, 3)
+        predicted (ndarray): Predicted spans, shape (m, 3)
+
+    Returns:
+        tuple: Boolean arrays telling which gold spans and which predicted spans are matched
+    """
+    order = np.argsort(predicted[:, 0], kind='stable')
+    keys = predicted[order, 0]
+    low = np.searchsorted(keys, gold[:, 0], side='left')
+    high = np.searchsorted(keys, gold[:, 0], side='right')
+    counts = high - low
+
+    # One row per (gold span, candidate predicted span) pair
+    gold_index = np.repeat(np.arange(len(gold)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    predicted_index = order[np.repeat(low, counts) + offsets]
+
+    overlap = ((gold[gold_index, 1] < predicted[predicted_index, 2]) &
+               (predicted[predicted_index, 1] < gold[gold_index, 2]))
+    gold_matched = np.bincount(gold_index[overlap], minlength=len(gold)) > 0
+    predicted_matched = np.bincount(predicted_index[overlap], minlength=len(predicted)) > 0
+    return gold_matched, predicted_matched
+
+class Evaluation:
+    def __init__(self, entities=None):
+        """
+        Collect predictions and compute intent and entity metrics
+
+        Predictions are stored in columns: one intent pair per utterance and one row per entity span,
+        metrics are computed on the whole set when requested.
+
+        Args:
+            entities (list, optional): Entities to score. Defaults to ENTITIES
+        """
+        self.entities = list(entities or ENTITIES)
+        self.entity_index = {entity: index for index, entity in enumerate(self.entities)}
+        self.intents = {}
+        self.true_intents = []
+        self.predicted_intents = []
+        # Spans: utterance index, entity index, start, end
+        self.gold_spans = []
+        self.predicted_spans = []
+
+    def __len__(self):
+        return len(self.true_intents)
+
+    def get_intent_index(self, intent):
+        """
+        Get the index of an intent, new intents are added at the end
+
+        Args:
+            intent (string): Intent name
+
+        Returns:
+            int: Intent index
+        """
+        return self.intents.setdefault(intent, len(self.intents))
+
+    def add(self, utterance, response):
+        """
+        Add the prediction of an utterance
+
+        Args:
+            utterance (dict): ground truth
+            response (dict): LUIS prediction
+        """
+        index = len(self.true_intents)
+        prediction = response["prediction"]
+        self.true_intents.append(self.get_intent_index(utterance["intentName"]))
+        self.predicted_intents.append(self.get_intent_index(prediction["topIntent"]))
+
+        for entity_label in utterance["entityLabels"]:
+            entity = self.entity_index.get(entity_label["entityName"])
+            if entity is not None:
+                self.gold_spans.append((index, entity, entity_label["startCharIndex"], entity_label["endCharIndex"]))
+
+        instances = prediction.get("entities", {}).get("$instance", {})
+        for instance in (instance for values in instances.values() for instance in values):
+            entity = self.entity_index.get(instance.get("type"))
+            if entity is not None:
+                start = instance["startIndex"]
+                self.predicted_spans.append((index, entity, start, start + instance["length"]))
+
+    def get_counts(self):
+        """
+        Count per utterance the gold spans, the predicted spans and the matched ones of each entity
+
+        Returns:
+            ndarray: Counts, shape (4, utterances, entities): gold, predicted, matched gold, matched predicted
+        """
+        gold = np.array(self.gold_spans, dtype=np.int64).reshape(-1, 4)
+        predicted = np.array(self.predicted_spans, dtype=np.int64).reshape(-1, 4)
+        entity_count = len(self.entities)
+
+        def key(spans):
+            return np.column_stack((spans[:, 0] * entity_count + spans[:, 1], spans[:, 2], spans[:, 3]))
+
+        gold_matched, predicted_matched = match_spans(key(gold), key(predicted))
+        size = len(self) * entity_count
+        counts = np.stack([
+            np.bincount(gold[:, 0] * entity_count + gold[:, 1], minlength=size),
+            np.bincount(predicted[:, 0] * entity_count + predicted[:, 1], minlength=size),
+            np.bincount(gold[gold_matched, 0] * entity_count + gold[gold_matched, 1], minlength=size),
+            np.bincount(predicted[predicted_matched, 0] * entity_count + predicted[predicted_matched, 1], minlength=size),
+        ])
+        return counts.reshape(4, len(self), entity_count)
+
+    def confusion_matrix(self):
+        """
+        Intent confusion matrix, rows are the true intents and columns the predicted ones
+
+        Returns:
+            ndarray: Confusion matrix, shape (intents, intents)
+        """
+        count = len(self.intents)
+        cells = np.array(self.true_intents, dtype=np.int64) * count + np.array(self.predicted_intents, dtype=np.int64)
+        return np.bincount(cells, minlength=count * count).reshape(count, count)
+
+    @staticmethod
+    def entity_scores(totals):
+        """
+        Precision, recall and F1 of entities from summed counts
+
+        Args:
+            totals (ndarray): Counts summed over utterances, shape (..., 4, entities)
+
+        Returns:
+            tuple: precision, recall, f1
+        """
+        precision = safe_divide(totals[..., 3, :], totals[..., 1, :])
+        recall = safe_divide(totals[..., 2, :], totals[..., 0, :])
+        return precision, recall, get_f1(precision, recall)
+
+    def bootstrap(self, counts, samples=1000, confidence=0.95, seed=None, batch=100):
+        """
+        Bootstrap confidence intervals of the intent accuracy and of the entity F1 scores
+
+        Each sample draws the utterances with replacement, it is represented by the number
+        of times each utterance is drawn, so sample metrics are weighted sums of the counts.
+
+        Args:
+            counts (ndarray): Entity counts per utterance, see get_counts
+            samples (int, optional): Number of bootstrap samples. Defaults to 1000
+            confidence (float, optional): Confidence level. Defaults to 0.95
+            seed (int, optional): Seed of the random generator
+            batch (int, optional): Number of samples drawn at once
+
+        Returns:
+            dict: Lower and upper bounds of "accuracy" and of the "f1" of each entity and "micro"
+        """
+        rng = np.random.default_rng(seed)
+        size = len(self)
+        correct = (np.array(self.true_intents) == np.array(self.predicted_intents)).astype(float)
+        per_utterance = np.concatenate((counts, counts.sum(axis=2, keepdims=True)), axis=2)
+        shape = per_utterance.shape[0], per_utterance.shape[2]
+        # One row per utterance so a batch of samples is a single matrix product
+        per_utterance = per_utterance.transpose(1, 0, 2).reshape(size, -1).astype(float)
+
+        accuracies, f1_scores = [], []
+        for start in range(0, samples, batch):
+            count = min(batch, samples - start)
+            draws = rng.integers(0, size, (count, size)) + np.arange(count)[:, None] * size
+            weights = np.bincount(draws.ravel(), minlength=count * size).reshape(count, size).astype(float)
+            accuracies.append(weights @ correct / size)
+            totals = (weights @ per_utterance).reshape(count, *shape)
+            f1_scores.append(self.entity_scores(totals)[2])
+
+        alpha = (1 - confidence) / 2
+        accuracy_bounds = np.quantile(np.concatenate(accuracies), [alpha, 1 - alpha])
+        f1_bounds = np.quantile(np.concatenate(f1_scores), [alpha, 1 - alpha], axis=0)
+        return {
+            "accuracy": accuracy_bounds.tolist(),
+            "f1": {entity: f1_bounds[:, index].tolist() for index, entity in enumerate(self.entities + ["micro"])},
+        }
+
+    def compute(self, samples=1000, confidence=0.95, seed=None):
+        """
+        Compute the metrics
+
+        Args:
+            samples (int, optional): Number of bootstrap samples, 0 to skip confidence intervals. Defaults to 1000
+            confidence (float, optional): Confidence level. Defaults to 0.95
+            seed (int, optional): Seed of the bootstrap
+
+        Returns:
+            dict: Metrics
+        """
+        if not len(self):
+            raise ValueError("No prediction to evaluate")
+
+        intents = list(self.intents)
+        confusion = self.confusion_matrix()
+        true_positive = np.diag(confusion)
+        intent_precision = safe_divide(true_positive, confusion.sum(axis=0))
+        intent_recall = safe_divide(true_positive, confusion.sum(axis=1))
+        intent_f1 = get_f1(intent_precision, intent_recall)
+
+        counts = self.get_counts()
+        totals = counts.sum(axis=1)
+        totals = np.concatenate((totals, totals.sum(axis=1, keepdims=True)), axis=1)
+        precision, recall, f1 = self.entity_scores(totals)
+
+        metrics = {
+            "utterances": len(self),
+            "intent": {
+                "accuracy": float(true_positive.sum() / len(self)),
+                "labels": intents,
+                "confusion_matrix": confusion.tolist(),
+                "scores": {
+                    intent: {
+                        "precision": float(intent_precision[index]),
+                        "recall": float(intent_recall[index]),
+                        "f1": float(intent_f1[index]),
+                        "support": int(confusion[index].sum()),
+                    } for index, intent in enumerate(intents)},
+            },
+            "entities": {
+                entity: {
+                    "precision": float(precision[index]),
+                    "recall": float(recall[index]),
+                    "f1": float(f1[index]),
+                    "support": int(totals[0, index]),
+                    "predicted": int(totals[1, index]),
+                } for index, entity in enumerate(self.entities + ["micro"])},
+        }
+
+        if samples:
+            intervals = self.bootstrap(counts, samples, confidence, seed)
+            metrics["confidence"] = confidence
+            metrics["intent"]["accuracy_interval"] = intervals["accuracy"]
+            for entity, interval in intervals["f1"].items():
+                metrics["entities"][entity]["f1_interval"] = interval
+        return metrics
+
+    def save(self, folder, samples=1000, confidence=0.95, seed=None):
+        """
+        Write the metrics in folder: evaluation.json, metrics.csv (one row per intent and entity)
+        and confusion_matrix.csv
+
+        Args:
+            folder (string): Destination folder
+            samples (int, optional): Number of bootstrap samples. Defaults to 1000
+            confidence (float, optional): Confidence level. Defaults to 0.95
+            seed (int, optional): Seed of the bootstrap
+
+        Returns:
+            dict: Metrics
+        """
+        metrics = self.compute(samples, confidence, seed)
+        with open(os.path.join(folder, 'evaluation.json'), 'w') as json_file:
+            json.dump(metrics, json_file, indent=2)
+
+        with open(os.path.join(folder, 'metrics.csv'), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['type', 'label', 'precision', 'recall', 'f1', 'support', 'f1_low', 'f1_high'])
+            for intent, scores in metrics["intent"]["scores"].items():
+                writer.writerow(['intent', intent, scores["precision"], scores["recall"], scores["f1"],
+                                 scores["support"], '', ''])
+            for entity, scores in metrics["entities"].items():
+                low, high = scores.get("f1_interval", ['', ''])
+                writer.writerow(['entity', entity, scores["precision"], scores["recall"], scores["f1"],
+                                 scores["support"], low, high])
+
+        with open(os.path.join(folder, 'confusion_matrix.csv'), 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            labels = metrics["intent"]["labels"]
+            writer.writerow(['true/predicted'] + labels)
+            for label, row in zip(labels, metrics["intent"]["confusion_matrix"]):
+                writer.writerow([label] + row)
+        return metrics
@@ -0,0 +1,389 @@
+from aiohttp import web
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+
+# Labels
+labels = ['dst_city','or_city','str_date','end_date','budget']
+
+MONTHS = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+          'august', 'september', 'october', 'november', 'december']
+
+DATE_PATTERN = re.compile(
+    r"\b(?:(?P<iso>\d{4}-\d{2}-\d{2})"
+    r"|(?:(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday),?\s+)?"
+    r"(?:(?P<month>" + "|".join(MONTHS) + r")\s+(?P<day>\d{1,2})(?:st|nd|rd|th)?"
+    r"|(?P<day2>\d{1,2})(?:st|nd|rd|th)?\s+of\s+(?P<month2>" + "|".join(MONTHS) + r"))"
+    r"(?:,?\s+(?P<year>\d{4}))?)\b", re.IGNORECASE)
+
+MONEY_PATTERN = re.compile(
+    r"(?:\$\s?\d[\d,]*(?:\.\d+)?(?:\s?usd)?|\b\d[\d,]*(?:\.\d+)?\s?(?:usd|dollars)\b"
+    r"|(?<=budget of )\d[\d,]*|(?<=budget is )\d[\d,]*)", re.IGNORECASE)
+
+ORIGIN_PATTERN = re.compile(r"(?:from|leaving|departing|leave)\s+(?:from\s+)?$", re.IGNORECASE)
+DESTINATION_PATTERN = re.compile(r"(?:to|for|visit|in)\s+$", re.IGNORECASE)
+END_DATE_PATTERN = re.compile(r"(?:to|and|until|returning|return|back)\s+(?:on\s+)?$", re.IGNORECASE)
+
+def get_json(filename):
+    """Load JSON file
+    Args:
+        filename (string): JSON filename
+
+    Returns:
+        list: JSON file content
+    """
+    with open(filename, "r") as jsonfile:
+        content = json.load(jsonfile)
+    return content
+
+def get_timex(match):
+    """
+    Build the timex of a date found by DATE_PATTERN
+
+    Args:
+        match (re.Match): date match
+
+    Returns:
+        string: timex, XXXX is used for the year when it's not given
+    """
+    if match.group('iso'):
+        return match.group('iso')
+
+    month = match.group('month') or match.group('month2')
+    day = match.group('day') or match.group('day2')
+    year = match.group('year') or 'XXXX'
+    return f"{year}-{MONTHS.index(month.lower()) + 1:02d}-{int(day):02d}"
+
+class StandInModel:
+    def __init__(self, model_file=None, dataset_files=()):
+        """
+        Rule based stand-in for the LUIS Fly Me model
+
+        Utterances found in the datasets are answered with their labels,
+        other utterances are labeled with rules built from the model closed lists and the dataset cities.
+
+        Args:
+            model_file (string, optional): LUIS application JSON (cognitiveModels/FlightBooking.json)
+            dataset_files (list, optional): LUIS JSON files (frames_train.json, frames_test.json)
+        """
+        self.known = {}
+        cities = set()
+        self.intents = {"book", "None"}
+
+        if model_file:
+            model = get_json(model_file)
+            self.intents.update(intent['name'] for intent in model['intents'])
+            for closed_list in model['closedLists']:
+                for sub_list in closed_list['subLists']:
+                    cities.add(sub_list['canonicalForm'].lower())
+                    cities.update(synonym.lower() for synonym in sub_list['list'])
+            for utterance in model['utterances']:
+                entities = [{'entityName': entity['entity'], 'startCharIndex': entity['startPos'],
+                             'endCharIndex': entity['endPos'] + 1} for entity in utterance['entities']]
+                self.add_known(utterance['text'], utterance['intent'], entities)
+
+        for dataset_file in dataset_files:
+            for utterance in get_json(dataset_file):
+                self.add_known(utterance['text'], utterance['intentName'], utterance['entityLabels'])
+                for label in utterance['entityLabels']:
+                    if label['entityName'] in ('dst_city', 'or_city'):
+                        text = utterance['text'][label['startCharIndex']:label['endCharIndex']]
+                        cities.add(text.lower())
+
+        # Longest cities first so "new york city" wins over "new york"
+        names = sorted((city for city in cities if city), key=len, reverse=True)
+        self.city_pattern = re.compile(
+            r"(?<!\w)(?:" + "|".join(re.escape(city) for city in names) + r")(?!\w)", re.IGNORECASE
+        ) if names else None
+
+    def add_known(self, text, intent, entity_labels):
+        """
+        Add a labeled utterance
+
+        Args:
+            text (string): sentence
+            intent (string): intent name
+            entity_labels (list): entities with character positions
+        """
+        self.intents.add(intent)
+        self.known[text.strip().lower()] = (intent, [
+            {'type': label['entityName'], 'start': label['startCharIndex'], 'end': label['endCharIndex']}
+            for label in entity_labels if label['entityName'] in labels
+        ])
+
+    def analyze(self, query):
+        """
+        Get intent and entities of a sentence
+
+        Args:
+            query (string): sentence
+
+        Returns:
+            tuple: intent, score and list of entities (type, text, start, end, timex)
+        """
+        known = self.known.get(query.strip().lower())
+        if known is not None:
+            intent, entities = known
+            score = 0.98
+        else:
+            intent, entities = self.apply_rules(query)
+            score = 0.85 if entities else 0.6
+
+        result = []
+        for entity in entities:
+            entity = dict(entity, text=query[entity['start']:entity['end']])
+            if entity['type'] in ('str_date', 'end_date'):
+                match = DATE_PATTERN.search(entity['text'])
+                entity['timex'] = get_timex(match) if match else None
+            result.append(entity)
+        return intent, score, result
+
+    def apply_rules(self, query):
+        """
+        Label a sentence that is not in the datasets
+
+        Args:
+            query (string): sentence
+
+        Returns:
+            tuple: intent and list of entities with character positions
+        """
+        if query.strip().lower() in ("cancel", "quit", "ignore"):
+            return "Cancel", []
+
+        entities = []
+        if self.city_pattern is not None:
+            for match in self.city_pattern.finditer(query):
+                before = query[:match.start()]
+                if ORIGIN_PATTERN.search(before):
+                    entity_type = 'or_city'
+                elif DESTINATION_PATTERN.search(before) or not any(e['type'] == 'dst_city' for e in entities):
+                    entity_type = 'dst_city'
+                else:
+                    entity_type = 'or_city'
+                entities.append({'type': entity_type, 'start': match.start(), 'end': match.end()})
+
+        for match in DATE_PATTERN.finditer(query):
+            has_start = any(e['type'] == 'str_date' for e in entities)
+            entity_type = 'end_date' if has_start and END_DATE_PATTERN.search(query[:match.start()]) else 'str_date'
+            entities.append({'type': entity_type, 'start': match.start(), 'end': match.end()})
+
+        for match in MONEY_PATTERN.finditer(query):
+            entities.append({'type': 'budget', 'start': match.start(), 'end': match.end()})
+
+        return ("book" if entities else "None"), entities
+
+    def all_intents(self, intent, score):
+        """
+        Get the score of every intent
+
+        Args:
+            intent (string): top intent
+            score (float): top intent score
+
+        Returns:
+            dict: score by intent name
+        """
+        others = (1.0 - score) / max(len(self.intents) - 1, 1)
+        return {name: (score if name == intent else others) for name in sorted(self.intents)}
+
+def v3_response(model, query, verbose=True, show_all_intents=True):
+    """
+    Build a LUIS v3 prediction response
+
+    Args:
+        model (StandInModel): stand-in model
+        query (string): sentence
+        verbose (bool, optional): add $instance metadata. Defaults to True
+        show_all_intents (bool, optional): return all intents. Defaults to True
+
+    Returns:
+        dict: prediction response
+    """
+    intent, score, entities = model.analyze(query)
+    intents = model.all_intents(intent, score) if show_all_intents else {intent: score}
+
+    prediction_entities = {}
+    instances = {}
+    for entity in entities:
+        prediction_entities.setdefault(entity['type'], []).append(entity['text'])
+        instances.setdefault(entity['type'], []).append({
+            "type": entity['type'],
+            "text": entity['text'],
+            "startIndex": entity['start'],
+            "length": entity['end'] - entity['start'],
+            "score": score,
+            "modelTypeId": 1,
+            "modelType": "Entity Extractor",
+            "recognitionSources": ["model"],
+        })
+        if entity.get('timex'):
+            prediction_entities.setdefault("datetimeV2", []).append({
+                "type": "date",
+                "values": [{"timex": entity['timex'], "resolution": [{"value": entity['timex']}]}],
+            })
+
+    if verbose:
+        prediction_entities["$instance"] = instances
+
+    return {
+        "query": query,
+        "prediction": {
+            "topIntent": intent,
+            "intents": {name: {"score": value} for name, value in intents.items()},
+            "entities": prediction_entities,
+        },
+    }
+
+def v2_response(model, query, verbose=False):
+    """
+    Build a LUIS v2 prediction response, as used by the bot LuisRecognizer
+
+    Args:
+        model (StandInModel): stand-in model
+        query (string): sentence
+        verbose (bool, optional): return all intents. Defaults to False
+
+    Returns:
+        dict: prediction response
+    """
+    intent, score, entities = model.analyze(query)
+
+    luis_entities = []
+    for entity in entities:
+        luis_entities.append({
+            "entity": entity['text'].lower(),
+            "type": entity['type'],
+            "startIndex": entity['start'],
+            "endIndex": entity['end'] - 1,
+            "score": score,
+        })
+        if entity.get('timex'):
+            luis_entities.append({
+                "entity": entity['text'].lower(),
+                "type": "builtin.datetimeV2.date",
+                "startIndex": entity['start'],
+                "endIndex": entity['end'] - 1,
+                "resolution": {"values": [{"timex": entity['timex'], "type": "date", "value": entity['timex']}]},
+            })
+
+    response = {
+        "query": query,
+        "topScoringIntent": {"intent": intent, "score": score},
+        "entities": luis_entities,
+    }
+    if verbose:
+        response["intents"] = [{"intent": name, "score": value}
+                               for name, value in sorted(model.all_intents(intent, score).items(), key=lambda item: -item[1])]
+    return response
+
+def create_app(model, latency=0, jitter=0, error_rate=0.0, error_status=503, seed=None):
+    """
+    Create the stand-in LUIS prediction server
+
+    Args:
+        model (StandInModel): stand-in model
+        latency (float, optional): Injected latency in ms. Defaults to 0
+        jitter (float, optional): Random latency added to each response in ms. Defaults to 0
+        error_rate (float, optional): Proportion of requests answered with error_status. Defaults to 0
+        error_status (int, optional): HTTP status of injected errors. Defaults to 503
+        seed (int, optional): Random seed for reproducible runs
+
+    Returns:
+        web.Application: aiohttp application
+    """
+    rand = random.Random(seed)
+
+    async def fail_or_none():
+        delay = (latency + rand.uniform(0, jitter)) / 1000.0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if error_rate and rand.random() < error_rate:
+            return web.json_response(
+                {"error": {"code": str(error_status), "message": "Injected error"}}, status=error_status)
+        return None
+
+    async def predict_v3(request):
+        error = await fail_or_none()
+        if error is not None:
+            return error
+
+        if request.method == "POST":
+            body = await request.json()
+            query = body.get("query", "")
+            options = body.get("options", {})
+            show_all_intents = options.get("showAllIntents", False)
+            verbose = request.query.get("verbose", "false").lower() == "true"
+        else:
+            query = request.query.get("query", "")
+            show_all_intents = request.query.get("show-all-intents", "false").lower() == "true"
+            verbose = request.query.get("verbose", "false").lower() == "true"
+        return web.json_response(v3_response(model, query, verbose, show_all_intents))
+
+    async def predict_v2(request):
+        error = await fail_or_none()
+        if error is not None:
+            return error
+
+        if request.method == "POST":
+            query = await request.json()
+        else:
+            query = request.query.get("q", "")
+        verbose = request.query.get("verbose", "false").lower() == "true"
+        return web.json_response(v2_response(model, query, verbose))
+
+    app = web.Application()
+    app.router.add_route("*", "/luis/prediction/v3.0/apps/{app_id}/slots/{slot}/predict", predict_v3)
+    app.router.add_route("*", "/luis/v2.0/apps/{app_id}", predict_v2)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in LUIS prediction server')
+
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+
+    help_model = """
+    LUIS application JSON file. Default: cognitiveModels/FlightBooking.json of the bot
+    """
+
+    help_data = """
+    LUIS JSON files whose utterances are answered with their labels. Default: frames/frames_train.json frames/frames_test.json
+    """
+
+    help_latency = """
+    Latency added to every response in ms. Default 0
+    """
+
+    help_jitter = """
+    Random latency between 0 and jitter ms added to every response. Default 0
+    """
+
+    help_error_rate = """
+    Proportion of requests (0.0 to 1.0) answered with an error. Default 0
+    """
+
+    parser.add_argument("--host", dest='host', type=str, default="localhost")
+    parser.add_argument("--port", dest='port', type=int, default=8080)
+    parser.add_argument("--model", dest='model_file', type=str,
+                        default=os.path.join(tools_dir, "../../P10_01_applicationweb/cognitiveModels/FlightBooking.json"),
+                        help=help_model)
+    parser.add_argument("--data", dest='dataset_files', type=str, nargs='*',
+                        default=[os.path.join(tools_dir, "frames/frames_train.json"),
+                                 os.path.join(tools_dir, "frames/frames_test.json")],
+                        help=help_data)
+    parser.add_argument("--latency", dest='latency', type=float, default=0, help=help_latency)
+    parser.add_argument("--jitter", dest='jitter', type=float, default=0, help=help_jitter)
+    parser.add_argument("--error-rate", dest='error_rate', type=float, default=0.0, help=help_error_rate)
+    parser.add_argument("--error-status", dest='error_status', type=int, default=503)
+    parser.add_argument("--seed", dest='seed', type=int)
+    args = parser.parse_args()
+
+    model_file = args.model_file if os.path.isfile(args.model_file) else None
+    dataset_files = [filename for filename in args.dataset_files if os.path.isfile(filename)]
+
+    model = StandInModel(model_file, dataset_files)
+    app = create_app(model, args.latency, args.jitter, args.error_rate, args.error_status, args.seed)
+    web.run_app(app, host=args.host, port=args.port)
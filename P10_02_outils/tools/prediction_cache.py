@@ -0,0 +1,119 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class PredictionCache:
+    def __init__(self, filename, max_size=64 * 1024 * 1024):
+        """
+        On-disk cache of raw LUIS predictions stored in SQLite
+
+        Least recently used predictions are evicted when the stored responses exceed max_size
+
+        Args:
+            filename (string): SQLite database filename
+            max_size (int, optional): Maximum size of stored responses in bytes. Defaults to 64MB
+        """
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS predictions (
+                key TEXT PRIMARY KEY,
+                app_id TEXT,
+                slot TEXT,
+                version TEXT,
+                query TEXT,
+                response TEXT,
+                size INTEGER,
+                accessed REAL
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS predictions_accessed ON predictions (accessed)")
+        self.connection.commit()
+
+    @staticmethod
+    def key(app_id, slot, version, query, params):
+        """
+        Build the cache key of a prediction request
+
+        Args:
+            app_id (string): LUIS application ID
+            slot (string): Publishing slot
+            version (string): Model version
+            query (string): Sentence
+            params (dict): Request parameters, without the subscription key
+
+        Returns:
+            string: cache key
+        """
+        content = json.dumps([app_id, slot, version, query, params], sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Get a cached prediction
+
+        Args:
+            key (string): cache key
+
+        Returns:
+            dict: prediction or None if not cached
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM predictions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE predictions SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+        return json.loads(row[0])
+
+    def set(self, key, app_id, slot, version, query, prediction):
+        """
+        Store a prediction and evict old ones if the cache is full
+
+        Args:
+            key (string): cache key
+            app_id (string): LUIS application ID
+            slot (string): Publishing slot
+            version (string): Model version
+            query (string): Sentence
+            prediction (dict): raw LUIS prediction
+        """
+        response = json.dumps(prediction)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, app_id, slot, version, query, response, len(response), time.time()))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        """
+        Remove least recently used predictions until the cache fits in max_size
+        """
+        size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM predictions").fetchone()[0]
+        if size <= self.max_size:
+            return
+
+        rows = self.connection.execute(
+            "SELECT key, size FROM predictions ORDER BY accessed").fetchall()
+        evicted = []
+        for key, row_size in rows:
+            if size <= self.max_size:
+                break
+            evicted.append((key,))
+            size -= row_size
+        self.connection.executemany("DELETE FROM predictions WHERE key = ?", evicted)
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self.lock:
+            self.connection.close()
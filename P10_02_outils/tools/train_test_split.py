@@ -3,11 +3,106 @@ import os
 import json
 import os.path
 import math
+import random
+import re
 import sys
+from array import array
+from difflib import SequenceMatcher
+from itertools import islice
+from multiprocessing import Pool
 
 # Intent labels
 labels = ['dst_city','or_city','str_date','end_date','budget']
 
+# Minimum similarity of a fuzzy match between an entity value and words of the sentence
+FUZZY_THRESHOLD = 0.8
+WORD_PATTERN = re.compile(r'\w+')
+
+class EntitySpanLocator:
+    """
+    Locate the entity values of a sentence, which is normalized once.
+
+    All the values are searched at once, as whole words, with one regular expression.
+    Values not found as words are searched as substrings, then by fuzzy matching on words.
+    """
+
+    def __init__(self, text):
+        """
+        Args:
+            text (string): sentence
+        """
+        self.text = text
+        self.lowered = text.lower()
+        self._words = None
+
+    def find_all(self, values):
+        """
+        Find every occurrence of values
+
+        Args:
+            values (list): entity values
+
+        Returns:
+            dic: start and end positions of the occurrences, by lowered value
+        """
+        spans = {}
+        patterns = sorted({value.lower() for value in values if value.strip()}, key=len, reverse=True)
+        if patterns:
+            matcher = re.compile(r'(?<!\w)(?:' + '|'.join(map(re.escape, patterns)) + r')(?!\w)')
+            for match in matcher.finditer(self.lowered):
+                spans.setdefault(match.group(), []).append((match.start(), match.end()))
+
+        for value in patterns:
+            if value not in spans:
+                spans[value] = self._find_substring(value) or self._find_fuzzy(value)
+        return spans
+
+    def _find_substring(self, value):
+        spans = []
+        start = self.lowered.find(value)
+        while start >= 0:
+            spans.append((start, start + len(value)))
+            start = self.lowered.find(value, start + 1)
+        return spans
+
+    def _find_fuzzy(self, value):
+        """Return the span of the words most similar to a value, if similar enough"""
+        if self._words is None:
+            self._words = [match.span() for match in WORD_PATTERN.finditer(self.lowered)]
+        size = len(WORD_PATTERN.findall(value)) or 1
+        best, best_ratio = None, FUZZY_THRESHOLD
+        for length in (size - 1, size, size + 1):
+            for index in range(len(self._words) - length + 1 if length > 0 else 0):
+                start, end = self._words[index][0], self._words[index + length - 1][1]
+                ratio = SequenceMatcher(None, self.lowered[start:end], value).ratio()
+                if ratio > best_ratio:
+                    best, best_ratio = (start, end), ratio
+        return [best] if best else []
+
+    def locate(self, args):
+        """
+        Locate the entities of a turn, each one on its own occurrence of its value
+
+        Args:
+            args (list): definitions of the entities ({'key': name, 'val': value})
+
+        Returns:
+            list: Entity label or None for each definition
+        """
+        spans = self.find_all([arg['val'] for arg in args])
+        used = []
+        entity_labels = []
+        for arg in args:
+            entity_label = None
+            for start, end in spans.get(arg['val'].lower(), []):
+                # Labels of a sentence cannot overlap
+                if all(end <= other_start or start >= other_end for other_start, other_end in used):
+                    used.append((start, end))
+                    entity_label = {'startCharIndex': start, 'endCharIndex': end, 'entityName': arg['key']}
+                    break
+            entity_labels.append(entity_label)
+        return entity_labels
+
 def get_entity_index(text, char):
     """
     Get position (start/end) of a substring
@@ -16,11 +111,16 @@ def get_entity_index(text, char):
         text (string): sentence
         char (string): substring to find position
 
+    Raises:
+        ValueError: Substring not found
+
     Returns:
         dic: start and end position
     """
-    start = text.lower().index(char.lower())
-    end = start + len(char)
+    spans = EntitySpanLocator(text).find_all([char]).get(char.lower())
+    if not spans:
+        raise ValueError("substring not found")
+    start, end = spans[0]
     return {'start': start, 'end': end}
 
 def get_entity(arg, text):
@@ -34,23 +134,22 @@ def get_entity(arg, text):
     Returns:
         dic: Entity name and position in sentence
     """
-    entity_label = {}
+    if not is_wanted_entity(arg):
+        return {}
 
-    # Only wanted entities
-    try:
-        if arg['val'] == "-1":
-            return entity_label
+    return EntitySpanLocator(text).locate([arg])[0] or {}
 
-        if arg['key'] in labels:
-            char_index = get_entity_index(text, arg['val'])
-            entity_label['startCharIndex'] = char_index['start']
-            entity_label['endCharIndex'] = char_index['end']
-            entity_label['entityName'] = arg['key']
-    except KeyError:
-        entity_label = {}
+def is_wanted_entity(arg):
+    """
+    Check if an argument is an entity to label
 
+    Args:
+        arg (array): definition of the entity
 
-    return entity_label
+    Returns:
+        bool: True for the entities of the model with a value
+    """
+    return 'val' in arg and arg['val'] != "-1" and arg.get('key') in labels
 
 def save_intents(outputfile, intents):
     """
@@ -75,7 +174,7 @@ def get_intents(turn, intent_text):
         [type]: [description]
     """
 
-    entity_labels = []
+    args = []
     intent_name = ""
 
     for act in turn['labels']['acts']:
@@ -85,54 +184,294 @@ def get_intents(turn, intent_text):
                 intent_name = arg['val']
                 continue
 
-            # Get entities
-            entity_label = get_entity(arg, intent_text)
-            if entity_label:
-                entity_labels.append(entity_label)
+            if is_wanted_entity(arg):
+                args.append(arg)
+
+    # Get entities, all at once
+    entity_labels = [
+        entity_label for entity_label in EntitySpanLocator(intent_text).locate(args) if entity_label]
 
     if not intent_name:
         intent_name = "book"
 
     return intent_name, entity_labels
 
-def convert_to_luis(filename, destination, train_size):
+class JsonArrayWriter:
     """
-    Convert JSON into LUIS Json
+    Write a JSON array one item at a time, in the format of json.dump
+    """
+
+    def __init__(self, outputfile):
+        """
+        Args:
+            outputfile (string): Destination filename
+        """
+        self.outputfile = outputfile
+        self.count = 0
+        self.fp = open(outputfile, 'w')
+        self.fp.write('[')
+
+    def write(self, item):
+        """
+        Append an item to the array
+
+        Args:
+            item (json): Data
+        """
+        if self.count:
+            self.fp.write(', ')
+        json.dump(item, self.fp)
+        self.count += 1
+
+    def close(self):
+        self.fp.write(']')
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def read_conversations(filename, chunk_size=65536):
+    """
+    Read conversations one at a time from a JSON array or a JSONL file,
+    only one conversation is kept in memory
 
     Args:
-        filename (string): JSON source filename
-        destination (string): Folder destination for converted file
+        filename (string): JSON or JSONL filename
+        chunk_size (int): Number of characters read at once
+
+    Yields:
+        json: Conversation
     """
+    decoder = json.JSONDecoder()
     with open(filename) as json_file:
-        data = json.load(json_file)
+        buffer = json_file.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            # JSONL, one conversation per line
+            json_file.seek(0)
+            for line in json_file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        position = 1
+        eof = False
+        while True:
+            # Skip the separator before the next conversation
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if buffer.startswith(']', position):
+                return
+            try:
+                conversation, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The conversation continues in the next chunk
+                if eof:
+                    raise
+                chunk = json_file.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield conversation
 
-    intents_test = []
-    intents_train = []
+def convert_intent(conversation):
+    """
+    Convert a conversation into a LUIS intent
 
-    stop_train = math.floor(len(data) * train_size)
+    Args:
+        conversation (json): Conversation
 
-    for conversation in data:
-        # Get the first turn
-        turn =  conversation['turns'][0]
-        intent = {}
-        intent['text'] = turn['text']
-        intent['intentName'], entity_labels = get_intents(turn, intent['text'])
-        intent['entityLabels'] = entity_labels
+    Returns:
+        dic: Text, intent name and entity labels of the first turn
+    """
+    # Get the first turn
+    return convert_turn(conversation['turns'][0])
 
-        if stop_train <= 0:
-            intents_test.append(intent)
-        else:
-            intents_train.append(intent)
-        stop_train -= 1
+def convert_turn(turn):
+    """
+    Convert a turn into a LUIS intent
 
-    # Save new JSON file
-    outputfile = os.path.join(destination, 'frames_test.json')
-    save_intents(outputfile, intents_test)
-    print(f"New file generated {outputfile} with {len(intents_test)} records on {len(data)}")
+    Args:
+        turn (json): Turn of a conversation
 
-    outputfile = os.path.join(destination, 'frames_train.json')
-    save_intents(outputfile, intents_train)
-    print(f"New file generated {outputfile} with {len(intents_train)} records on {len(data)}")
+    Returns:
+        dic: Text, intent name and entity labels of the turn
+    """
+    intent = {}
+    intent['text'] = turn['text']
+    intent['intentName'], entity_labels = get_intents(turn, intent['text'])
+    intent['entityLabels'] = entity_labels
+    return intent
+
+def convert_intents(conversations, pool=None, window=10000, chunksize=100):
+    """
+    Convert conversations into LUIS intents, in order
+
+    Args:
+        conversations (iterable): Conversations
+        pool (Pool): Process pool converting the conversations, None to convert them in this process
+        window (int): Maximum number of conversations sent to the pool at once
+        chunksize (int): Number of conversations sent to a process at once
+
+    Yields:
+        dic: LUIS intent
+    """
+    if pool is None:
+        yield from map(convert_intent, conversations)
+        return
+
+    # Pool.imap would read the whole source ahead, it is given one window at a time instead.
+    # Only the first turns are converted, so only they are sent to the processes.
+    turns = (conversation['turns'][0] for conversation in conversations)
+    while True:
+        batch = list(islice(turns, window))
+        if not batch:
+            return
+        yield from pool.imap(convert_turn, batch, chunksize)
+
+def get_stratum(conversation):
+    """
+    Get the stratum of a conversation: the combination of entities labeled in its first turn
+
+    Args:
+        conversation (json): Conversation
+
+    Returns:
+        tuple: Sorted entity names
+    """
+    turn = conversation['turns'][0]
+    return tuple(sorted({
+        arg['key'] for act in turn['labels']['acts'] for arg in act['args'] if is_wanted_entity(arg)}))
+
+def get_train_counts(sizes, train_size, rand=None):
+    """
+    Split the size of the train set between groups, with the largest remainder method
+
+    Each group gets the floor of its share, the conversations left go to the groups with the
+    largest remainders, so the train set has floor(total * train_size) conversations.
+
+    Args:
+        sizes (list): Number of conversations of each group
+        train_size (float): Proportion of the train set
+        rand (Random): Generator breaking the ties between equal remainders, None for the group order
+
+    Returns:
+        list: Number of train conversations of each group
+    """
+    quotas = [size * train_size for size in sizes]
+    counts = [math.floor(quota) for quota in quotas]
+    missing = math.floor(sum(sizes) * train_size) - sum(counts)
+    order = list(range(len(sizes)))
+    if rand is not None:
+        rand.shuffle(order)
+    # The sort is stable, equal remainders keep the shuffled order
+    order.sort(key=lambda group: quotas[group] - counts[group], reverse=True)
+    for group in order[:max(missing, 0)]:
+        counts[group] += 1
+    return counts
+
+def get_assignments(total, train_size, seed=None, strata=None, folds=0):
+    """
+    Assign each conversation to the train set (1) or the test set (0), or to a fold (0 to folds - 1)
+
+    Without seed, conversations are taken in file order, e.g the first ones go to the train set.
+    With a seed, they are shuffled first. With strata, each combination of entities is split
+    in the same proportions, as far as its size allows: the sizes are rounded so that the
+    whole train set and the folds keep their size.
+
+    Args:
+        total (int): Number of conversations
+        train_size (float): Proportion of the train set
+        seed (int): Seed of the shuffle, None to keep the file order
+        strata (list): Stratum of each conversation, None not to stratify
+        folds (int): Number of folds, 0 for a train/test split
+
+    Returns:
+        array: Assignment of each conversation
+    """
+    if strata is None:
+        groups = [array('i', range(total))]
+    else:
+        by_stratum = {}
+        for index, stratum in enumerate(strata):
+            by_stratum.setdefault(stratum, array('i')).append(index)
+        groups = sorted(by_stratum.values(), key=lambda indexes: indexes[0])
+
+    rand = random.Random(seed)
+    train_counts = get_train_counts([len(indexes) for indexes in groups], train_size,
+                                    rand if seed is not None else None)
+    assignments = array('i', bytes(4 * total))
+    # Folds continue from a group to the next one, so small groups do not all go to the first folds
+    offset = 0
+    for indexes, stop_train in zip(groups, train_counts):
+        if seed is not None:
+            rand.shuffle(indexes)
+        for rank, index in enumerate(indexes):
+            assignments[index] = (offset + rank) % folds if folds else int(rank < stop_train)
+        offset += len(indexes)
+    return assignments
+
+def convert_to_luis(filename, destination, train_size, workers=1, seed=None, stratify=False, folds=0):
+    """
+    Convert JSON into LUIS Json
+
+    The source is read twice, once to count the conversations (and get their strata) and once
+    to convert them, and the intents are written as they are converted. Only the assignment of
+    each conversation is kept in memory, an array of 4 bytes per conversation, and with stratify
+    the stratum of each conversation while the assignments are computed.
+    In k-fold mode, the train and test sets of every fold are written during the same pass.
+
+    Args:
+        filename (string): JSON or JSONL source filename
+        destination (string): Folder destination for converted file
+        workers (int): Number of processes converting the conversations
+        seed (int): Seed of the shuffle, None to keep the file order
+        stratify (bool): Split each combination of entities in the same proportions
+        folds (int): Number of folds, 0 for a train/test split
+    """
+    if stratify:
+        strata = [get_stratum(conversation) for conversation in read_conversations(filename)]
+        total = len(strata)
+    else:
+        strata = None
+        total = sum(1 for _ in read_conversations(filename))
+    assignments = get_assignments(total, train_size, seed, strata, folds)
+    del strata
+
+    if folds:
+        test_files = [f'frames_test_{fold + 1}.json' for fold in range(folds)]
+        train_files = [f'frames_train_{fold + 1}.json' for fold in range(folds)]
+    else:
+        test_files, train_files = ['frames_test.json'], ['frames_train.json']
+
+    pool = Pool(workers) if workers > 1 else None
+    writers = []
+    try:
+        writers = [JsonArrayWriter(os.path.join(destination, name)) for name in test_files + train_files]
+        test_writers, train_writers = writers[:len(test_files)], writers[len(test_files):]
+        for index, intent in enumerate(convert_intents(read_conversations(filename), pool)):
+            if folds:
+                # Test set of its fold, train set of the others
+                fold = assignments[index]
+                test_writers[fold].write(intent)
+                for other, writer in enumerate(train_writers):
+                    if other != fold:
+                        writer.write(intent)
+            elif assignments[index]:
+                train_writers[0].write(intent)
+            else:
+                test_writers[0].write(intent)
+    finally:
+        for writer in writers:
+            writer.close()
+        if pool is not None:
+            pool.terminate()
+
+    for writer in writers:
+        print(f"New file generated {writer.outputfile} with {writer.count} records on {total}")
 
 def get_train_test_size(train_size, test_size):
     """
@@ -179,7 +518,7 @@ def parse_args(args):
     parser = argparse.ArgumentParser(description='Split json data into train/test data in LUIS format')
 
     help_in = """
-    Filename of data in json format to extract.
+    Filename of data in json format (an array of conversations) or jsonl format (one conversation per line) to extract.
     By default frames/frames.json
     """
 
@@ -203,7 +542,29 @@ def parse_args(args):
     parser.add_argument("--in", dest='input_file', type=str, default="./frames/frames.json", help=help_in)
     parser.add_argument("--test_size", dest='test_size', type=float, help=help_test_size)
     parser.add_argument("--train_size", type=float, help=help_train_size)
+    help_workers = """
+    Number of processes converting the conversations, the output does not depend on it.
+    Default: 1
+    """
+
     parser.add_argument("--out", dest='folder', type=str, default="./frames",help=help_out)
+    help_seed = """
+    Seed used to shuffle the conversations before splitting them. By default they are split in file order.
+    """
+
+    help_stratify = """
+    Split each combination of labeled entities in the same proportions.
+    """
+
+    help_folds = """
+    Number of folds for cross-validation, at least 2. Writes frames_train_<k>.json and frames_test_<k>.json
+    for each fold instead of a single train/test split, test and train sizes are then ignored.
+    """
+
+    parser.add_argument("--workers", dest='workers', type=int, default=1, help=help_workers)
+    parser.add_argument("--seed", dest='seed', type=int, help=help_seed)
+    parser.add_argument("--stratify", dest='stratify', action='store_true', help=help_stratify)
+    parser.add_argument("--folds", dest='folds', type=int, default=0, help=help_folds)
     return parser.parse_args(args)
 
 
@@ -231,4 +592,8 @@ if __name__ == "__main__":
         print(error)
         exit();
 
-    convert_to_luis(args.input_file, args.folder, train_size)
+    if args.folds == 1 or args.folds < 0:
+        print("The number of folds should be at least 2")
+        exit();
+
+    convert_to_luis(args.input_file, args.folder, train_size, args.workers, args.seed, args.stratify, args.folds)